@@ -0,0 +1,301 @@
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches as django_caches
+from django.db import connection
+
+from .constants import (
+    CATALOG_VERSION_CHECK_INTERVAL,
+    SUBSTITUTES_REQUESTS_FLUSH_INTERVAL,
+    SUBSTITUTES_REQUESTS_MAX_KEYS,
+)
+
+
+class LRUCache:
+    """Cache of a process with a bounded size (the Least Recently Used entry is
+    evicted first) and a time to live.
+    Each entry is stored with the version of the catalog it was computed with.
+    An entry of another version is a miss."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl  # Seconds
+        self._entries = OrderedDict()  # key => (catalog_version, expiry, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, catalog_version: int):
+        """Return the value of the key or None if it is not in the cache
+        (or if it is expired or computed with another version of the catalog)."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry_version, expiry, value = entry
+            if entry_version != catalog_version or expiry < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)  # Most recently used
+            self.hits += 1
+            return value
+
+    def set(self, key, catalog_version: int, value):
+        if self.max_size <= 0:  # Cache disabled
+            return
+
+        with self._lock:
+            self._entries[key] = (catalog_version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)  # Least recently used
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        nbr_of_lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / nbr_of_lookups if nbr_of_lookups else 0,
+        }
+
+
+class TieredCache:
+    """Cache with two tiers: the LRUCache of the process, then the Django cache
+    settings.CACHES[alias] shared by all the processes (e.g. Redis or Memcached).
+    The version of the catalog is part of the shared keys: the entries of a previous
+    catalog are never read again (they expire after ttl seconds).
+    The number of requests of each key is counted to know the keys to pre-warm."""
+
+    def __init__(self, name: str, max_size: int, ttl: float, alias: str):
+        self.name = name
+        self.ttl = ttl  # Seconds
+        self.alias = alias  # Empty: no shared tier
+        self.local = LRUCache(max_size, ttl)
+        self._lock = threading.Lock()
+        self.shared_hits = 0
+        self.fills = 0
+        self.fill_time = 0.0  # Seconds
+        self.max_fill_time = 0.0
+        self._requests = Counter()  # key => nbr of requests not yet flushed
+        self._nbr_of_unflushed_requests = 0
+
+    @property
+    def shared(self):
+        return django_caches[self.alias] if self.alias else None
+
+    def _shared_key(self, key, catalog_version: int) -> str:
+        return f"{self.name}:{catalog_version}:{':'.join(str(part) for part in key)}"
+
+    def get_or_fill(self, key: tuple, catalog_version: int, fill):
+        """Return the value of the key: from the local tier, else from the shared tier,
+        else computed by fill() then stored in both tiers (unless it is None)."""
+
+        self._count_request(key)
+        value = self.local.get(key, catalog_version)
+        if value is not None:
+            return value
+
+        if self.shared is not None:
+            value = self.shared.get(self._shared_key(key, catalog_version))
+            if value is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                self.local.set(key, catalog_version, value)
+                return value
+
+        start = time.perf_counter()
+        value = fill()
+        fill_time = time.perf_counter() - start
+        with self._lock:
+            self.fills += 1
+            self.fill_time += fill_time
+            self.max_fill_time = max(self.max_fill_time, fill_time)
+
+        if value is not None:
+            self.set(key, catalog_version, value)
+        return value
+
+    def set(self, key: tuple, catalog_version: int, value):
+        self.local.set(key, catalog_version, value)
+        if self.shared is not None:
+            self.shared.set(self._shared_key(key, catalog_version), value, self.ttl)
+
+    def _count_request(self, key: tuple):
+        with self._lock:
+            self._requests[key] += 1
+            self._nbr_of_unflushed_requests += 1
+            if self.shared is None:
+                if len(self._requests) > 2 * SUBSTITUTES_REQUESTS_MAX_KEYS:
+                    self._requests = Counter(
+                        dict(self._requests.most_common(SUBSTITUTES_REQUESTS_MAX_KEYS))
+                    )
+                return
+            if self._nbr_of_unflushed_requests < SUBSTITUTES_REQUESTS_FLUSH_INTERVAL:
+                return
+            requests, self._requests = self._requests, Counter()
+            self._nbr_of_unflushed_requests = 0
+        self._flush_requests(requests)
+
+    def _flush_requests(self, requests: Counter):
+        """Add the requests counted by the process to the ones of the shared tier.
+        Two processes flushing at the same time may lose a few requests: the counts
+        are only used to choose the keys to pre-warm."""
+
+        requests_key = f"{self.name}:requests"
+        all_requests = Counter(self.shared.get(requests_key, {}))
+        all_requests.update(requests)
+        self.shared.set(
+            requests_key, dict(all_requests.most_common(SUBSTITUTES_REQUESTS_MAX_KEYS)), None
+        )
+
+    def most_requested(self, nbr_of_keys: int) -> list[tuple]:
+        """The nbr_of_keys keys requested the most (by all the processes)."""
+
+        with self._lock:
+            requests = Counter(self._requests)
+        if self.shared is not None:
+            requests.update(self.shared.get(f"{self.name}:requests", {}))
+        return [key for key, _ in requests.most_common(nbr_of_keys)]
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self) -> dict:
+        local_stats = self.local.stats()
+        nbr_of_lookups = local_stats["hits"] + local_stats["misses"]
+        return {
+            **local_stats,
+            "shared_tier": self.alias,
+            "shared_hits": self.shared_hits,
+            "fills": self.fills,
+            # Local or shared hits
+            "hit_rate": (local_stats["hits"] + self.shared_hits) / nbr_of_lookups
+            if nbr_of_lookups
+            else 0,
+            "average_fill_ms": self.fill_time / self.fills * 1000 if self.fills else 0,
+            "max_fill_ms": self.max_fill_time * 1000,
+        }
+
+
+# Ids of the products found by Product.find_original_products (key: mode + keywords)
+search_results_cache = LRUCache(
+    settings.PRODUCTS_SEARCH_CACHE_SIZE, settings.PRODUCTS_SEARCH_CACHE_TTL
+)
+
+# Product and substitutes of Product.find_cached_substitutes
+# (key: (product id, nutriscore grade))
+substitutes_cache = TieredCache(
+    "substitutes",
+    settings.PRODUCTS_SUBSTITUTES_CACHE_SIZE,
+    settings.PRODUCTS_SUBSTITUTES_CACHE_TTL,
+    settings.PRODUCTS_SUBSTITUTES_CACHE_ALIAS,
+)
+
+_catalog_version = None
+_catalog_size = 0
+_catalog_version_checked_at = 0.0
+
+
+def _check_catalog_version():
+    """Read the version of the catalog (and its number of products) from the database
+    at most every CATALOG_VERSION_CHECK_INTERVAL seconds."""
+
+    global _catalog_version, _catalog_size, _catalog_version_checked_at
+    from products.models import CatalogVersion
+
+    now = time.monotonic()
+    if _catalog_version is None or now - _catalog_version_checked_at > CATALOG_VERSION_CHECK_INTERVAL:
+        _catalog_version, _catalog_size = CatalogVersion.current_state()
+        _catalog_version_checked_at = now
+
+
+def get_catalog_version() -> int:
+    """Version of the catalog. The database is queried at most every
+    CATALOG_VERSION_CHECK_INTERVAL seconds."""
+
+    _check_catalog_version()
+    return _catalog_version
+
+
+def get_catalog_size() -> int:
+    """Number of products of the current version of the catalog (0 if unknown)."""
+
+    _check_catalog_version()
+    return _catalog_size
+
+
+def forget_catalog_version():
+    """The next call to get_catalog_version() will query the database."""
+
+    global _catalog_version
+    _catalog_version = None
+
+
+class CatalogIndex:
+    """Index of a process built from the catalog (e.g.: the prefix index of the
+    autocomplete). It is built on first use. When the version of the catalog changes,
+    it is rebuilt in a background thread and the previous index is served until the
+    new one is ready."""
+
+    def __init__(self, name: str, build):
+        """build: function of the version of the catalog returning the index (which has
+        a catalog_version attribute)"""
+
+        self.name = name
+        self.build = build
+        self._index = None
+        self._lock = threading.Lock()
+        self.rebuild: threading.Thread = None  # Background rebuild in progress
+
+    def get(self):
+        catalog_version = get_catalog_version()
+        with self._lock:
+            if self._index is None:
+                self._index = self.build(catalog_version)
+
+            elif self._index.catalog_version != catalog_version and self.rebuild is None:
+                self.rebuild = threading.Thread(
+                    target=self._rebuild, args=(catalog_version,), daemon=True
+                )
+                self.rebuild.start()
+
+            return self._index
+
+    def _rebuild(self, catalog_version: int):
+        """Build the index of a new version of the catalog then swap it with the one
+        served meanwhile."""
+
+        index = None
+        try:
+            index = self.build(catalog_version)
+        except Exception:
+            logging.exception("%s of the version %s not built", self.name, catalog_version)
+        finally:
+            connection.close()  # Connection of this thread
+
+        with self._lock:
+            if index is not None and self._index is not None:
+                self._index = index
+            self.rebuild = None
+
+    def reset(self):
+        with self._lock:
+            self._index = None
@@ -1,4 +1,13 @@
+AUTOCOMPLETE_MAX_SUGGESTIONS = 10
+AUTOCOMPLETE_PRECOMPUTED_PREFIX_LENGTH = 2  # Suggestions of prefixes of 1 or 2 letters
+BATCH_SEARCH_DEFAULT_K = 5  # Products returned per query of a batch search
+BATCH_SEARCH_MAX_K = 24
+BATCH_SEARCH_MAX_QUERIES = 50
+BATCH_SUBSTITUTES_MAX_IDS = 100  # Products per request of the batch substitutes
+BARCODE_MAX_LENGTH = 18  # Product.code is a BigIntegerField (at most 18 digits are safe)
+CATALOG_VERSION_CHECK_INTERVAL = 5  # Seconds between two reads of the catalog version
 ETL_EXTRACT_MAX_WORKERS = 10
+FACET_MAX_CATEGORIES = 10  # Categories shown as filters of the search results
 KIND_OF_BISCUITS = [
                     "Biscuits", "Biscuit",
                     "biscuits", "biscuit",
@@ -11,10 +20,25 @@ KIND_OF_BISCUITS = [
 
 MAX_NBR_OF_SUBSTITUTE_PRODUCTS = 10
 NBR_OF_PAGES = 4
+NUTRIENT_OF_ORIGINAL = "original"  # Constraint value: the nutrient of the original product
+# Typed columns of Product (per 100 g) => key in the nutriments of Open Food Facts
+NUTRITION_FACTS = {
+    "energy_kcal_100g": "energy-kcal_100g",
+    "fat_100g": "fat_100g",
+    "fiber_100g": "fiber_100g",
+    "proteins_100g": "proteins_100g",
+    "salt_100g": "salt_100g",
+    "sugars_100g": "sugars_100g",
+}
+ORIGINAL_PRODUCTS_PER_PAGE = 24  # Page of the search results (3 products per row)
 PAGE_NBR_FOR_EXTRACTION_FILENAME = 'page_nbr.txt'
+PRODUCT_ID_MAX = 2**63 - 1  # Product.id is a BigAutoField
 PRODUCT_NAME_MAX_LENGTH = 50
 PRODUCTS_PER_PAGE = 20  # ====== Should be reset to 50
 QUANTITY_MAX_LENGTH = 30
+QUANTITY_UNIT_MAX_LENGTH = 2  # Base unit of Product.quantity_value: ml or g
+QUANTITY_VALUE_DECIMAL_PLACES = 3  # Product.quantity_value
+QUANTITY_VALUE_MAX_DIGITS = 15  # Product.quantity_value (decimal places included)
 REQUIRED_FIELDS_OF_A_PRODUCT = (
                                 "_id,"
                                 "product_name_fr,"
@@ -35,6 +59,23 @@ REQUIRED_FIELDS_OF_A_PRODUCT = (
                                 "code,"
                                 "_keywords")
 
+SEARCH_CACHE_MAX_RESULTS = 1000  # Ids kept per cached search (a broader search is run again)
+SEARCH_INDEX_REFRESH_INTERVAL = 60  # Seconds between two checks for new products (memory mode)
+SEARCH_FUZZY_MAX_RESULTS = 50  # The fuzzy search returns at most the N most similar products
+SEARCH_MODE_FULL_TEXT = "full_text"  # tsvector column + GIN index (PostgreSQL only)
+SEARCH_MODE_FUZZY = "fuzzy"  # pg_trgm similarity + GIN trigram indexes (PostgreSQL only)
+SEARCH_MODE_ICONTAINS = "icontains"  # One ILIKE '%keyword%' per keyword
+SEARCH_MODE_MEMORY = "memory"  # In process inverted index (see products.search_index)
+SEARCH_MODE_TOKENS = "tokens"  # text[] column of the tokens + GIN index (PostgreSQL only)
+SEARCH_SHADOW_MAX_PENDING = 100  # Shadow searches waiting to be compared (more are dropped)
+SEARCH_STOP_TOKEN_RATIO = 0.5  # A keyword found in more products than this ratio is ignored
+SEARCH_TEXT_CONFIG = "french"  # PostgreSQL text search configuration
+SUBSTITUTES_ENGINE_MINHASH = "minhash"  # Approximate (see substitute_engine.MinHashIndex)
+SUBSTITUTES_ENGINE_SQL = "sql"  # Exact
+SUBSTITUTES_REQUESTS_FLUSH_INTERVAL = 100  # Requests counted by a process before sharing them
+SUBSTITUTES_REQUESTS_MAX_KEYS = 1000  # Most requested substitutes kept in the counts
+TOKEN_MAX_LENGTH = 255  # Longer tokens are not counted in TokenFrequency
+
 UNWANTED_CATEGORIES = [
                         "Alimentos",
                         "Aperitivos",
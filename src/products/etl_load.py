@@ -1,4 +1,5 @@
-from products.models import Category, Product
+from products import caches
+from products.models import CatalogVersion, Category, Product, TokenFrequency
 
 
 def populate_database(products: list, categories: set) -> bool:
@@ -18,4 +19,12 @@ def populate_database(products: list, categories: set) -> bool:
         print("No category added")
         return False
 
-    return Product.add_many(products)
+    are_products_added = Product.add_many(products)
+    if are_products_added:
+        nbr_of_products = TokenFrequency.refresh()  # Used to plan the searches
+        Category.refresh_frequencies()  # Used to find the substitutes
+        # Invalidate the caches built with the previous catalog
+        CatalogVersion.bump(nbr_of_products)
+        caches.forget_catalog_version()
+
+    return are_products_added
@@ -74,6 +74,14 @@ def add_mega_keywords_to_product(product: WellFormedProduct):
     return product
 
 
+def add_nutrition_facts_to_product(product: WellFormedProduct):
+    """Add the attribute nutrition_facts: the typed columns of Product (energy, fat,
+    fiber, proteins, salt and sugars per 100 g) read from the nutriments."""
+
+    product.nutrition_facts = utils.parse_nutrition_facts(product.nutriments)
+    return product
+
+
 def transform_product(product: WellFormedProduct) -> WellFormedProduct or None:
     """Take a product which is an instance of WellFormedProduct as arg.
 
@@ -84,6 +92,7 @@ def transform_product(product: WellFormedProduct) -> WellFormedProduct or None:
     - Cut the value of the attribut quantity if too long
     - Replace the attribut mega_keyword with a new one made with several attributes
         of the product itself.
+    - Add the attribut nutrition_facts made from nutriments.
 
     Returns the modified product (or None if something went wrong).
     """
@@ -119,6 +128,7 @@ def transform_product(product: WellFormedProduct) -> WellFormedProduct or None:
     setattr(product, "categories_old", categories_as_string)
 
     product = add_mega_keywords_to_product(product)
+    product = add_nutrition_facts_to_product(product)
 
     if len(product.product_name_fr) > PRODUCT_NAME_MAX_LENGTH:
         product.product_name_fr = (
@@ -1,5 +1,6 @@
 import logging
 
+from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
 
 from products.etl_extract import download_products
@@ -125,6 +126,8 @@ class Command(BaseCommand):
                 self.style.SUCCESS("The database has been populated with success!")
             )
             print()
+            call_command("refreshsubstitutes", incremental=True, stdout=self.stdout)
+            call_command("prewarmsubstitutes", stdout=self.stdout)
         else:
             self.stdout.write(self.style.ERROR("No products added to the database!"))
             print()
@@ -0,0 +1,131 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products import substitute_engine
+from products.constants import MAX_NBR_OF_SUBSTITUTE_PRODUCTS
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the recall and the latency of the approximate substitutes (MinHash LSH) "
+        "against the exact engine on N synthetic products held in memory "
+        "(command: benchmarkminhash 1000000 --queries 1000)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("nbr_of_products", type=int)
+        parser.add_argument("--queries", type=int, default=1000, help="Nbr of products searched")
+        parser.add_argument(
+            "--categories", type=int, default=20000, help="Nbr of synthetic categories"
+        )
+        parser.add_argument("--bands", type=int, nargs="+", default=[16, 32, 64])
+        parser.add_argument("--rows-per-band", type=int, nargs="+", default=[2])
+        parser.add_argument("--max-bucket-size", type=int, default=2000)
+
+    def _create_synthetic_matrix(
+        self, random_generator, nbr_of_products: int, nbr_of_categories: int
+    ):
+        """2 to 6 categories per product. The popularity of the categories follows
+        Zipf's law: a few broad categories ("Snacks") are on a large part of the products."""
+
+        np = substitute_engine.np
+        nbr_of_categories_per_product = random_generator.integers(2, 7, nbr_of_products)
+        popularity = 1 / np.arange(1, nbr_of_categories + 1)
+        categories = random_generator.choice(
+            nbr_of_categories,
+            nbr_of_categories_per_product.sum(),
+            p=popularity / popularity.sum(),
+        )
+        products = np.repeat(np.arange(nbr_of_products), nbr_of_categories_per_product)
+        memberships = np.unique(products * nbr_of_categories + categories)  # No duplicate
+        return substitute_engine.CategoryMatrix(
+            np.arange(nbr_of_products),
+            random_generator.choice(list("abcde"), nbr_of_products).tolist(),
+            np.column_stack((memberships // nbr_of_categories, memberships % nbr_of_categories)),
+        )
+
+    def _search(self, engine, product_ids) -> tuple[list, list[float]]:
+        """Return the substitutes and the latency (in ms) of each search."""
+        all_substitutes = []
+        latencies = []
+        for product_id in product_ids:
+            start = time.perf_counter()
+            all_substitutes.append(engine.find_substitutes(product_id))
+            latencies.append((time.perf_counter() - start) * 1000)
+        return all_substitutes, latencies
+
+    def _recalls(self, matrix, exact_substitutes, approximate_substitutes) -> tuple[float, float]:
+        """Return (recall of the ids, recall of the (weight, grade)).
+        Many products tie on the weight and the grade: the exact engine keeps the ones
+        with the smallest ids, an equivalent product of the buckets is as good a
+        substitute. The second recall counts it as found."""
+
+        def grades_and_weights(substitutes):
+            return Counter(
+                (weight, matrix.grade_codes[matrix.product_ids.searchsorted(product_id)])
+                for product_id, weight in substitutes
+            )
+
+        nbr_of_expected = nbr_of_found = nbr_of_equivalent = 0
+        for exact, approximate in zip(exact_substitutes, approximate_substitutes):
+            nbr_of_expected += len(exact)
+            nbr_of_found += len(set(exact) & set(approximate))
+            nbr_of_equivalent += sum(
+                (grades_and_weights(exact) & grades_and_weights(approximate)).values()
+            )
+        if not nbr_of_expected:
+            return 1.0, 1.0
+        return nbr_of_found / nbr_of_expected, nbr_of_equivalent / nbr_of_expected
+
+    def _report(self, name: str, latencies: list[float], recalls=(1.0, 1.0), build: str = ""):
+        latencies = sorted(latencies)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{name:>22} | recall@{MAX_NBR_OF_SUBSTITUTE_PRODUCTS} ids {recalls[0]:.3f} "
+                f"(weight, grade) {recalls[1]:.3f} | "
+                f"p50 {latencies[len(latencies) // 2]:.2f} ms | "
+                f"p95 {latencies[int(len(latencies) * 0.95)]:.2f} ms{build}"
+            )
+        )
+
+    def handle(self, *args, **options):
+        if not substitute_engine.is_available():
+            raise CommandError("The vectorized engine requires NumPy: pip install numpy")
+        nbr_of_products = options["nbr_of_products"]
+        if nbr_of_products < 1 or options["queries"] < 1 or options["categories"] < 1:
+            raise CommandError("The numbers must be greater than 0")
+
+        random_generator = substitute_engine.np.random.default_rng(42)  # Same on each run
+        print(f"Creating {nbr_of_products} synthetic products...")
+        matrix = self._create_synthetic_matrix(
+            random_generator, nbr_of_products, options["categories"]
+        )
+        biggest_category = substitute_engine.np.diff(matrix.category_indptr).max()
+        self.stdout.write(
+            f"{len(matrix.product_categories)} memberships | biggest category: "
+            f"{biggest_category} products ({biggest_category / nbr_of_products:.0%})"
+        )
+
+        product_ids = random_generator.choice(
+            nbr_of_products, min(options["queries"], nbr_of_products), replace=False
+        ).tolist()
+        exact_substitutes, latencies = self._search(matrix, product_ids)
+        self._report("exact", latencies)
+
+        for nbr_of_bands in options["bands"]:
+            for rows_per_band in options["rows_per_band"]:
+                start = time.perf_counter()
+                index = substitute_engine.MinHashIndex(
+                    matrix, nbr_of_bands, rows_per_band, options["max_bucket_size"]
+                )
+                build_duration = time.perf_counter() - start
+
+                approximate_substitutes, latencies = self._search(index, product_ids)
+                self._report(
+                    f"minhash {nbr_of_bands} x {rows_per_band}",
+                    latencies,
+                    self._recalls(matrix, exact_substitutes, approximate_substitutes),
+                    f" | built in {build_duration:.1f} s ({index.nbytes / 2**20:.0f} MiB)",
+                )
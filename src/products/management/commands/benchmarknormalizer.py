@@ -0,0 +1,57 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products import utils
+from products.management.commands.benchmarksearch import BRANDS, QUANTITIES, QUERIES, WORDS
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the throughput (strings per second) of utils.format_text on texts of "
+        "products and on search queries (command: benchmarknormalizer 100000)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("nbr_of_strings", type=int)
+        parser.add_argument("--runs", type=int, default=3, help="The best run is kept")
+
+    def _create_texts_of_products(self, nbr_of_strings: int) -> list[str]:
+        random_generator = random.Random(42)  # Same texts on each run
+        return [
+            f"{' '.join(random_generator.sample(WORDS, 3)).title()} "
+            f"{random_generator.choice(QUANTITIES).replace('l', ' L').replace('.', ',')} "
+            f"Marque: {random_generator.choice(BRANDS).title()} & Co, "
+            f"{' '.join(random_generator.sample(WORDS, 5))} de la marque "
+            f"{random_generator.randrange(10**12, 10**13)}"
+            for _ in range(nbr_of_strings)
+        ]
+
+    def _measure(self, texts: list[str], runs: int) -> float:
+        """Return the number of strings formatted per second (best run)."""
+        best_duration = min(self._format_all(texts) for _ in range(runs))
+        return len(texts) / best_duration
+
+    def _format_all(self, texts: list[str]) -> float:
+        start = time.perf_counter()
+        for text in texts:
+            utils.format_text(text)
+        return time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        nbr_of_strings = options["nbr_of_strings"]
+        if nbr_of_strings < 1:
+            raise CommandError("The number of strings must be greater than 0")
+
+        products = self._create_texts_of_products(nbr_of_strings)
+        queries = [QUERIES[i % len(QUERIES)] for i in range(nbr_of_strings)]
+
+        for kind_of_texts, texts in (("products", products), ("queries", queries)):
+            strings_per_second = self._measure(texts, max(options["runs"], 1))
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"format_text | {kind_of_texts:>8} | {nbr_of_strings} strings | "
+                    f"{strings_per_second:,.0f} strings/s"
+                )
+            )
@@ -0,0 +1,81 @@
+import ast
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from products.constants import MAX_NBR_OF_SUBSTITUTE_PRODUCTS
+from products.models import Product
+
+
+# Keys of the nutriments of a product of Open Food Facts
+NUTRIMENTS = (
+    "carbohydrates", "energy", "energy-kcal", "energy-kj", "fat", "fiber", "proteins",
+    "salt", "saturated-fat", "sodium", "sugars", "calcium", "iron", "vitamin-c",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the CPU time per request spent to decode the nutriments of the substitutes "
+        "with ast.literal_eval and with the JSONField (command: benchmarknutriments 10000)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("nbr_of_requests", type=int)
+        parser.add_argument("--runs", type=int, default=3, help="The best run is kept")
+
+    def _create_nutriments_as_json(self, nbr_of_products: int) -> list[str]:
+        """Return the nutriments as returned by the database driver (JSON texts)."""
+        random_generator = random.Random(42)  # Same nutriments on each run
+        nutriments_as_json = []
+        for _ in range(nbr_of_products):
+            nutriments = {}
+            for key in NUTRIMENTS:
+                value = round(random_generator.uniform(0, 100), 2)
+                nutriments[key] = value
+                nutriments[f"{key}_100g"] = value
+                nutriments[f"{key}_serving"] = round(value / 3, 2)
+                nutriments[f"{key}_unit"] = "g"
+                nutriments[f"{key}_value"] = value
+            nutriments_as_json.append(json.dumps(nutriments))
+        return nutriments_as_json
+
+    def _decode_all(self, requests: list[list[str]], decode) -> float:
+        """Return the CPU time (in s) spent to decode the nutriments of all the requests."""
+        start = time.process_time()
+        for nutriments_of_substitutes in requests:
+            [{"nutriment": decode(nutriments)} for nutriments in nutriments_of_substitutes]
+        return time.process_time() - start
+
+    def handle(self, *args, **options):
+        nbr_of_requests = options["nbr_of_requests"]
+        if nbr_of_requests < 1:
+            raise CommandError("The number of requests must be greater than 0")
+
+        nutriments_as_json = self._create_nutriments_as_json(MAX_NBR_OF_SUBSTITUTE_PRODUCTS)
+        requests = [nutriments_as_json] * nbr_of_requests
+        nutriments_field = Product._meta.get_field("nutriments")
+
+        durations = {}
+        for decoder_name, decode in (
+            ("ast.literal_eval", ast.literal_eval),
+            ("JSONField", lambda value: nutriments_field.from_db_value(value, None, connection)),
+        ):
+            durations[decoder_name] = min(
+                self._decode_all(requests, decode) for _ in range(max(options["runs"], 1))
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{decoder_name:>16} | {nbr_of_requests} requests | "
+                    f"{durations[decoder_name] / nbr_of_requests * 1_000_000:,.0f} µs CPU/request"
+                )
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "The JSON decoding is "
+                f"{durations['ast.literal_eval'] / durations['JSONField']:.1f} times faster"
+            )
+        )
@@ -0,0 +1,166 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from products.constants import (
+    SEARCH_MODE_FULL_TEXT,
+    SEARCH_MODE_FUZZY,
+    SEARCH_MODE_ICONTAINS,
+    SEARCH_MODE_MEMORY,
+    SEARCH_MODE_TOKENS,
+)
+from products.models import Product
+from products import search_index, utils
+
+
+# Synthetic products are stored with a negative original_id so that they can't be
+# mistaken for products downloaded from Open Food Facts (and can be removed).
+FIRST_SYNTHETIC_ORIGINAL_ID = -1
+
+WORDS = [
+    "bio", "boisson", "cacao", "cafe", "chips", "chocolat", "coca", "cola", "confiture",
+    "cookies", "creme", "eau", "fraise", "fromage", "gateau", "jus", "lait", "light",
+    "miel", "noisette", "nutella", "orange", "pain", "pate", "pomme", "riz", "sauce",
+    "soda", "sucre", "tartiner", "the", "vanille", "yaourt", "zero",
+]
+BRANDS = ["auchan", "carrefour", "coca cola", "danone", "ferrero", "lu", "nestle", "president"]
+QUANTITIES = ["33cl", "50cl", "1l", "1.5l", "125g", "250g", "400g", "500g", "1kg"]
+
+QUERIES = [
+    "nutela",
+    "coca cola zero 33 cl",
+    "chocolat",
+    "pate a tartiner noisette",
+    "jus orange bio 1l",
+]
+
+
+def add_allow_write_argument(parser):
+    parser.add_argument(
+        "--allow-write",
+        action="store_true",
+        help="Write the synthetic products into the configured database (never a production one)",
+    )
+
+
+def check_allow_write(options):
+    """The synthetic products are written into the configured database: refuse unless
+    --allow-write is given."""
+
+    if not options["allow_write"]:
+        raise CommandError(
+            "This benchmark writes synthetic products into the database "
+            f"{connection.settings_dict['NAME']!r}. Run it against a dedicated database "
+            "with --allow-write."
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the latency (p50/p95) of each search mode of "
+        "Product.find_original_products on N synthetic products "
+        "(command: benchmarksearch 100000 --runs 20)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("nbr_of_products", type=int)
+        parser.add_argument("--runs", type=int, default=20, help="Nbr of runs per query")
+        parser.add_argument(
+            "--modes",
+            nargs="+",
+            default=[
+                SEARCH_MODE_ICONTAINS,
+                SEARCH_MODE_FULL_TEXT,
+                SEARCH_MODE_FUZZY,
+                SEARCH_MODE_TOKENS,
+                SEARCH_MODE_MEMORY,
+            ],
+        )
+        parser.add_argument(
+            "--keep", action="store_true", help="Do not remove the synthetic products"
+        )
+        add_allow_write_argument(parser)
+
+    def _create_synthetic_products(self, nbr_of_products: int, batch_size: int = 5000):
+        random_generator = random.Random(42)  # Same products on each run
+        nbr_of_created_products = 0
+
+        while nbr_of_created_products < nbr_of_products:
+            batch = []
+            for _ in range(min(batch_size, nbr_of_products - nbr_of_created_products)):
+                nbr_of_created_products += 1
+                name = " ".join(random_generator.sample(WORDS, 3))
+                brand = random_generator.choice(BRANDS)
+                quantity = random_generator.choice(QUANTITIES)
+                code = random_generator.randrange(10**12, 10**13)
+                keywords = utils.format_text(
+                    f"{name} {quantity} {brand} "
+                    + " ".join(random_generator.sample(WORDS, 5))
+                    + f" {code}"
+                )
+                batch.append(
+                    Product(
+                        name=name,
+                        brands=brand,
+                        code=code,
+                        original_id=FIRST_SYNTHETIC_ORIGINAL_ID - nbr_of_created_products,
+                        quantity=quantity,
+                        image_thumb_url="",
+                        image_url="",
+                        ingredients_text="",
+                        keywords=keywords,
+                        nutriments={},
+                        nutriscore_grade=random_generator.choice("abcde"),
+                        stores="",
+                        url="",
+                    )
+                )
+            Product.objects.bulk_create(batch)
+            self.stdout.write(f"{nbr_of_created_products} products created...")
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE products_product;")
+
+    def _measure(self, mode: str, runs: int) -> list[float]:
+        """Return the latency (in ms) of each search."""
+        latencies = []
+        for query in QUERIES:
+            keywords = utils.format_text(query)
+            for _ in range(runs):
+                start = time.perf_counter()
+                list(Product.find_original_products(keywords, mode=mode))
+                latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    def handle(self, *args, **options):
+        nbr_of_products = options["nbr_of_products"]
+        if nbr_of_products < 1:
+            raise CommandError("The number of products must be greater than 0")
+        check_allow_write(options)
+
+        print(f"Creating {nbr_of_products} synthetic products...")
+        self._create_synthetic_products(nbr_of_products)
+
+        try:
+            # Build the in memory index before measuring (so that it includes the new products)
+            search_index.reset_inverted_index()
+            if SEARCH_MODE_MEMORY in options["modes"]:
+                search_index.get_inverted_index()
+
+            for mode in options["modes"]:
+                latencies = self._measure(mode, options["runs"])
+                percentiles = statistics.quantiles(latencies, n=100)
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"{mode:>10} | {nbr_of_products} products | "
+                        f"p50: {percentiles[49]:.2f} ms | p95: {percentiles[94]:.2f} ms"
+                    )
+                )
+        finally:
+            if not options["keep"]:
+                print("Removing the synthetic products...")
+                Product.objects.filter(original_id__lte=FIRST_SYNTHETIC_ORIGINAL_ID).delete()
@@ -0,0 +1,117 @@
+import random
+import time
+
+from django.core.management.base import CommandError
+from django.db import connection
+
+from products import substitute_engine
+from products.constants import SUBSTITUTES_ENGINE_SQL
+from products.management.commands import benchmarksubstitutes
+from products.management.commands.benchmarksearch import (
+    FIRST_SYNTHETIC_ORIGINAL_ID,
+    add_allow_write_argument,
+    check_allow_write,
+)
+from products.models import Category, Product
+
+
+class Command(benchmarksubstitutes.Command):
+    help = (
+        "Compare the throughput (products per second) of find_substitute_products and of "
+        "the vectorized engine on N synthetic products "
+        "(command: benchmarksubstituteengine 100000 --sample 1000)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("nbr_of_products", type=int)
+        parser.add_argument(
+            "--sample", type=int, default=1000,
+            help="Nbr of products whose substitutes are found with SQL and compared",
+        )
+        parser.add_argument(
+            "--categories", type=int, default=5000, help="Nbr of synthetic categories"
+        )
+        add_allow_write_argument(parser)
+
+    def _report(self, engine: str, nbr_of_products: int, duration: float):
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{engine:>24} | {nbr_of_products} products | {duration:.2f} s | "
+                f"{nbr_of_products / duration:,.0f} products/s"
+            )
+        )
+
+    def handle(self, *args, **options):
+        if not substitute_engine.is_available():
+            raise CommandError("The vectorized engine requires NumPy: pip install numpy")
+
+        nbr_of_products = options["nbr_of_products"]
+        if nbr_of_products < 1 or options["sample"] < 1 or options["categories"] < 4:
+            raise CommandError(
+                "The numbers of products must be greater than 0 and the number of "
+                "categories greater than 3"
+            )
+        check_allow_write(options)
+
+        random_generator = random.Random(42)  # Same products on each run
+        categories = Category.objects.bulk_create(
+            Category(name=f"{benchmarksubstitutes.SYNTHETIC_CATEGORY_PREFIX}{index}")
+            for index in range(options["categories"])
+        )
+
+        try:
+            print(f"Creating {nbr_of_products} synthetic products...")
+            products = self._create_synthetic_products(
+                random_generator, categories, 0, nbr_of_products
+            )
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE products_product;")
+                    cursor.execute("ANALYZE products_category_products;")
+
+            sample = random_generator.sample(products, min(options["sample"], len(products)))
+            start = time.perf_counter()
+            expected_substitutes = {
+                product.id: [
+                    (substitute["id"], substitute["weight"])
+                    for substitute in Product.find_substitute_products(
+                        str(product.id), product.nutriscore_grade, engine=SUBSTITUTES_ENGINE_SQL
+                    )
+                ]
+                for product in sample
+            }
+            self._report("find_substitute_products", len(sample), time.perf_counter() - start)
+
+            start = time.perf_counter()
+            matrix = substitute_engine.CategoryMatrix.load()
+            load_duration = time.perf_counter() - start
+            self.stdout.write(
+                f"Matrix loaded in {load_duration:.2f} s ({matrix.nbytes / 2**20:.1f} MiB)"
+            )
+
+            start = time.perf_counter()
+            for product in sample:
+                matrix.find_substitutes(product.id)
+            self._report("vectorized (one by one)", len(sample), time.perf_counter() - start)
+
+            start = time.perf_counter()
+            substitutes = matrix.find_many_substitutes()
+            duration = time.perf_counter() - start
+            self._report("vectorized (all at once)", matrix.nbr_of_products, duration)
+            self._report(
+                "  including the loading", matrix.nbr_of_products, duration + load_duration
+            )
+
+            if any(
+                substitutes.get(product_id, []) != expected
+                or matrix.find_substitutes(product_id) != expected
+                for product_id, expected in expected_substitutes.items()
+            ):
+                raise CommandError("The vectorized engine and SQL give different substitutes!")
+            self.stdout.write(self.style.SUCCESS("Same substitutes as find_substitute_products"))
+        finally:
+            print("Removing the synthetic products...")
+            Product.objects.filter(original_id__lte=FIRST_SYNTHETIC_ORIGINAL_ID).delete()
+            Category.objects.filter(
+                name__startswith=benchmarksubstitutes.SYNTHETIC_CATEGORY_PREFIX
+            ).delete()
@@ -0,0 +1,142 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from products.management.commands.benchmarksearch import (
+    FIRST_SYNTHETIC_ORIGINAL_ID,
+    add_allow_write_argument,
+    check_allow_write,
+)
+from products.models import CatalogVersion, Category, Product, ProductSubstitute, TouchedProduct
+
+
+SYNTHETIC_CATEGORY_PREFIX = "benchmark-category-"
+NBR_OF_CATEGORIES_PER_PRODUCT = 4
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the full and the incremental refresh of the substitutes on N synthetic "
+        "products (command: benchmarksubstitutes 100000 --added 500)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("nbr_of_products", type=int)
+        parser.add_argument(
+            "--added", type=int, default=500, help="Nbr of products added after the full refresh"
+        )
+        parser.add_argument(
+            "--categories", type=int, default=5000, help="Nbr of synthetic categories"
+        )
+        add_allow_write_argument(parser)
+
+    def _create_synthetic_products(
+        self, random_generator, categories, first_index: int, nbr_of_products: int,
+        batch_size: int = 5000,
+    ) -> list[Product]:
+        """Create the products with their categories. Return the created products."""
+
+        created_products = []
+        Membership = Category.products.through
+        for first_of_batch in range(first_index, first_index + nbr_of_products, batch_size):
+            last_of_batch = min(first_of_batch + batch_size, first_index + nbr_of_products)
+            products = Product.objects.bulk_create(
+                Product(
+                    name=f"synthetic product {index}",
+                    brands="",
+                    code=index,
+                    original_id=FIRST_SYNTHETIC_ORIGINAL_ID - index,
+                    quantity="",
+                    image_thumb_url="",
+                    image_url="",
+                    ingredients_text="",
+                    keywords="",
+                    nutriments={},
+                    nutriscore_grade=random_generator.choice("abcde"),
+                    stores="",
+                    url="",
+                )
+                for index in range(first_of_batch, last_of_batch)
+            )
+            Membership.objects.bulk_create(
+                Membership(category_id=category.id, product_id=product.id)
+                for product in products
+                for category in random_generator.sample(categories, NBR_OF_CATEGORIES_PER_PRODUCT)
+            )
+            created_products += products
+            self.stdout.write(f"{last_of_batch - first_index} products created...")
+        return created_products
+
+    def _refresh(self, incremental: bool) -> float:
+        """Return the duration (in s) of the refresh."""
+        start = time.perf_counter()
+        nbr_of_rows = ProductSubstitute.refresh(incremental=incremental)
+        duration = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'incremental' if incremental else 'full':>11} | "
+                f"{nbr_of_rows} substitutes | {duration:.2f} s"
+            )
+        )
+        return duration
+
+    def _checksum(self) -> tuple:
+        """Used to check that both refreshes give the same substitutes."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*), SUM(product_id * substitute_id * (weight + 7) * (rank + 3)) "
+                "FROM products_productsubstitute"
+            )
+            return cursor.fetchone()
+
+    def handle(self, *args, **options):
+        nbr_of_products = options["nbr_of_products"]
+        if nbr_of_products < 1 or options["added"] < 1 or options["categories"] < 4:
+            raise CommandError(
+                "The numbers of products must be greater than 0 and the number of "
+                "categories greater than 3"
+            )
+        check_allow_write(options)
+
+        random_generator = random.Random(42)  # Same products on each run
+        categories = Category.objects.bulk_create(
+            Category(name=f"{SYNTHETIC_CATEGORY_PREFIX}{index}")
+            for index in range(options["categories"])
+        )
+
+        try:
+            print(f"Creating {nbr_of_products} synthetic products...")
+            self._create_synthetic_products(random_generator, categories, 0, nbr_of_products)
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE products_product;")
+                    cursor.execute("ANALYZE products_category_products;")
+            CatalogVersion.bump()
+            self._refresh(incremental=False)
+
+            print(f"Adding {options['added']} synthetic products...")
+            added_products = self._create_synthetic_products(
+                random_generator, categories, nbr_of_products, options["added"]
+            )
+            TouchedProduct.objects.bulk_create(
+                TouchedProduct(product=product) for product in added_products
+            )
+            CatalogVersion.bump()
+
+            incremental_duration = self._refresh(incremental=True)
+            incremental_checksum = self._checksum()
+            full_duration = self._refresh(incremental=False)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"The incremental refresh is {full_duration / incremental_duration:.1f} "
+                    "times faster"
+                )
+            )
+            if incremental_checksum != self._checksum():
+                raise CommandError("The incremental and the full refreshes are different!")
+        finally:
+            print("Removing the synthetic products...")
+            Product.objects.filter(original_id__lte=FIRST_SYNTHETIC_ORIGINAL_ID).delete()
+            Category.objects.filter(name__startswith=SYNTHETIC_CATEGORY_PREFIX).delete()
@@ -0,0 +1,130 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from products import caches
+from products.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Display the categories found in most of the products then, for each cap on "
+        "their frequency (PRODUCTS_SUBSTITUTES_MAX_CATEGORY_RATIO), how much the join "
+        "of the substitutes shrinks and how their ranking changes "
+        "(command: categorystats --ratios 0.05 0.1 0.2 --sample 500)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ratios", type=float, nargs="+", default=[0.05, 0.1, 0.2, 0.5])
+        parser.add_argument(
+            "--sample", type=int, default=500,
+            help="Nbr of products whose substitutes are compared",
+        )
+        parser.add_argument("--top", type=int, default=10, help="Nbr of categories displayed")
+
+    def _join_size(self, max_category_ratio: float) -> int:
+        """Rows joined to count the categories in common of all the products (as in the
+        full refresh of the substitutes): each category of a product brings all the
+        products of the category."""
+
+        memberships, params = Category.substitute_memberships(max_category_ratio)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT COALESCE(SUM(c.nbr_of_products), 0)
+                FROM {memberships} m
+                INNER JOIN products_category c ON c.id = m.category_id
+                """,
+                params,
+            )
+            return cursor.fetchone()[0]
+
+    def _search(self, products, max_category_ratio: float) -> tuple[list, list[float]]:
+        """Return the substitute ids of each product and the latency (in ms) of each
+        search."""
+
+        all_substitutes = []
+        latencies = []
+        for product_id, nutriscore_grade in products:
+            start = time.perf_counter()
+            substitutes = Product.find_substitute_products(
+                str(product_id), nutriscore_grade, max_category_ratio=max_category_ratio
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+            all_substitutes.append([substitute["id"] for substitute in substitutes])
+        return all_substitutes, sorted(latencies)
+
+    def _report(
+        self, name: str, join_size: int, full_join_size: int, substitutes, latencies,
+        expected_substitutes=None,
+    ):
+        """expected_substitutes: the substitutes found with all the categories"""
+
+        expected_substitutes = expected_substitutes or substitutes
+        overlaps = [
+            len(set(found) & set(expected)) / len(expected)
+            for found, expected in zip(substitutes, expected_substitutes)
+            if expected
+        ]
+        nbr_of_same_rankings = sum(
+            found == expected for found, expected in zip(substitutes, expected_substitutes)
+        )
+        nbr_with_substitutes = sum(bool(found) for found in substitutes)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{name:>22} | join {join_size:,} rows "
+                f"({join_size / max(full_join_size, 1) - 1:+.0%}) | "
+                f"overlap {sum(overlaps) / max(len(overlaps), 1):.3f} | "
+                f"same ranking {nbr_of_same_rankings / len(substitutes):.0%} | "
+                f"with substitutes {nbr_with_substitutes / len(substitutes):.0%} | "
+                f"p50 {latencies[len(latencies) // 2]:.2f} ms"
+            )
+        )
+
+    def handle(self, *args, **options):
+        if options["sample"] < 1 or options["top"] < 0 or min(options["ratios"]) <= 0:
+            raise CommandError("The sample and the ratios must be greater than 0")
+
+        caches.forget_catalog_version()
+        nbr_of_products = caches.get_catalog_size()
+        if not nbr_of_products:
+            raise CommandError(
+                "The frequencies are computed after each load of products (addproducts)"
+            )
+
+        self.stdout.write(
+            f"{nbr_of_products} products | {Category.objects.count()} categories | "
+            "most general categories:"
+        )
+        most_general_categories = Category.objects.order_by("-nbr_of_products").values_list(
+            "name", "nbr_of_products"
+        )[: options["top"]]
+        for name, frequency in most_general_categories:
+            self.stdout.write(
+                f"{frequency:>10} products ({frequency / nbr_of_products:>4.0%}) | {name}"
+            )
+
+        random_generator = random.Random(42)  # Same products on each run
+        products = list(Product.objects.values_list("id", "nutriscore_grade"))
+        products = random_generator.sample(products, min(options["sample"], len(products)))
+
+        print(f"Searching the substitutes of {len(products)} products...")
+        full_join_size = self._join_size(1)
+        expected_substitutes, latencies = self._search(products, 1)
+        self._report(
+            "all the categories", full_join_size, full_join_size, expected_substitutes, latencies
+        )
+
+        for max_category_ratio in sorted(options["ratios"], reverse=True):
+            nbr_of_too_general = len(Category.too_general_ids(max_category_ratio))
+            substitutes, latencies = self._search(products, max_category_ratio)
+            self._report(
+                f"ratio {max_category_ratio} ({nbr_of_too_general} out)",
+                self._join_size(max_category_ratio),
+                full_join_size,
+                substitutes,
+                latencies,
+                expected_substitutes,
+            )
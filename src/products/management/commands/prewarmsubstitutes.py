@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from products import caches
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute the most requested substitutes for the current version of the catalog "
+        "into the shared tier of the cache (command: prewarmsubstitutes [--size 100])"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=settings.PRODUCTS_SUBSTITUTES_PREWARM_SIZE,
+            help="Nbr of the most requested substitutes to compute",
+        )
+
+    def handle(self, *args, **options):
+        substitutes_cache = caches.substitutes_cache
+        if substitutes_cache.shared is None:
+            self.stdout.write("The substitutes cache has no shared tier: nothing to pre-warm")
+            return
+        if isinstance(substitutes_cache.shared, LocMemCache):
+            self.stdout.write(
+                f"The shared tier of the substitutes cache ({substitutes_cache.alias}) is a "
+                "local-memory cache: it is neither read nor written by the other processes, "
+                "nothing to pre-warm (set CACHE_URL, e.g. rediscache://127.0.0.1:6379/1)"
+            )
+            return
+
+        print("Pre-warming the substitutes...")
+        caches.forget_catalog_version()
+        catalog_version = caches.get_catalog_version()
+        fill_times = []
+        for product_id, nutriscore_grade in substitutes_cache.most_requested(options["size"]):
+            start = time.perf_counter()
+            product, substitutes = Product.find_product_and_substitutes(
+                product_id, nutriscore_grade
+            )
+            fill_times.append(time.perf_counter() - start)
+            if product is not None:
+                substitutes_cache.set(
+                    (product_id, nutriscore_grade), catalog_version, (product, substitutes)
+                )
+
+        average_fill_time = sum(fill_times) / len(fill_times) if fill_times else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(fill_times)} substitutes of the version {catalog_version} pre-warmed "
+                f"in {sum(fill_times):.2f} s (average {average_fill_time * 1000:.1f} ms)"
+            )
+        )
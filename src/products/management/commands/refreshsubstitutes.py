@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.models import ProductSubstitute
+
+
+class Command(BaseCommand):
+    help = (
+        "Precompute the substitutes of the products into the table ProductSubstitute "
+        "(command: refreshsubstitutes [--incremental])"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only recompute the substitutes of the products sharing a category "
+            "with the products added since the last refresh",
+        )
+
+    def handle(self, *args, **options):
+        print("Refreshing the substitutes...")
+        start = time.perf_counter()
+        nbr_of_rows = ProductSubstitute.refresh(incremental=options["incremental"])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{nbr_of_rows} substitutes refreshed in {time.perf_counter() - start:.2f} s"
+            )
+        )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from products.search_index import build_inverted_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the in memory search index (memory mode) from the products of the "
+        "database then display its size (command: searchindexstats)"
+    )
+
+    def handle(self, *args, **options):
+        print("Building the inverted index...")
+        memory = build_inverted_index().memory_usage()
+
+        self.stdout.write(f"Nbr of products: {memory['nbr_of_products']}")
+        self.stdout.write(f"Nbr of tokens: {memory['nbr_of_tokens']}")
+        self.stdout.write(f"Total size: {memory['total_bytes'] / 1024 / 1024:.1f} MB")
+        self.stdout.write(
+            self.style.SUCCESS(f"Size per product: {memory['bytes_per_product']:.0f} bytes")
+        )
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# The tsvector column is generated by PostgreSQL from products_product.keywords
+# (the mega_keywords of the ETL) so it can never be out of date.
+# It is not declared on the model: SQLite (used by the tests) has no tsvector.
+
+
+def add_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute(
+        "ALTER TABLE products_product "
+        "ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('french', keywords)) STORED;"
+    )
+    schema_editor.execute(
+        "CREATE INDEX products_product_search_vector_gin "
+        "ON products_product USING gin (search_vector);"
+    )
+
+
+def remove_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute("DROP INDEX IF EXISTS products_product_search_vector_gin;")
+    schema_editor.execute("ALTER TABLE products_product DROP COLUMN IF EXISTS search_vector;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vector, remove_search_vector),
+    ]
@@ -0,0 +1,41 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Trigram indexes are built on UPPER(column) because Django translates
+# icontains into UPPER(column) LIKE UPPER('%keyword%') on PostgreSQL.
+# This way, the same indexes serve the icontains and the fuzzy searches
+# (pg_trgm ignores the case when comparing trigrams).
+
+
+def add_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute(
+        "CREATE INDEX products_product_keywords_trgm "
+        "ON products_product USING gin (UPPER(keywords) gin_trgm_ops);"
+    )
+    schema_editor.execute(
+        "CREATE INDEX products_product_name_trgm "
+        "ON products_product USING gin (UPPER(name) gin_trgm_ops);"
+    )
+
+
+def remove_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute("DROP INDEX IF EXISTS products_product_keywords_trgm;")
+    schema_editor.execute("DROP INDEX IF EXISTS products_product_name_trgm;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_search_vector'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(add_trigram_indexes, remove_trigram_indexes),
+    ]
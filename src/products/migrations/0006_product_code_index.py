@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-18 09:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='code',
+            field=models.BigIntegerField(db_index=True, help_text='Bar code of the product'),
+        ),
+    ]
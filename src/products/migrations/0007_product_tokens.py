@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# The text[] column holds the tokens of products_product.keywords (the keywords are
+# already normalized by utils.format_text in the ETL: tokens are separated by spaces
+# or commas). It is generated by PostgreSQL, so the existing rows are backfilled when
+# the column is added and the tokens can never be out of date.
+# It is not declared on the model: SQLite (used by the tests) has no arrays.
+
+
+def add_tokens(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute(
+        "ALTER TABLE products_product "
+        "ADD COLUMN tokens text[] "
+        "GENERATED ALWAYS AS "
+        "(regexp_split_to_array(btrim(keywords, ' ,'), '[\\s,]+')) STORED;"
+    )
+    schema_editor.execute(
+        "CREATE INDEX products_product_tokens_gin "
+        "ON products_product USING gin (tokens);"
+    )
+
+
+def remove_tokens(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute("DROP INDEX IF EXISTS products_product_tokens_gin;")
+    schema_editor.execute("ALTER TABLE products_product DROP COLUMN IF EXISTS tokens;")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_code_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_tokens, remove_tokens),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0.3 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenFrequency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=255, unique=True)),
+                ('frequency', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='catalogversion',
+            name='nbr_of_products',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
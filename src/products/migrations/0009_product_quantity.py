@@ -0,0 +1,111 @@
+# Generated by Django 4.0.3 on 2026-10-18 10:11
+
+import re
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# Copy of the parsing of products.utils.parse_quantity when this migration was written:
+# the migration must keep doing the same thing whatever the later changes of utils.
+UNITS = (
+    "l", "cl", "ml", "hl", "dl", "g", "kg", "kg", "mm", "cm", "dm", "m2", "m²", "m3", "m³",
+    "cm2", "cm²", "cm3", "cm³", "mm2", "mm²", "mm3", "mm³",
+)
+GLUE_UNIT_TO_QUANTITY = (
+    [(f" {unit} ", f"{unit} ") for unit in UNITS]
+    + [(f" {unit},", f"{unit}, ") for unit in UNITS]
+)
+UNIT_WORDS = (
+    (" gramme ", "g "),
+    (" grammes ", "g "),
+    (" grame ", "g "),
+    (" grames ", "g "),
+    (" gram ", "g "),
+    (" grams ", "g "),
+    (" litre ", "l "),
+    (" litres ", "l "),
+    (" kilogramme ", "kg "),
+    (" kilogrammes ", "kg "),
+    (" kilogrames ", "kg "),
+    (" kilogrammes ", "kg "),
+    (" liter ", "l "),
+    (" liters ", "l "),
+)
+UNIT_CONVERSIONS = {
+    "ml": ("ml", Decimal(1)),
+    "cl": ("ml", Decimal(10)),
+    "dl": ("ml", Decimal(100)),
+    "l": ("ml", Decimal(1000)),
+    "hl": ("ml", Decimal(100000)),
+    "mg": ("g", Decimal("0.001")),
+    "g": ("g", Decimal(1)),
+    "kg": ("g", Decimal(1000)),
+}
+# Product.quantity_value: max_digits=15, decimal_places=3
+QUANTITY_PRECISION = Decimal("0.001")
+QUANTITY_MAX_VALUE = Decimal(10) ** 12
+QUANTITY = re.compile(
+    r"(?<![\w.,])(\d+(?:[.,]\d+)?)(" + "|".join(sorted(UNIT_CONVERSIONS, key=len, reverse=True))
+    + r")(?![\w²³])"
+)
+
+
+def parse_quantity(text: str):
+    """Return (value in base unit, base unit) of the first quantity of the text
+    (e.g.: "6 x 33 cl" => (330, "ml")) or None if the text has no quantity with a known
+    unit (or if the first one does not fit Product.quantity_value)."""
+
+    if not (text and isinstance(text, str)):
+        return None
+    text = " " + text.lower().strip() + " "
+    for old, new in GLUE_UNIT_TO_QUANTITY + list(UNIT_WORDS):
+        text = text.replace(old, new)
+    match = QUANTITY.search(text)
+    if not match:
+        return None
+    number, unit = match.groups()
+    base_unit, size = UNIT_CONVERSIONS[unit]
+    value = Decimal(number.replace(",", ".")) * size
+    if not (value < QUANTITY_MAX_VALUE and value.quantize(QUANTITY_PRECISION) < QUANTITY_MAX_VALUE):
+        return None
+    return value, base_unit
+
+
+def fill_quantities(apps, schema_editor):
+    """Parse the quantity of the products already stored."""
+
+    Product = apps.get_model("products", "Product")
+    products = []
+    for product in Product.objects.only("id", "quantity").iterator(chunk_size=5000):
+        quantity = parse_quantity(product.quantity)
+        if quantity is not None:
+            product.quantity_value, product.quantity_unit = quantity
+            products.append(product)
+    Product.objects.bulk_update(
+        products, ["quantity_unit", "quantity_value"], batch_size=5000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_tokenfrequency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='quantity_unit',
+            field=models.CharField(blank=True, help_text='Base unit: ml or g', max_length=2),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='quantity_value',
+            field=models.DecimalField(decimal_places=3, help_text='Quantity in base unit', max_digits=15, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['quantity_unit', 'quantity_value'], name='products_quantity_idx'),
+        ),
+        migrations.RunPython(fill_quantities, migrations.RunPython.noop),
+    ]
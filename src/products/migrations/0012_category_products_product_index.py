@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+# The table of the categories of the products (ManyToManyField Category.products) is
+# created by Django with the unique index (category_id, product_id): the categories in
+# common with a product are counted with index only scans of it.
+# This index (product_id, category_id) gives the categories of a product with an index
+# only scan too (see Product.find_substitute_products).
+# The index products_id_grade_idx (id) INCLUDE (nutriscore_grade) gives the grades of
+# the candidates without reading the rows of products_product (PostgreSQL only).
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_touchedproduct'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX products_category_products_product_category "
+            "ON products_category_products (product_id, category_id);",
+            "DROP INDEX IF EXISTS products_category_products_product_category;",
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['id'], include=('nutriscore_grade',), name='products_id_grade_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+import ast
+
+from django.db import migrations
+
+
+def nutriments_from_python_repr(nutriments):
+    """Return the dict (or list) written in nutriments if nutriments is the Python repr
+    of the nutriments (e.g.: "{'fat_100g': 1.5}") instead of JSON, otherwise return
+    nutriments unchanged."""
+
+    if not (isinstance(nutriments, str) and nutriments.lstrip().startswith(("{", "["))):
+        return nutriments
+    try:
+        value = ast.literal_eval(nutriments)
+    except (MemoryError, RecursionError, SyntaxError, ValueError):
+        return nutriments
+    return value if isinstance(value, (dict, list)) else nutriments
+
+
+def repair_nutriments(apps, schema_editor):
+    """The nutriments stored as the Python repr of a dict (a JSON string such as
+    "{'fat_100g': 1.5}") are replaced by the JSON object."""
+
+    Product = apps.get_model("products", "Product")
+    products = []
+    for product in Product.objects.only("id", "nutriments").iterator(chunk_size=5000):
+        nutriments = nutriments_from_python_repr(product.nutriments)
+        if nutriments is not product.nutriments:
+            product.nutriments = nutriments
+            products.append(product)
+    Product.objects.bulk_update(products, ["nutriments"], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_category_products_product_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(repair_nutriments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,113 @@
+# Generated by Django 4.0.3 on 2026-10-18 10:43
+
+import math
+
+from django.db import migrations, models
+
+# Column of Product => key of the nutriments of Open Food Facts, when this migration was
+# written
+NUTRITION_FACTS = {
+    "energy_kcal_100g": "energy-kcal_100g",
+    "fat_100g": "fat_100g",
+    "fiber_100g": "fiber_100g",
+    "proteins_100g": "proteins_100g",
+    "salt_100g": "salt_100g",
+    "sugars_100g": "sugars_100g",
+}
+
+
+def parse_nutrition_facts(nutriments) -> dict:
+    """Copy of products.utils.parse_nutrition_facts when this migration was written:
+    return the typed columns read from the nutriments. A missing, non numeric, negative
+    or infinite value is None."""
+
+    if not isinstance(nutriments, dict):
+        nutriments = {}
+
+    nutrition_facts = {}
+    for column, key in NUTRITION_FACTS.items():
+        try:
+            value = float(nutriments.get(key))
+        except (TypeError, ValueError):
+            value = None
+        nutrition_facts[column] = value if value is not None and 0 <= value < math.inf else None
+    return nutrition_facts
+
+
+def fill_nutrition_facts(apps, schema_editor):
+    """Read the nutrition facts of the products already stored from their nutriments."""
+
+    Product = apps.get_model("products", "Product")
+    products = []
+    for product in Product.objects.only("id", "nutriments").iterator(chunk_size=5000):
+        nutrition_facts = parse_nutrition_facts(product.nutriments)
+        if any(value is not None for value in nutrition_facts.values()):
+            for column, value in nutrition_facts.items():
+                setattr(product, column, value)
+            products.append(product)
+    Product.objects.bulk_update(products, list(NUTRITION_FACTS), batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_product_nutriments_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='energy_kcal_100g',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='fat_100g',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='fiber_100g',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='proteins_100g',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='salt_100g',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sugars_100g',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['energy_kcal_100g'], name='products_energy_kcal_100g_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['fat_100g'], name='products_fat_100g_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['fiber_100g'], name='products_fiber_100g_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['proteins_100g'], name='products_proteins_100g_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['salt_100g'], name='products_salt_100g_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['sugars_100g'], name='products_sugars_100g_idx'),
+        ),
+        migrations.RunPython(fill_nutrition_facts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.0.3 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_product_nutrition_facts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='nbr_of_products',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # Frequencies of the categories already stored (see Category.refresh_frequencies)
+        migrations.RunSQL(
+            """
+            UPDATE products_category
+            SET nbr_of_products = (
+                SELECT COUNT(*)
+                FROM products_category_products
+                WHERE category_id = products_category.id
+            )
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-18 11:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_category_nbr_of_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogversion',
+            name='substitutes_too_general_categories',
+            field=models.JSONField(default=list),
+        ),
+    ]
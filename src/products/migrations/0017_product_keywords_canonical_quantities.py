@@ -0,0 +1,98 @@
+import re
+from collections import Counter
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import F
+
+# Copy of the quantity normalization of products.utils.canonicalize_quantities when this
+# migration was written: the migration must keep doing the same thing whatever the later
+# changes of utils.
+UNIT_CONVERSIONS = {
+    "ml": ("ml", Decimal(1)),
+    "cl": ("ml", Decimal(10)),
+    "dl": ("ml", Decimal(100)),
+    "l": ("ml", Decimal(1000)),
+    "hl": ("ml", Decimal(100000)),
+    "mg": ("g", Decimal("0.001")),
+    "g": ("g", Decimal(1)),
+    "kg": ("g", Decimal(1000)),
+}
+CANONICAL_UNITS = {
+    "ml": (("l", Decimal(1000)), ("cl", Decimal(10)), ("ml", Decimal(1))),
+    "g": (("kg", Decimal(1000)), ("g", Decimal(1)), ("mg", Decimal("0.001"))),
+}
+QUANTITY = re.compile(
+    r"(?<![\w.,])(\d+(?:[.,]\d+)?)(" + "|".join(sorted(UNIT_CONVERSIONS, key=len, reverse=True))
+    + r")(?![\w²³])"
+)
+TOKEN_MAX_LENGTH = 255  # TokenFrequency.token
+
+
+def canonical_quantity(match) -> str:
+    """Canonical writing of a match of QUANTITY (e.g.: "330ml" => "33cl")."""
+
+    number, unit = match.groups()
+    base_unit, size = UNIT_CONVERSIONS[unit]
+    value = Decimal(number.replace(",", ".")) * size
+    for unit, size in CANONICAL_UNITS[base_unit]:
+        if value >= size:
+            break
+    return format((value / size).normalize(), "f") + unit
+
+
+def canonicalize_quantities(text: str) -> str:
+    """Write each quantity of the text in its canonical unit
+    (e.g.: " 0,5l 330ml 1,75l 0.3kg " => " 50cl 33cl 1.75l 300g ")."""
+
+    if not any(char.isdigit() for char in text):
+        return text
+    return QUANTITY.sub(canonical_quantity, text)
+
+
+def canonicalize_keywords(apps, schema_editor):
+    """The keywords stored before the quantities were parsed only have the spellings of
+    the old fixed table converted (" 330ml" => " 33cl"...): the searches, whose keywords
+    are now canonicalized, no longer found them (e.g.: "400ml", "1,98l")."""
+
+    Product = apps.get_model("products", "Product")
+    products = []
+    for product in Product.objects.only("id", "keywords").iterator(chunk_size=5000):
+        keywords = canonicalize_quantities(product.keywords)
+        if keywords != product.keywords:
+            product.keywords = keywords
+            products.append(product)
+    if not products:
+        return
+    Product.objects.bulk_update(products, ["keywords"], batch_size=5000)
+
+    # The frequencies of the tokens (see TokenFrequency.refresh) and the caches of the
+    # searches (invalidated with the version of the catalog) were built with the old
+    # keywords
+    TokenFrequency = apps.get_model("products", "TokenFrequency")
+    if TokenFrequency.objects.exists():
+        token_counts = Counter()
+        for keywords in Product.objects.values_list("keywords", flat=True).iterator(chunk_size=5000):
+            token_counts.update(set(keywords.replace(",", " ").split()))
+        TokenFrequency.objects.all().delete()
+        TokenFrequency.objects.bulk_create(
+            (
+                TokenFrequency(token=token, frequency=frequency)
+                for token, frequency in token_counts.items()
+                if len(token) <= TOKEN_MAX_LENGTH
+            ),
+            batch_size=5000,
+        )
+    CatalogVersion = apps.get_model("products", "CatalogVersion")
+    CatalogVersion.objects.filter(id=1).update(number=F("number") + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_catalogversion_substitutes_too_general_categories'),
+    ]
+
+    operations = [
+        migrations.RunPython(canonicalize_keywords, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,35 @@
 import logging
-import ast
+import time
+from collections import Counter
 
+from django.conf import settings
 from django.db import connection, models
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Case, F, IntegerField, Max, Q, Value, When
+from django.db.models.expressions import RawSQL
 
 from accounts.models import Customer
 
+from products import caches, search_backends, search_index, utils
 from products.utils import WellFormedProduct
 from .constants import (
+    BATCH_SEARCH_DEFAULT_K,
+    FACET_MAX_CATEGORIES,
     MAX_NBR_OF_SUBSTITUTE_PRODUCTS,
+    NUTRIENT_OF_ORIGINAL,
+    NUTRITION_FACTS,
+    ORIGINAL_PRODUCTS_PER_PAGE,
     PRODUCT_NAME_MAX_LENGTH,
     QUANTITY_MAX_LENGTH,
+    QUANTITY_UNIT_MAX_LENGTH,
+    QUANTITY_VALUE_DECIMAL_PLACES,
+    QUANTITY_VALUE_MAX_DIGITS,
+    SEARCH_CACHE_MAX_RESULTS,
+    SEARCH_MODE_MEMORY,
+    SEARCH_MODE_TOKENS,
+    SEARCH_STOP_TOKEN_RATIO,
+    SUBSTITUTES_ENGINE_MINHASH,
+    TOKEN_MAX_LENGTH,
 )
 
 
@@ -23,9 +41,20 @@ class Product(models.Model):
         max_length=PRODUCT_NAME_MAX_LENGTH, help_text="Name of the product"
     )
     brands = models.TextField(help_text="Brands of the product")
-    code = models.BigIntegerField(help_text="Bar code of the product")
+    code = models.BigIntegerField(help_text="Bar code of the product", db_index=True)
     original_id = models.BigIntegerField(unique=True, db_index=True)
     quantity = models.CharField(max_length=QUANTITY_MAX_LENGTH)
+    # First quantity found in quantity, in its base unit (e.g.: "6 x 33 cl" => 330 ml)
+    # See utils.parse_quantity
+    quantity_value = models.DecimalField(
+        max_digits=QUANTITY_VALUE_MAX_DIGITS,
+        decimal_places=QUANTITY_VALUE_DECIMAL_PLACES,
+        null=True,
+        help_text="Quantity in base unit",
+    )
+    quantity_unit = models.CharField(
+        max_length=QUANTITY_UNIT_MAX_LENGTH, blank=True, help_text="Base unit: ml or g"
+    )
     image_thumb_url = models.URLField()
     image_url = models.URLField()
     ingredients_text = models.TextField()
@@ -41,17 +70,51 @@ class Product(models.Model):
     #       + " ")
     keywords = models.TextField()
 
+    # search_vector = to_tsvector('french', keywords)
+    # Only on PostgreSQL: column generated by the database itself (GIN indexed).
+    # See migration 0002_product_search_vector.
+    # Trigram GIN indexes on UPPER(keywords) and UPPER(name) (PostgreSQL only).
+    # See migration 0003_product_trigram_indexes.
+    # tokens = keywords split on spaces and commas (text[], GIN indexed)
+    # Only on PostgreSQL: column generated by the database itself.
+    # See migration 0007_product_tokens.
+
     # nutriments_100g = these to string =>(
     # nutriments["energy-kcal"], nut..["fat_100g"], ["fat_unit"], ["fiber_100g"], ["fiber_unit"],
     # ["proteins_100g"], ["proteins_unit"], ["salt_100g"], ["salt_unit"], ["sugar_100g"], ["sugar_unit"])
     nutriments = models.JSONField()
+    # Typed copies of nutriments (per 100 g) for the range filters (see NUTRITION_FACTS)
+    energy_kcal_100g = models.FloatField(null=True)
+    fat_100g = models.FloatField(null=True)
+    fiber_100g = models.FloatField(null=True)
+    proteins_100g = models.FloatField(null=True)
+    salt_100g = models.FloatField(null=True)
+    sugars_100g = models.FloatField(null=True)
     nutriscore_grade = models.CharField(max_length=2)
     stores = models.TextField()
     url = models.URLField()
 
     # Metadata
     class Meta:
-        ordering = ["name"]
+        ordering = ["name", "id"]
+        indexes = [
+            # Keyset pagination of the search results (see get_page_of_products)
+            models.Index(fields=["name", "id"], name="products_name_id_idx"),
+            # Searches constrained by a quantity (see find_original_products)
+            models.Index(
+                fields=["quantity_unit", "quantity_value"], name="products_quantity_idx"
+            ),
+            # Covering index: the grades of the candidate substitutes are read with an
+            # index only scan (see find_substitute_products). PostgreSQL only.
+            models.Index(
+                fields=["id"], include=["nutriscore_grade"], name="products_id_grade_idx"
+            ),
+            # Range filters on the nutrition facts (see find_substitute_products)
+            *(
+                models.Index(fields=[column], name=f"products_{column}_idx")
+                for column in NUTRITION_FACTS
+            ),
+        ]
 
     # Methods
     def __str__(self):
@@ -67,13 +130,27 @@ class Product(models.Model):
             return False
 
         is_new_product_added = False
+        new_products = []  # (id, keywords) of the added products for the search index
+        touched_products = []  # Added products or products added to new categories
         try:
             with transaction.atomic():  # Commit only if all queries have been done with success
+                # Categories of the products already stored (a single query)
+                stored_categories = {}
+                for original_id, category in Category.products.through.objects.filter(
+                    product__original_id__in=[product._id for product in products]
+                ).values_list("product__original_id", "category__name"):
+                    stored_categories.setdefault(original_id, set()).add(category)
+
                 for product in products:
                     try:
                         stored_product = Product.objects.get(original_id=product._id)
+                        if set(product.categories) - stored_categories.get(
+                            stored_product.original_id, set()
+                        ):
+                            touched_products.append(TouchedProduct(product=stored_product))
                     except Product.DoesNotExist:  # if the product is not already stored
                         is_new_product_added = True
+                        quantity = utils.parse_quantity(product.quantity)
                         stored_product = Product(
                             brands=product.brands,
                             code=product.code,
@@ -83,13 +160,19 @@ class Product(models.Model):
                             keywords=product.mega_keywords,
                             name=product.product_name_fr,
                             nutriments=product.nutriments,
+                            # Added by etl_transform.transform_product
+                            **getattr(product, "nutrition_facts", {}),
                             nutriscore_grade=product.nutriscore_grade,
                             original_id=product._id,
                             quantity=product.quantity,
+                            quantity_unit=quantity.unit if quantity else "",
+                            quantity_value=quantity.value if quantity else None,
                             stores=product.stores,
                             url=product.url,
                         )
                         stored_product.save()
+                        new_products.append((stored_product.id, stored_product.keywords))
+                        touched_products.append(TouchedProduct(product=stored_product))
                     except Exception as e:
                         raise Exception(str(e))
 
@@ -97,6 +180,11 @@ class Product(models.Model):
                         stored_category = Category.objects.get(name=category)
                         stored_category.products.add(stored_product)
 
+                # Their substitutes and the ones of the products sharing a category
+                # with them have to be recomputed (see ProductSubstitute.refresh)
+                TouchedProduct.objects.bulk_create(touched_products)
+                transaction.on_commit(lambda: search_index.add_products(new_products))
+
             if not is_new_product_added:
                 print("No new product added to the database!")
             return True
@@ -105,9 +193,14 @@ class Product(models.Model):
             return False
 
     @classmethod
-    def find_original_products(cls, keywords: str):
+    def find_original_products(cls, keywords: str, mode: str = None):
         """Get products by keywords.
-        All the keywords must be in product.keywords for the product to get selected.
+        All the keywords must be in product.keywords for the product to get selected
+        (a quantity must be the quantity of the product, whatever its unit).
+        mode: name of the search backend (see products.search_backends):
+            SEARCH_MODE_ICONTAINS, SEARCH_MODE_FULL_TEXT, SEARCH_MODE_FUZZY,
+            SEARCH_MODE_TOKENS, SEARCH_MODE_MEMORY or the dotted path of a backend
+            (default: settings.PRODUCTS_SEARCH_MODE)
         return: list of products
         """
         if not (keywords and isinstance(keywords, str)):
@@ -115,23 +208,356 @@ class Product(models.Model):
 
         keywords = keywords.replace(",", " ")
         keywords_as_list = keywords.split()
+        if not keywords_as_list:
+            return Product.objects.none()
+
+        # A bar code is found with the index of Product.code instead of the keywords
+        if len(keywords_as_list) == 1 and utils.is_barcode(keywords_as_list[0]):
+            products_with_this_code = Product.objects.filter(code=int(keywords_as_list[0]))
+            if products_with_this_code.exists():
+                return products_with_this_code
+
+        # A quantity (e.g.: "33cl") is compared to the indexed Product.quantity_value
+        # in its base unit (so "330ml" and "0,33 l" find it too) or searched in the
+        # keywords like the other keywords: the first quantity of Product.quantity can
+        # be missing or another one (e.g.: "6 x 33 cl, 1,98 l")
+        quantities, other_keywords = cls._split_quantities(keywords_as_list)
+
+        mode = mode or settings.PRODUCTS_SEARCH_MODE
+        backend = search_backends.get_backend(mode)
+
+        def search():
+            products = backend.search(other_keywords) if other_keywords else Product.objects.all()
+            for keyword, quantity in quantities:
+                products = products.filter(
+                    Q(quantity_unit=quantity.unit, quantity_value=quantity.value)
+                    | Q(id__in=backend.search([keyword]).values("id"))
+                )
+            return products
+
+        # A sampled search is compared with the shadow backend after the response,
+        # with the products served (not on a hit of the cache)
+        shadow_backend = search_backends.get_shadow_backend(backend) if other_keywords else None
+        is_cached = backend.is_cached and caches.search_results_cache.max_size > 0
+        if not (is_cached or shadow_backend):
+            return search()
+
+        # Many spellings of the same search give the same normalized keywords
+        cache_key = f"{mode}:{' '.join(keywords_as_list)}"
+        catalog_version = caches.get_catalog_version()
+
+        product_ids = None
+        if is_cached:
+            product_ids = caches.search_results_cache.get(cache_key, catalog_version)
+        if product_ids is None:
+            product_ids = cls._find_product_ids(search(), other_keywords, backend, shadow_backend)
+            if is_cached:
+                caches.search_results_cache.set(cache_key, catalog_version, product_ids)
+
+        if len(product_ids) > SEARCH_CACHE_MAX_RESULTS:
+            return search()
+        if backend.is_ranked and other_keywords:
+            return Product.find_in_order(product_ids)
+        return Product.objects.filter(id__in=product_ids)
+
+    @staticmethod
+    def _split_quantities(keywords_as_list: list[str]) -> tuple[list, list[str]]:
+        """Return the [(keyword, Quantity)] of the quantities and the other keywords."""
 
-        # First element of the params
-        params = Q(keywords__icontains=keywords_as_list[0])
-        # Add all of the the other params to make the query to the db
-        for keyword in keywords_as_list[1:]:
-            params &= Q(keywords__icontains=keyword)
+        quantities = []
+        other_keywords = []
+        for keyword in keywords_as_list:
+            quantity = utils.as_quantity(keyword)
+            if quantity is None:
+                other_keywords.append(keyword)
+            else:
+                quantities.append((keyword, quantity))
+        return quantities, other_keywords
 
-        products = Product.objects.filter(params)
+    @staticmethod
+    def _find_product_ids(products, keywords_as_list: list[str], backend, shadow_backend):
+        """Return the ids of the first SEARCH_CACHE_MAX_RESULTS products found (one more
+        id tells that the search is too broad to be served from its ids).
+        products: queryset of the search of backend
+        shadow_backend: if not None, the search is compared with it after the response"""
+
+        start = time.perf_counter()
+        product_ids = list(products.values_list("id", flat=True)[: SEARCH_CACHE_MAX_RESULTS + 1])
+        latency = (time.perf_counter() - start) * 1000
+
+        # The overlap with the shadow search is meaningless on a truncated list
+        if shadow_backend is not None and len(product_ids) <= SEARCH_CACHE_MAX_RESULTS:
+            search_backends.compare_with_shadow_backend_later(
+                keywords_as_list, backend, product_ids, latency, shadow_backend
+            )
+        return product_ids
+
+    @classmethod
+    def find_in_order(cls, product_ids: list[int]):
+        """Queryset of these products in the order of the list (e.g.: the ids of a
+        ranked search). It is annotated with rank: the first product has the highest."""
+
+        if not product_ids:
+            return Product.objects.none()
+
+        if connection.vendor == "postgresql":
+            position = RawSQL(
+                "array_position(%s::bigint[], products_product.id)",
+                (list(product_ids),),
+                output_field=IntegerField(),
+            )
+        else:
+            position = Case(
+                *(
+                    When(id=product_id, then=Value(index))
+                    for index, product_id in enumerate(product_ids, 1)
+                ),
+                output_field=IntegerField(),
+            )
+        return (
+            Product.objects.filter(id__in=product_ids)
+            .annotate(rank=-position)
+            .order_by("-rank")
+        )
+
+    @classmethod
+    def find_by_barcode(cls, code: str):
+        """Return the product having this bar code (indexed lookup) or None."""
+
+        if not utils.is_barcode(code):
+            return None
+        return (
+            Product.objects.filter(code=int(code))
+            .only("id", "nutriscore_grade")
+            .order_by("id")
+            .first()
+        )
+
+    @classmethod
+    def find_original_products_in_batch(
+        cls, queries: list[str], k: int = BATCH_SEARCH_DEFAULT_K, mode: str = None
+    ) -> list[list[dict]]:
+        """Search many queries at once (e.g.: the lines of a shopping list).
+        Each query finds the same products as find_original_products, in the order of
+        the list of the search results (get_page_of_products), and keeps the first k.
+        The queries without bar code nor quantity are resolved together:
+        - memory mode: the in memory index answers every query then the matching
+          products are fetched with a single query (ordered by name then id), as long
+          as they are at most SEARCH_CACHE_MAX_RESULTS.
+        - tokens mode on PostgreSQL: a single statement, the queries (planned like the
+          tokens search) are unnested then each one selects its first k products
+          having all of its keywords as tokens (lateral join on the GIN indexed
+          tokens column).
+        The other queries (and the other modes) are searched one by one.
+        return: for each query, the list of its matching products (as dicts)
+        """
+
+        fields = ["id", "name", "brands", "nutriscore_grade", "image_thumb_url"]
+        keywords_of_queries = [
+            " ".join(utils.format_text(query).replace(",", " ").split())
+            if query and isinstance(query, str)
+            else ""
+            for query in queries
+        ]
+        mode = mode or settings.PRODUCTS_SEARCH_MODE
+        results = [[] for _ in queries]
+
+        # The bar codes and the quantities are handled by find_original_products
+        plain_queries = {
+            position: keywords.split()
+            for position, keywords in enumerate(keywords_of_queries)
+            if keywords and cls._is_plain_search(keywords.split())
+        }
+
+        if mode == SEARCH_MODE_MEMORY:
+            inverted_index = search_index.get_inverted_index()
+            ids_of_queries = {}
+            all_ids = set()
+            for position, keywords_as_list in plain_queries.items():
+                ids = set(inverted_index.search(keywords_as_list))
+                if len(all_ids | ids) <= SEARCH_CACHE_MAX_RESULTS:
+                    ids_of_queries[position] = ids
+                    all_ids |= ids
+
+            if all_ids:
+                products = Product.objects.filter(id__in=all_ids).order_by("name", "id")
+                for product in products.values(*fields):
+                    for position, ids in ids_of_queries.items():
+                        if product["id"] in ids and len(results[position]) < k:
+                            results[position].append(product)
+            searched_positions = set(ids_of_queries)
+
+        elif mode == SEARCH_MODE_TOKENS and connection.vendor == "postgresql":
+            frequencies = TokenFrequency.frequencies(
+                keyword for keywords_as_list in plain_queries.values()
+                for keyword in keywords_as_list
+            )
+            planned_keywords_of_queries = [
+                " ".join(TokenFrequency.plan(plain_queries[position], True, frequencies))
+                if position in plain_queries
+                else ""
+                for position in range(len(queries))
+            ]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                        SELECT q.position, p.{", p.".join(fields)}
+                        FROM unnest(%s::text[]) WITH ORDINALITY AS q(keywords, position)
+                        CROSS JOIN LATERAL (
+                            SELECT {", ".join(fields)}
+                            FROM products_product
+                            WHERE tokens @> regexp_split_to_array(q.keywords, ' ')
+                            ORDER BY name, id
+                            LIMIT %s
+                        ) AS p
+                        WHERE q.keywords <> ''
+                        ORDER BY q.position, p.name, p.id
+                    """,
+                    (planned_keywords_of_queries, k),
+                )
+                for position, *values in cursor.fetchall():
+                    results[position - 1].append(dict(zip(fields, values)))
+            searched_positions = set(plain_queries)
+
+        else:
+            searched_positions = set()
+
+        for position, keywords in enumerate(keywords_of_queries):
+            if keywords and position not in searched_positions:
+                results[position] = list(
+                    cls.order_for_display(cls.find_original_products(keywords, mode))
+                    .values(*fields)[:k]
+                )
+        return results
+
+    @staticmethod
+    def _is_plain_search(keywords_as_list: list[str]) -> bool:
+        """True if the keywords contain neither a bar code nor a quantity."""
+
+        if len(keywords_as_list) == 1 and utils.is_barcode(keywords_as_list[0]):
+            return False
+        return all(utils.as_quantity(keyword) is None for keyword in keywords_as_list)
+
+    @classmethod
+    def filter_by_facets(cls, products, nutriscore_grade: str = "", category: str = ""):
+        """Keep the products having this nutriscore grade and/or in this category."""
+
+        if nutriscore_grade:
+            products = products.filter(nutriscore_grade=nutriscore_grade)
+        if category:
+            products = products.filter(categories__name=category)
         return products
 
+    @classmethod
+    def get_facets(cls, products, max_categories: int = FACET_MAX_CATEGORIES) -> dict:
+        """Count the products per nutriscore grade and per category (the most used
+        categories first) with a single query.
+        products: queryset of the products found
+        return: {"nutriscore_grade": [(grade, count), ...], "categories": [(name, count), ...]}
+        """
+
+        facets = {"nutriscore_grade": [], "categories": []}
+        matching_ids_sql, params = products.order_by().values("id").query.sql_with_params()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                    WITH matching AS ({matching_ids_sql})
+                    SELECT 'nutriscore_grade', nutriscore_grade, COUNT(*)
+                        FROM products_product
+                        WHERE id IN (SELECT id FROM matching)
+                        GROUP BY nutriscore_grade
+                    UNION ALL
+                    SELECT * FROM (
+                        SELECT 'categories', c.name, COUNT(*) AS nbr_of_products
+                            FROM products_category_products cp
+                            INNER JOIN products_category c ON c.id = cp.category_id
+                            WHERE cp.product_id IN (SELECT id FROM matching)
+                            GROUP BY c.name
+                            ORDER BY nbr_of_products DESC, c.name
+                            LIMIT %s
+                    ) AS top_categories
+                """,
+                (*params, max_categories),
+            )
+            for facet, value, count in cursor.fetchall():
+                facets[facet].append((value, count))
+
+        facets["nutriscore_grade"].sort()
+        return facets
+
+    @classmethod
+    def get_page_of_products(
+        cls, products, cursor: str = "", page_size: int = ORIGINAL_PRODUCTS_PER_PAGE
+    ) -> tuple[list, str]:
+        """Keyset (seek) pagination of a queryset of products ordered by rank then id
+        if the products are ranked (e.g.: full_text search), otherwise by name then id.
+        cursor: given by the previous page ("" for the first page)
+        Only the fields displayed in the list of products are fetched.
+        Return the products of the page and the cursor of the next page
+        ("" if this is the last page).
+        """
+
+        is_ranked = "rank" in products.query.annotations
+        products = cls.order_for_display(
+            products.only("id", "name", "brands", "image_thumb_url", "nutriscore_grade")
+        )
+
+        # A cursor of another order (e.g.: the search mode changed) gives the first page
+        if last_product_of_previous_page := utils.decode_cursor(cursor):
+            sort_value, product_id = last_product_of_previous_page
+            if is_ranked and not isinstance(sort_value, str):
+                products = products.filter(
+                    Q(rank__lt=sort_value) | Q(rank=sort_value, id__gt=product_id)
+                )
+            elif not is_ranked and isinstance(sort_value, str):
+                products = products.filter(
+                    Q(name__gt=sort_value) | Q(name=sort_value, id__gt=product_id)
+                )
+
+        # One more product to know if there is a next page
+        page = list(products[: page_size + 1])
+        if len(page) <= page_size:
+            return page, ""
+
+        page = page[:page_size]
+        last_product = page[-1]
+        return page, utils.encode_cursor(
+            last_product.rank if is_ranked else last_product.name, last_product.id
+        )
+
+    @classmethod
+    def order_for_display(cls, products):
+        """Order the products as in the list of the search results: the most relevant
+        first if they are ranked, otherwise by name (then by id)."""
+
+        if "rank" in products.query.annotations:
+            return products.order_by("-rank", "id")
+        return products.order_by("name", "id")
+
     @classmethod
     def find_substitute_products(
-        cls, original_product_id: str, original_product_nutriscore: str
+        cls,
+        original_product_id: str,
+        original_product_nutriscore: str,
+        nutrient_constraints: dict = None,
+        max_category_ratio: float = None,
+        engine: str = None,
     ):
         """Returns a list of substitute products for a given product id.
         The products will be selected according to the number of categories in common
         with the original one then according to their nutriscore_grade (A to E).
+        nutrient_constraints (optional) are resolved in SQL on the typed columns of the
+        nutrition facts: {"<column>__<lt|lte|gt|gte>": number or NUTRIENT_OF_ORIGINAL}
+        E.g.: {"sugars_100g__lt": NUTRIENT_OF_ORIGINAL, "fat_100g__lte": 10} selects
+        the substitutes with less sugars than the original product and at most 10 g of fat.
+        A product whose nutrient is unknown does not match a constraint on it.
+        max_category_ratio: the categories found in more than this ratio of the products
+        are not counted (default: settings.PRODUCTS_SUBSTITUTES_MAX_CATEGORY_RATIO).
+        See Category.substitute_memberships
+        engine: SUBSTITUTES_ENGINE_SQL or SUBSTITUTES_ENGINE_MINHASH (approximate, only
+        without nutrient_constraints nor max_category_ratio).
+        Default: settings.PRODUCTS_SUBSTITUTES_ENGINE
         """
 
         if not (
@@ -167,6 +593,30 @@ class Product(models.Model):
                     "original_product_nutriscore must be ONE letter from a to e!"
                 )
 
+        engine = engine or settings.PRODUCTS_SUBSTITUTES_ENGINE
+        # The MinHash index only knows the categories (capped with the settings)
+        if (
+            engine == SUBSTITUTES_ENGINE_MINHASH
+            and not nutrient_constraints
+            and max_category_ratio is None
+        ):
+            substitutes = cls._find_approximate_substitutes(
+                original_product_id,
+                original_product_nutriscore,
+                [
+                    "id", "name", "brands", "code", "original_id", "quantity", "keywords",
+                    "url", "image_url", "image_thumb_url", "nutriscore_grade",
+                    "ingredients_text", "stores", "nutriments",
+                ],
+            )
+            if substitutes is not None:
+                return substitutes
+
+        nutrient_conditions, nutrient_params = cls._nutrient_conditions(
+            nutrient_constraints, original_product_id
+        )
+        memberships, memberships_params = Category.substitute_memberships(max_category_ratio)
+
         product_fields_as_str = (
             "p.id,"
             "p.name,"
@@ -186,45 +636,59 @@ class Product(models.Model):
 
         try:
             with connection.cursor() as cursor:
+                # The categories in common are counted on the ids only (index only scans
+                # of products_category_products), then only the best ids are joined back
+                # to products_product. See SQL/get_substitutes_by_ids.sql
                 cursor.execute(
                     f"""
+                        WITH best_substitutes AS (
+                            SELECT
+                                cp.product_id,
+                                COUNT(*) AS weight,
+                                p.nutriscore_grade
+                            FROM
+                                products_category_products cp
+                            INNER JOIN
+                                products_product p
+                                ON p.id = cp.product_id
+                            WHERE
+                                cp.category_id IN (
+                                    SELECT category_id
+                                    FROM {memberships} m
+                                    WHERE product_id = %s
+                                )
+                                AND p.nutriscore_grade < %s
+                                {nutrient_conditions}
+                            GROUP BY
+                                cp.product_id,
+                                p.nutriscore_grade
+                            ORDER BY
+                                weight DESC,
+                                p.nutriscore_grade ASC,
+                                cp.product_id ASC
+                            LIMIT %s
+                        )
                         SELECT
                             {product_fields_as_str}
-                    """
-                    " %s"
-                    """,
-                            COUNT(product_id) AS weight
-                        from
+                            %s,
+                            b.weight
+                        FROM
+                            best_substitutes b
+                        INNER JOIN
                             products_product p
-                        inner join
-                            products_category_products
-                            on p.id = product_id
-                        where
-                            category_id in (select cp.category_id from products_product p
-                                        inner join products_category_products cp
-                                            on p.id = cp.product_id
-                                        where p.id =
-                    """
-                    " %s"
-                    """)
-                            and nutriscore_grade <
-                    """
-                    "  %s"
-                    f"""
-                        GROUP BY
-                             {product_fields_as_str}
-                            product_id
+                            ON p.id = b.product_id
                         ORDER BY
-                             weight desc,
-                            p.nutriscore_grade asc
-                        limit
-                    """
-                    "  %s",
+                            b.weight DESC,
+                            p.nutriscore_grade ASC,
+                            p.id ASC
+                    """,
                     [
-                        original_product_id,
+                        *memberships_params,
                         original_product_id,
                         original_product_nutriscore,
+                        *nutrient_params,
                         MAX_NBR_OF_SUBSTITUTE_PRODUCTS,
+                        original_product_id,
                     ],
                 )
 
@@ -249,15 +713,19 @@ class Product(models.Model):
                 "weight",
             ]
 
+            # The driver returns the jsonb/json column as a JSON text: it is decoded by
+            # the JSONField itself, as for the products fetched with the ORM
+            nutriments_field = Product._meta.get_field("nutriments")
+
             # Creation of the following:
             # products = [{field1:val1, field2: val2}, {field1:val1, field2: val2}...]
             products = [
                 {
                     fields[i]: val
-                    if fields[i] != "nutriments"  # "nutriments" is a json into a string
+                    if fields[i] != "nutriments"
                     else {
-                        "nutriment": ast.literal_eval(val)
-                    }  # "nutriments" => str to json
+                        "nutriment": nutriments_field.from_db_value(val, None, connection)
+                    }
                     for i, val in enumerate(product)
                 }
                 for product in rows
@@ -270,6 +738,311 @@ class Product(models.Model):
 
         return products
 
+    @classmethod
+    def _find_approximate_substitutes(
+        cls, original_product_id, nutriscore_grade: str, fields: list[str]
+    ):
+        """Return the substitutes found with the MinHash index (in the format of
+        find_substitute_products, with these fields) or None without NumPy."""
+
+        from products import substitute_engine
+
+        minhash_index = substitute_engine.get_minhash_index()
+        if minhash_index is None:
+            return None
+
+        ids_and_weights = minhash_index.find_substitutes(
+            int(original_product_id), nutriscore_grade
+        )
+        products_by_id = {
+            product["id"]: product
+            for product in Product.objects.filter(
+                id__in=[substitute_id for substitute_id, _ in ids_and_weights]
+            ).values(*fields)
+        }
+        substitutes = []
+        for substitute_id, weight in ids_and_weights:
+            product = products_by_id.get(substitute_id)
+            if product is None:  # Deleted since the index was built
+                continue
+            substitutes.append(
+                {
+                    **product,
+                    "nutriments": {"nutriment": product["nutriments"]},
+                    "product_to_substitute_id": original_product_id,
+                    "weight": weight,
+                }
+            )
+        return substitutes
+
+    @classmethod
+    def find_substitutes_in_batch(cls, product_ids: list[int]) -> dict[int, list[dict]]:
+        """Return {product id: its substitutes (as dicts, with their weight)} for many
+        products at once (e.g.: a basket or a list of favorites), with a single SQL
+        statement whatever the number of products. The substitutes of each product are
+        the ones of find_substitute_products (better than its own nutriscore_grade).
+        They are read from the table ProductSubstitute if it is up to date with the
+        catalog, otherwise they are computed:
+        - PostgreSQL: the best substitutes of each product are selected by a lateral
+          join (the query of find_substitute_products), then ranked with ROW_NUMBER.
+        - Otherwise: all the (product, substitute) pairs are ranked with ROW_NUMBER.
+        The unknown ids are ignored.
+        """
+
+        fields = ["id", "name", "brands", "nutriscore_grade", "image_thumb_url"]
+        product_ids = sorted(set(product_ids))
+        if not product_ids:
+            return {}
+
+        memberships, memberships_params = Category.substitute_memberships()
+
+        if connection.vendor == "postgresql":
+            originals = "SELECT unnest(%s::bigint[]) AS product_id"
+            originals_params = [product_ids]
+            computed_substitutes = f"""
+                SELECT
+                    o.product_id,
+                    b.product_id AS substitute_id,
+                    b.weight,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY o.product_id
+                        ORDER BY b.weight DESC, b.nutriscore_grade ASC, b.product_id ASC
+                    ) AS rank
+                FROM originals o
+                INNER JOIN products_product op ON op.id = o.product_id
+                CROSS JOIN LATERAL (
+                    SELECT cp.product_id, COUNT(*) AS weight, p.nutriscore_grade
+                    FROM products_category_products cp
+                    INNER JOIN products_product p ON p.id = cp.product_id
+                    WHERE cp.category_id IN (
+                        SELECT category_id
+                        FROM {memberships} m
+                        WHERE product_id = o.product_id
+                    )
+                    AND p.nutriscore_grade < op.nutriscore_grade
+                    GROUP BY cp.product_id, p.nutriscore_grade
+                    ORDER BY weight DESC, p.nutriscore_grade ASC, cp.product_id ASC
+                    LIMIT {MAX_NBR_OF_SUBSTITUTE_PRODUCTS}
+                ) b
+            """
+        else:
+            originals = (
+                f"SELECT id AS product_id FROM products_product "
+                f"WHERE id IN ({', '.join(['%s'] * len(product_ids))})"
+            )
+            originals_params = product_ids
+            computed_substitutes = f"""
+                SELECT
+                    o.product_id,
+                    s.product_id AS substitute_id,
+                    COUNT(*) AS weight,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY o.product_id
+                        ORDER BY COUNT(*) DESC, sp.nutriscore_grade ASC, s.product_id ASC
+                    ) AS rank
+                FROM originals
+                INNER JOIN {memberships} o
+                    ON o.product_id = originals.product_id
+                INNER JOIN products_category_products s ON s.category_id = o.category_id
+                INNER JOIN products_product op ON op.id = o.product_id
+                INNER JOIN products_product sp ON sp.id = s.product_id
+                WHERE sp.nutriscore_grade < op.nutriscore_grade
+                GROUP BY o.product_id, s.product_id, sp.nutriscore_grade
+            """
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH originals AS ({originals}),
+                is_precomputed AS (
+                    SELECT COUNT(*) > 0 AS value
+                    FROM products_catalogversion
+                    WHERE id = 1 AND substitutes_version = number
+                ),
+                ranked_substitutes AS (
+                    SELECT s.product_id, s.substitute_id, s.weight, s.rank
+                    FROM originals o
+                    INNER JOIN products_productsubstitute s ON s.product_id = o.product_id
+                    WHERE (SELECT value FROM is_precomputed)
+                    UNION ALL
+                    SELECT product_id, substitute_id, weight, rank
+                    FROM ({computed_substitutes}) computed_substitutes
+                    WHERE NOT (SELECT value FROM is_precomputed)
+                )
+                SELECT r.product_id, r.weight, p.{", p.".join(fields)}
+                FROM ranked_substitutes r
+                INNER JOIN products_product p ON p.id = r.substitute_id
+                WHERE r.rank <= %s
+                ORDER BY r.product_id, r.rank
+                """,
+                originals_params + memberships_params + [MAX_NBR_OF_SUBSTITUTE_PRODUCTS],
+            )
+            rows = cursor.fetchall()
+
+        substitutes = {}
+        for product_id, weight, *values in rows:
+            substitutes.setdefault(product_id, []).append(
+                {**dict(zip(fields, values)), "weight": weight}
+            )
+        return substitutes
+
+    @classmethod
+    def find_cached_substitutes(cls, product_id, nutriscore_grade: str = None):
+        """Same as find_product_and_substitutes, through caches.substitutes_cache
+        (key: product id and grade, for the current version of the catalog)."""
+
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return None, []
+
+        def fill():
+            product, substitutes = cls.find_product_and_substitutes(product_id, nutriscore_grade)
+            return None if product is None else (product, substitutes)
+
+        product_and_substitutes = caches.substitutes_cache.get_or_fill(
+            (product_id, nutriscore_grade or ""), caches.get_catalog_version(), fill
+        )
+        return product_and_substitutes or (None, [])
+
+    @staticmethod
+    def _nutrient_conditions(nutrient_constraints: dict, original_product_id: str):
+        """Return the SQL conditions (on the products_product aliased p) and their params
+        for the nutrient_constraints of find_substitute_products."""
+
+        operators = {"lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+        conditions = []
+        params = []
+        for lookup, value in (nutrient_constraints or {}).items():
+            column, _, operator = lookup.rpartition("__")
+            # The column and the operator are written in the SQL: only known ones pass
+            if column not in NUTRITION_FACTS or operator not in operators:
+                raise Exception(
+                    "Error in products.models.Product.find_substitute_products()! "
+                    f"Unknown nutrient constraint: {lookup}"
+                )
+            if value == NUTRIENT_OF_ORIGINAL:
+                conditions.append(
+                    f"AND p.{column} {operators[operator]} "
+                    f"(SELECT {column} FROM products_product WHERE id = %s)"
+                )
+                params.append(original_product_id)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                conditions.append(f"AND p.{column} {operators[operator]} %s")
+                params.append(value)
+            else:
+                raise Exception(
+                    "Error in products.models.Product.find_substitute_products()! "
+                    f"The value of {lookup} must be a number or NUTRIENT_OF_ORIGINAL"
+                )
+        return " ".join(conditions), params
+
+    @classmethod
+    def find_product_and_substitutes(cls, product_id, nutriscore_grade: str = None):
+        """Return (product, substitute products) with a single query.
+        The substitutes are selected and ordered as in find_substitute_products (they
+        have a better nutriscore_grade than nutriscore_grade, by default the one of
+        the product) and returned in the same format.
+        They are read from the table ProductSubstitute if it is up to date with the
+        catalog, otherwise they are computed.
+        With the approximate engine (settings.PRODUCTS_SUBSTITUTES_ENGINE), the product
+        then its substitutes are fetched with the MinHash index.
+        product is None if no product has this id."""
+
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return None, []
+
+        if settings.PRODUCTS_SUBSTITUTES_ENGINE == SUBSTITUTES_ENGINE_MINHASH:
+            product = Product.objects.filter(id=product_id).first()
+            if product is None:
+                return None, []
+            substitutes = cls._find_approximate_substitutes(
+                product_id,
+                nutriscore_grade or product.nutriscore_grade,
+                [field.attname for field in Product._meta.concrete_fields],
+            )
+            if substitutes is not None:
+                return product, substitutes
+
+        columns = ", ".join(
+            f"p.{field.column} AS {field.column}" for field in Product._meta.concrete_fields
+        )
+        memberships, memberships_params = Category.substitute_memberships()
+
+        # The product is the first row (is_original = 1), followed by its substitutes
+        rows = Product.objects.raw(
+            f"""
+            WITH original AS (
+                SELECT id, nutriscore_grade, COALESCE(%s, nutriscore_grade) AS better_than
+                FROM products_product
+                WHERE id = %s
+            ),
+            is_precomputed AS (
+                SELECT COUNT(*) > 0 AS value
+                FROM products_catalogversion v, original o
+                WHERE v.id = 1
+                AND v.substitutes_version = v.number
+                AND o.better_than = o.nutriscore_grade
+            ),
+            substitutes AS (
+                SELECT substitute_id AS id, weight
+                FROM products_productsubstitute
+                WHERE product_id = %s AND (SELECT value FROM is_precomputed)
+                UNION ALL
+                SELECT id, weight
+                FROM (
+                    SELECT p.id, COUNT(cp.product_id) AS weight
+                    FROM products_product p
+                    INNER JOIN products_category_products cp ON p.id = cp.product_id
+                    WHERE cp.category_id IN (
+                        SELECT category_id FROM {memberships} m WHERE product_id = %s
+                    )
+                    AND p.nutriscore_grade < (SELECT better_than FROM original)
+                    GROUP BY p.id, p.nutriscore_grade
+                    ORDER BY weight DESC, p.nutriscore_grade ASC, p.id ASC
+                    LIMIT %s
+                ) computed_substitutes
+                WHERE NOT (SELECT value FROM is_precomputed)
+            )
+            SELECT {columns}, 1 AS is_original, NULL AS weight
+            FROM products_product p
+            INNER JOIN original o ON p.id = o.id
+            UNION ALL
+            SELECT {columns}, 0 AS is_original, s.weight
+            FROM products_product p
+            INNER JOIN substitutes s ON p.id = s.id
+            ORDER BY is_original DESC, weight DESC, nutriscore_grade ASC, id ASC
+            """,
+            [
+                nutriscore_grade or None,
+                product_id,
+                product_id,
+                *memberships_params,
+                product_id,
+                MAX_NBR_OF_SUBSTITUTE_PRODUCTS,
+            ],
+        )
+
+        product = None
+        substitute_products = []
+        for row in rows:
+            if row.is_original:
+                product = row
+                continue
+
+            substitute_product = {
+                field.attname: getattr(row, field.attname)
+                for field in Product._meta.concrete_fields
+            }
+            substitute_product["nutriments"] = {"nutriment": row.nutriments}
+            substitute_product["product_to_substitute_id"] = product_id
+            substitute_product["weight"] = row.weight
+            substitute_products.append(substitute_product)
+
+        return product, substitute_products
+
 
 class L_Favorite(models.Model):
     customer = models.ForeignKey(
@@ -290,6 +1063,9 @@ class L_Favorite(models.Model):
 class Category(models.Model):
     name = models.CharField(max_length=255, unique=True)
     products = models.ManyToManyField("Product", related_name="categories")
+    # Refreshed after each load of products (see refresh_frequencies). The categories
+    # found in most of the products are not used to find the substitutes.
+    nbr_of_products = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ["name"]
@@ -330,6 +1106,435 @@ class Category(models.Model):
         except Exception as e:
             logging.error("Error adding categories. Exception was: %s", e)
 
+    @classmethod
+    def refresh_frequencies(cls) -> int:
+        """Count the products of each category with a single UPDATE then return the
+        number of categories."""
+
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE products_category
+                SET nbr_of_products = (
+                    SELECT COUNT(*)
+                    FROM products_category_products
+                    WHERE category_id = products_category.id
+                )
+                """
+            )
+            nbr_of_categories = cursor.rowcount
+
+        logging.info(
+            "Frequencies of %s categories refreshed in %.2f s",
+            nbr_of_categories,
+            time.perf_counter() - start,
+        )
+        return nbr_of_categories
+
+    @classmethod
+    def max_substitute_frequency(cls, max_category_ratio: float = None):
+        """Return the maximum number of products of a category used to find the
+        substitutes or None if all the categories are used.
+        max_category_ratio: default settings.PRODUCTS_SUBSTITUTES_MAX_CATEGORY_RATIO"""
+
+        if max_category_ratio is None:
+            max_category_ratio = settings.PRODUCTS_SUBSTITUTES_MAX_CATEGORY_RATIO
+        if max_category_ratio >= 1:
+            return None
+
+        nbr_of_products = caches.get_catalog_size()
+        if not nbr_of_products:  # The frequencies have not been computed yet
+            return None
+        return int(max_category_ratio * nbr_of_products)
+
+    @classmethod
+    def too_general_ids(cls, max_category_ratio: float = None) -> list[int]:
+        """Return the ids (sorted) of the categories left out of the substitutes."""
+
+        max_frequency = cls.max_substitute_frequency(max_category_ratio)
+        if max_frequency is None:
+            return []
+        return list(
+            cls.objects.filter(nbr_of_products__gt=max_frequency)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+    @classmethod
+    def substitute_memberships(cls, max_category_ratio: float = None) -> tuple[str, list]:
+        """Return (SQL relation, params): the (product_id, category_id) used to find the
+        substitutes of each product. A category found in more than max_category_ratio
+        of the products (e.g.: "Snacks") is too general to compare two products: it is
+        left out, unless all the categories of the product are too general.
+        Without a cap, the relation is products_category_products itself."""
+
+        max_frequency = cls.max_substitute_frequency(max_category_ratio)
+        if max_frequency is None:
+            return "products_category_products", []
+
+        return (
+            """(
+                SELECT cp.product_id, cp.category_id
+                FROM products_category_products cp
+                INNER JOIN products_category c ON c.id = cp.category_id
+                WHERE c.nbr_of_products <= %s
+                OR NOT EXISTS (
+                    SELECT 1
+                    FROM products_category_products other_cp
+                    INNER JOIN products_category other_c ON other_c.id = other_cp.category_id
+                    WHERE other_cp.product_id = cp.product_id
+                    AND other_c.nbr_of_products <= %s
+                )
+            )""",
+            [max_frequency, max_frequency],
+        )
+
+
+class CatalogVersion(models.Model):
+    """Version of the catalog of products (a single row).
+    The number is incremented after each load of products into the database
+    so that the caches built with the previous catalog get invalidated."""
+
+    number = models.PositiveIntegerField(default=0)
+    datetime = models.DateTimeField(auto_now=True)
+    # Used to estimate the selectivity of the keywords (see TokenFrequency)
+    nbr_of_products = models.PositiveIntegerField(default=0)
+    # Version of the catalog the table ProductSubstitute was computed with.
+    # The precomputed substitutes are used only if it is the current version.
+    substitutes_version = models.PositiveIntegerField(default=0)
+    # Ids of the categories left out of the substitutes when the table
+    # ProductSubstitute was computed (see Category.substitute_memberships)
+    substitutes_too_general_categories = models.JSONField(default=list)
+
+    def __str__(self):
+        return f"Catalog version {self.number} ({str(self.datetime)[:16]})"
+
+    @classmethod
+    def current(cls) -> int:
+        return cls.objects.filter(id=1).values_list("number", flat=True).first() or 0
+
+    @classmethod
+    def current_state(cls) -> tuple[int, int]:
+        """Return the version of the catalog and its number of products."""
+
+        return cls.objects.filter(id=1).values_list("number", "nbr_of_products").first() or (0, 0)
+
+    @classmethod
+    def bump(cls, nbr_of_products: int = None) -> int:
+        """Increment the version of the catalog then return the new version.
+        nbr_of_products: number of products of the new version (unchanged if None)"""
+
+        with transaction.atomic():
+            version, _ = cls.objects.select_for_update().get_or_create(id=1)
+            version.number = F("number") + 1
+            update_fields = ["number", "datetime"]
+            if nbr_of_products is not None:
+                version.nbr_of_products = nbr_of_products
+                update_fields.append("nbr_of_products")
+            version.save(update_fields=update_fields)
+            version.refresh_from_db()
+
+        logging.info("The catalog is now at version %s", version.number)
+        return version.number
+
+
+class TokenFrequency(models.Model):
+    """Number of products containing each token of Product.keywords.
+    Refreshed after each load of products into the database. Used to plan the
+    searches: the rarest keyword is checked first, the keywords found in most of the
+    products are ignored and a keyword found in no product gives no result at once."""
+
+    token = models.CharField(max_length=TOKEN_MAX_LENGTH, unique=True)
+    frequency = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.token}: {self.frequency}"
+
+    @classmethod
+    def refresh(cls) -> int:
+        """Count the products containing each token then replace the table.
+        Return the number of products."""
+
+        start = time.perf_counter()
+        token_counts = Counter()
+        nbr_of_products = 0
+        for keywords in Product.objects.values_list("keywords", flat=True).iterator(chunk_size=5000):
+            # Same tokens as the column products_product.tokens (see migration 0007)
+            token_counts.update(set(keywords.replace(",", " ").split()))
+            nbr_of_products += 1
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                (
+                    cls(token=token, frequency=frequency)
+                    for token, frequency in token_counts.items()
+                    if len(token) <= TOKEN_MAX_LENGTH
+                ),
+                batch_size=5000,
+            )
+
+        logging.info(
+            "Frequencies of %s tokens of %s products refreshed in %.2f s",
+            len(token_counts),
+            nbr_of_products,
+            time.perf_counter() - start,
+        )
+        return nbr_of_products
+
+    @classmethod
+    def plan(
+        cls, keywords_as_list: list[str], is_exact_match: bool, frequencies: dict = None
+    ) -> list[str]:
+        """Return the keywords to search, the rarest first, without the keywords found
+        in more than SEARCH_STOP_TOKEN_RATIO of the products (at least one keyword is
+        kept). Return an empty list if no product can match.
+        is_exact_match: True if the keywords must be whole tokens. Otherwise a keyword
+        unknown as a token can still be a part of a token (icontains).
+        frequencies: token => frequency of (at least) the keywords, queried if None"""
+
+        nbr_of_products = caches.get_catalog_size()
+        if not nbr_of_products:  # The frequencies have not been computed yet
+            return keywords_as_list
+
+        keywords_as_list = list(dict.fromkeys(keywords_as_list))  # Without duplicates
+        if frequencies is None:
+            frequencies = cls.frequencies(keywords_as_list)
+
+        if is_exact_match:
+            for keyword in keywords_as_list:
+                if keyword not in frequencies:
+                    logging.info(
+                        "Search plan: no product contains %r. %s rows not scanned",
+                        keyword,
+                        nbr_of_products,
+                    )
+                    return []
+
+        # Part of a token: the number of products containing it is unknown
+        planned_keywords = sorted(
+            keywords_as_list, key=lambda keyword: frequencies.get(keyword, nbr_of_products)
+        )
+        first_keyword = planned_keywords[0]
+        rows_saved = (
+            frequencies.get(keywords_as_list[0], nbr_of_products)
+            - frequencies.get(first_keyword, nbr_of_products)
+        )
+        if rows_saved > 0:
+            logging.info(
+                "Search plan: %r checked first instead of %r. ~%s fewer rows to check "
+                "with the next keywords",
+                first_keyword,
+                keywords_as_list[0],
+                rows_saved,
+            )
+
+        nbr_of_candidates = frequencies.get(first_keyword, nbr_of_products)
+        for keyword in planned_keywords[1:]:
+            ratio = frequencies.get(keyword, 0) / nbr_of_products
+            if ratio > SEARCH_STOP_TOKEN_RATIO:
+                planned_keywords.remove(keyword)
+                logging.info(
+                    "Search plan: %r ignored (in %.0f%% of the products). ~%s rows "
+                    "not checked",
+                    keyword,
+                    ratio * 100,
+                    nbr_of_candidates,
+                )
+
+        return planned_keywords
+
+    @classmethod
+    def frequencies(cls, tokens) -> dict:
+        """token => number of products containing it (unknown tokens are left out)"""
+
+        return dict(cls.objects.filter(token__in=set(tokens)).values_list("token", "frequency"))
+
+
+class ProductSubstitute(models.Model):
+    """Substitutes of each product, precomputed after each load of products into the
+    database (command: refreshsubstitutes). Same selection and same order as
+    Product.find_substitute_products: rank 1 is the best substitute."""
+
+    # Indexed by products_substitute_product_rank
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="+", db_index=False
+    )
+    substitute = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    weight = models.PositiveIntegerField(help_text="Nbr of categories in common")
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            # The substitutes of a product are read with a range scan of this index
+            models.UniqueConstraint(
+                fields=["product", "rank"], name="products_substitute_product_rank"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} => {self.substitute_id} (rank {self.rank})"
+
+    @classmethod
+    def _insert_substitutes(cls, product_ids: list[int] = None) -> int:
+        """Compute then insert the substitutes of the products (all of them if
+        product_ids is None). Return the number of rows inserted."""
+
+        memberships, params = Category.substitute_memberships()
+        products_filter = ""
+        if product_ids is not None:
+            products_filter = f"AND o.product_id IN ({', '.join(['%s'] * len(product_ids))})"
+            params += list(product_ids)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO products_productsubstitute (product_id, substitute_id, weight, rank)
+                SELECT product_id, substitute_id, weight, rank
+                FROM (
+                    SELECT
+                        o.product_id,
+                        s.product_id AS substitute_id,
+                        COUNT(*) AS weight,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY o.product_id
+                            ORDER BY COUNT(*) DESC, sp.nutriscore_grade ASC, s.product_id ASC
+                        ) AS rank
+                    FROM {memberships} o
+                    INNER JOIN products_category_products s
+                        ON s.category_id = o.category_id
+                    INNER JOIN products_product op ON op.id = o.product_id
+                    INNER JOIN products_product sp ON sp.id = s.product_id
+                    WHERE sp.nutriscore_grade < op.nutriscore_grade
+                    {products_filter}
+                    GROUP BY o.product_id, s.product_id, sp.nutriscore_grade
+                ) ranked_substitutes
+                WHERE rank <= %s
+                """,
+                params + [MAX_NBR_OF_SUBSTITUTE_PRODUCTS],
+            )
+            return cursor.rowcount
+
+    @classmethod
+    def _find_affected_products(cls, last_touched_product_id: int) -> list[int]:
+        """Return the ids of the products whose substitutes may have been changed by
+        the products touched since the last refresh: the touched products and the
+        products for which a touched product now ranks before their last substitute
+        (or which have less than MAX_NBR_OF_SUBSTITUTE_PRODUCTS substitutes)."""
+
+        memberships, memberships_params = Category.substitute_memberships()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH touched AS (
+                    SELECT DISTINCT product_id
+                    FROM products_touchedproduct
+                    WHERE id <= %s
+                ),
+                candidates AS (
+                    SELECT
+                        o.product_id,
+                        s.product_id AS substitute_id,
+                        sp.nutriscore_grade,
+                        COUNT(*) AS weight
+                    FROM touched t
+                    INNER JOIN products_category_products s ON s.product_id = t.product_id
+                    INNER JOIN {memberships} o ON o.category_id = s.category_id
+                    INNER JOIN products_product op ON op.id = o.product_id
+                    INNER JOIN products_product sp ON sp.id = s.product_id
+                    WHERE sp.nutriscore_grade < op.nutriscore_grade
+                    GROUP BY o.product_id, s.product_id, sp.nutriscore_grade
+                )
+                SELECT product_id FROM touched
+                UNION
+                SELECT c.product_id
+                FROM candidates c
+                LEFT JOIN products_productsubstitute last_substitute
+                    ON last_substitute.product_id = c.product_id AND last_substitute.rank = %s
+                LEFT JOIN products_product lp ON lp.id = last_substitute.substitute_id
+                WHERE last_substitute.id IS NULL
+                OR c.weight > last_substitute.weight
+                OR (
+                    c.weight = last_substitute.weight
+                    AND (
+                        c.nutriscore_grade < lp.nutriscore_grade
+                        OR (c.nutriscore_grade = lp.nutriscore_grade AND c.substitute_id < lp.id)
+                    )
+                )
+                """,
+                [last_touched_product_id, *memberships_params, MAX_NBR_OF_SUBSTITUTE_PRODUCTS],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    @classmethod
+    def refresh(cls, incremental: bool = False, batch_size: int = 500) -> int:
+        """Recompute the substitutes with INSERT ... SELECT then return the number of
+        rows inserted.
+        incremental: only recompute the substitutes of the products affected by the
+        products touched since the last refresh (see TouchedProduct and
+        _find_affected_products). The other rows are left untouched.
+        The rows are replaced within a transaction: until it is committed, the readers
+        keep seeing the previous substitutes (never a half-built table)."""
+
+        start = time.perf_counter()
+        catalog_version = CatalogVersion.current()
+        last_touched_product_id = TouchedProduct.objects.aggregate(Max("id"))["id__max"] or 0
+
+        if incremental and not CatalogVersion.objects.filter(substitutes_version__gt=0).exists():
+            logging.info("The substitutes have never been computed. Full refresh instead.")
+            incremental = False
+
+        # A category crossing the cap changes the weights of all of its products
+        # (loads change the frequencies and the size of the catalog)
+        too_general_ids = Category.too_general_ids()
+        previous_too_general_ids = (
+            CatalogVersion.objects.filter(id=1)
+            .values_list("substitutes_too_general_categories", flat=True)
+            .first()
+        )
+        if incremental and too_general_ids != previous_too_general_ids:
+            logging.info("Categories crossed the cap of the substitutes. Full refresh instead.")
+            incremental = False
+
+        with transaction.atomic():
+            if incremental:
+                product_ids = cls._find_affected_products(last_touched_product_id)
+                nbr_of_rows = 0
+                for first in range(0, len(product_ids), batch_size):
+                    last = first + batch_size
+                    batch_of_ids = product_ids[first:last]
+                    cls.objects.filter(product_id__in=batch_of_ids).delete()
+                    nbr_of_rows += cls._insert_substitutes(batch_of_ids)
+            else:
+                cls.objects.all().delete()
+                nbr_of_rows = cls._insert_substitutes()
+
+            TouchedProduct.objects.filter(id__lte=last_touched_product_id).delete()
+            CatalogVersion.objects.filter(id=1).update(
+                substitutes_version=catalog_version,
+                substitutes_too_general_categories=too_general_ids,
+            )
+
+        logging.info(
+            "%s substitutes refreshed (%s) in %.2f s",
+            nbr_of_rows,
+            f"incremental: {len(product_ids)} products" if incremental else "full",
+            time.perf_counter() - start,
+        )
+        return nbr_of_rows
+
+
+class TouchedProduct(models.Model):
+    """Product added to the database (or to new categories) since the last refresh
+    of the substitutes (see ProductSubstitute.refresh)."""
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    datetime = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.product_id} ({str(self.datetime)[:16]})"
+
 
 class ReceivedMessage(models.Model):
     datetime = models.DateTimeField(auto_now_add=True)
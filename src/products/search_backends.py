@@ -0,0 +1,326 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import Func, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Greatest, Upper
+from django.utils.module_loading import import_string
+
+from products import search_index
+from .constants import (
+    SEARCH_FUZZY_MAX_RESULTS,
+    SEARCH_MODE_FULL_TEXT,
+    SEARCH_MODE_FUZZY,
+    SEARCH_MODE_ICONTAINS,
+    SEARCH_MODE_MEMORY,
+    SEARCH_MODE_TOKENS,
+    SEARCH_SHADOW_MAX_PENDING,
+    SEARCH_TEXT_CONFIG,
+)
+
+
+class SearchBackend:
+    """Engine used by Product.find_original_products.
+    search() receives the keywords normalized by utils.format_text (as a list) and
+    returns the queryset of the products containing ALL the keywords.
+    A backend is selected by its name or by its dotted path with the setting
+    PRODUCTS_SEARCH_MODE (e.g.: "full_text" or "my_app.search.MyBackend")."""
+
+    name = ""
+    requires_postgresql = False
+    is_cached = True  # The ids found are kept in caches.search_results_cache
+    # The products are annotated with their rank (the most relevant first)
+    is_ranked = False
+
+    def is_available(self) -> bool:
+        return not self.requires_postgresql or connection.vendor == "postgresql"
+
+    def search(self, keywords_as_list: list[str]):
+        raise NotImplementedError
+
+
+class IcontainsBackend(SearchBackend):
+    """One ILIKE '%keyword%' per keyword (the rarest keyword first)."""
+
+    name = SEARCH_MODE_ICONTAINS
+
+    def search(self, keywords_as_list: list[str]):
+        from products.models import Product, TokenFrequency
+
+        # The rarest keyword is checked first
+        keywords_as_list = TokenFrequency.plan(keywords_as_list, is_exact_match=False)
+
+        # First element of the params
+        params = Q(keywords__icontains=keywords_as_list[0])
+        # Add all of the the other params to make the query to the db
+        for keyword in keywords_as_list[1:]:
+            params &= Q(keywords__icontains=keyword)
+
+        return Product.objects.filter(params)
+
+
+class FullTextBackend(SearchBackend):
+    """Select the products whose search_vector matches ALL the keywords
+    (GIN index lookup) then order them by relevance (ts_rank)."""
+
+    name = SEARCH_MODE_FULL_TEXT
+    requires_postgresql = True
+    is_ranked = True
+
+    def search(self, keywords_as_list: list[str]):
+        from products.models import Product
+
+        ts_query = f"plainto_tsquery('{SEARCH_TEXT_CONFIG}', %s)"
+        keywords = " ".join(keywords_as_list)
+
+        return (
+            Product.objects.filter(
+                RawSQL(
+                    f"search_vector @@ {ts_query}",
+                    (keywords,),
+                    output_field=models.BooleanField(),
+                )
+            )
+            .annotate(
+                # float8: the rank is compared exactly to the one of a cursor
+                rank=RawSQL(
+                    f"ts_rank(search_vector, {ts_query})::float8",
+                    (keywords,),
+                    output_field=models.FloatField(),
+                )
+            )
+            .order_by("-rank", "name")
+        )
+
+
+class FuzzyBackend(SearchBackend):
+    """Typo tolerant search (e.g.: "nutela" finds "nutella").
+    Select the products whose keywords contain words similar to the keywords
+    (operator <%) or whose name is similar to the keywords (operator %).
+    Both operators use the GIN trigram indexes.
+    Only the SEARCH_FUZZY_MAX_RESULTS most similar products are returned,
+    ordered from the most similar to the least similar.
+    """
+
+    name = SEARCH_MODE_FUZZY
+    requires_postgresql = True
+    is_ranked = True
+
+    def search(self, keywords_as_list: list[str]):
+        from products.models import Product
+
+        keywords = Value(" ".join(keywords_as_list))
+        upper_keywords = Upper("keywords")
+        upper_name = Upper("name")
+
+        similarity = Greatest(
+            Func(keywords, upper_keywords, function="word_similarity", output_field=models.FloatField()),
+            Func(keywords, upper_name, function="similarity", output_field=models.FloatField()),
+        )
+        # "%%" is the escaped "%" for the database driver
+        is_similar = Q(
+            Func(keywords, upper_keywords, template="(%(expressions)s)", arg_joiner=" <%% ",
+                 output_field=models.BooleanField())
+        ) | Q(
+            Func(keywords, upper_name, template="(%(expressions)s)", arg_joiner=" %% ",
+                 output_field=models.BooleanField())
+        )
+
+        most_similar_ids = (
+            Product.objects.filter(is_similar)
+            .annotate(similarity=similarity)
+            .order_by("-similarity", "name")
+            .values("id")[:SEARCH_FUZZY_MAX_RESULTS]
+        )
+
+        # Filtering on a subquery (instead of slicing) lets the caller refine the queryset
+        return (
+            Product.objects.filter(id__in=most_similar_ids)
+            .annotate(rank=Cast(similarity, models.FloatField()))
+            .order_by("-rank", "name")
+        )
+
+
+class TokensBackend(SearchBackend):
+    """Select the products having ALL the keywords as whole tokens
+    (array containment, GIN index lookup): "lait" does not match "laitue"."""
+
+    name = SEARCH_MODE_TOKENS
+    requires_postgresql = True
+
+    def search(self, keywords_as_list: list[str]):
+        from products.models import Product, TokenFrequency
+
+        keywords_as_list = TokenFrequency.plan(keywords_as_list, is_exact_match=True)
+        if not keywords_as_list:
+            return Product.objects.none()
+
+        return Product.objects.filter(
+            RawSQL(
+                "tokens @> %s::text[]",
+                (keywords_as_list,),
+                output_field=models.BooleanField(),
+            )
+        )
+
+
+class MemoryBackend(SearchBackend):
+    """In process inverted index (see products.search_index).
+    Only the final fetch of the matching products by primary key hits the db."""
+
+    name = SEARCH_MODE_MEMORY
+    is_cached = False  # The index is faster than the cache
+
+    def search(self, keywords_as_list: list[str]):
+        from products.models import Product
+
+        product_ids = search_index.get_inverted_index().search(keywords_as_list)
+        return Product.objects.filter(id__in=list(product_ids))
+
+
+BUILT_IN_BACKENDS = {
+    backend.name: backend
+    for backend in (IcontainsBackend, FullTextBackend, FuzzyBackend, TokensBackend, MemoryBackend)
+}
+
+
+def get_backend(name: str = None) -> SearchBackend:
+    """Return the backend named name (a built-in name or a dotted path to a subclass
+    of SearchBackend). Default: settings.PRODUCTS_SEARCH_MODE.
+    Fall back to icontains (with a warning) if the backend is unknown or unavailable."""
+
+    name = name or settings.PRODUCTS_SEARCH_MODE
+
+    backend_class = BUILT_IN_BACKENDS.get(name)
+    if backend_class is None:
+        try:
+            backend_class = import_string(name)
+        except ImportError:
+            logging.warning("Unknown search mode: %s. Searching with icontains instead.", name)
+            return IcontainsBackend()
+
+    backend = backend_class()
+    if not backend.is_available():
+        logging.warning(
+            "The %s search requires PostgreSQL. Searching with icontains instead.", name
+        )
+        return IcontainsBackend()
+    return backend
+
+
+def get_shadow_backend(backend: SearchBackend) -> SearchBackend:
+    """Return the shadow backend (settings.PRODUCTS_SEARCH_SHADOW_MODE) if this search
+    is in the sample (settings.PRODUCTS_SEARCH_SHADOW_SAMPLE_RATE), otherwise None.
+    Used to try a new engine on the real traffic before switching to it."""
+
+    shadow_name = settings.PRODUCTS_SEARCH_SHADOW_MODE
+    if not shadow_name or random.random() >= settings.PRODUCTS_SEARCH_SHADOW_SAMPLE_RATE:
+        return None
+
+    shadow_backend = get_backend(shadow_name)
+    if type(shadow_backend) is type(backend):
+        return None
+    return shadow_backend
+
+
+def compare_with_shadow_backend(
+    keywords_as_list: list[str],
+    backend: SearchBackend,
+    product_ids: list[int],
+    latency: float,
+    shadow_backend: SearchBackend,
+):
+    """Run the same search with the shadow backend then log the latency of both
+    backends and the overlap of their results.
+    product_ids, latency (in ms): result of the search served by backend"""
+
+    try:
+        start = time.perf_counter()
+        shadow_product_ids = set(
+            shadow_backend.search(keywords_as_list).values_list("id", flat=True)
+        )
+        shadow_latency = (time.perf_counter() - start) * 1000
+    except Exception as e:  # The shadow search must never break the real one
+        logging.error("Shadow search of %s failed: %s", keywords_as_list, e)
+        return None
+
+    product_ids = set(product_ids)
+    all_product_ids = product_ids | shadow_product_ids
+    comparison = {
+        "keywords": " ".join(keywords_as_list),
+        "backend": backend.name,
+        "latency": latency,
+        "nbr_of_products": len(product_ids),
+        "shadow_backend": shadow_backend.name,
+        "shadow_latency": shadow_latency,
+        "shadow_nbr_of_products": len(shadow_product_ids),
+        # 1 when both backends find the same products
+        "overlap": len(product_ids & shadow_product_ids) / len(all_product_ids)
+        if all_product_ids
+        else 1.0,
+    }
+    logging.info(
+        "Shadow search %(keywords)r: %(backend)s %(latency).1f ms "
+        "(%(nbr_of_products)s products) | %(shadow_backend)s %(shadow_latency).1f ms "
+        "(%(shadow_nbr_of_products)s products) | overlap %(overlap).2f",
+        comparison,
+    )
+    return comparison
+
+
+_shadow_executor: ThreadPoolExecutor = None
+_shadow_executor_lock = threading.Lock()
+# Acquired before submitting a comparison and released once it is done: the pending
+# comparisons (and their product ids) are bounded
+_shadow_pending = threading.BoundedSemaphore(SEARCH_SHADOW_MAX_PENDING)
+
+
+def _compare_in_background(*args):
+    try:
+        return compare_with_shadow_backend(*args)
+    finally:
+        connection.close()  # Connection of the thread of the executor
+        _shadow_pending.release()
+
+
+def compare_with_shadow_backend_later(
+    keywords_as_list: list[str],
+    backend: SearchBackend,
+    product_ids: list[int],
+    latency: float,
+    shadow_backend: SearchBackend,
+) -> Optional[Future]:
+    """compare_with_shadow_backend in a background thread: the shadow search does not
+    delay the response. The search is not compared (None is returned) if
+    SEARCH_SHADOW_MAX_PENDING comparisons are already waiting."""
+
+    global _shadow_executor
+
+    if not _shadow_pending.acquire(blocking=False):
+        logging.warning(
+            "Shadow search of %s dropped: %s comparisons pending",
+            keywords_as_list,
+            SEARCH_SHADOW_MAX_PENDING,
+        )
+        return None
+
+    try:
+        with _shadow_executor_lock:
+            if _shadow_executor is None:
+                _shadow_executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="shadow-search"
+                )
+        future = _shadow_executor.submit(
+            _compare_in_background,
+            keywords_as_list, backend, list(product_ids), latency, shadow_backend,
+        )
+    except Exception:
+        _shadow_pending.release()
+        raise
+    return future
@@ -0,0 +1,257 @@
+import heapq
+import logging
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from products import caches, utils
+from .constants import (
+    AUTOCOMPLETE_MAX_SUGGESTIONS,
+    AUTOCOMPLETE_PRECOMPUTED_PREFIX_LENGTH,
+    SEARCH_INDEX_REFRESH_INTERVAL,
+)
+
+
+# Product ids are stored as unsigned 64 bits integers (8 bytes per id): Product.id is a
+# BigAutoField
+POSTING_TYPECODE = "Q"
+
+
+def tokenize(keywords: str) -> list[str]:
+    """Split keywords into tokens the same way find_original_products does."""
+
+    if not (keywords and isinstance(keywords, str)):
+        return []
+    return utils.format_text(keywords).replace(",", " ").split()
+
+
+def intersect(small: array, large: array) -> array:
+    """Intersection of two sorted posting lists.
+    Each id of the small list is searched in the large one by bisection, starting
+    from the position of the previous id found."""
+
+    result = array(POSTING_TYPECODE)
+    position = 0
+    len_large = len(large)
+    for product_id in small:
+        position = bisect_left(large, product_id, position)
+        if position == len_large:
+            break
+        if large[position] == product_id:
+            result.append(product_id)
+    return result
+
+
+class InvertedIndex:
+    """In memory inverted index: token => sorted array of product ids.
+    Answers AND queries on Product.keywords without querying the database."""
+
+    def __init__(self):
+        self.postings: dict[str, array] = {}
+        self.nbr_of_products = 0
+        self.max_product_id = 0
+        self.last_refresh = time.monotonic()
+
+    def add(self, product_id: int, keywords: str):
+        """Add a product to the index.
+        Ids are appended to the posting lists so products must be added by
+        increasing id (new products always have a bigger id)."""
+
+        for token in set(tokenize(keywords)):
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = array(POSTING_TYPECODE)
+
+            if posting and posting[-1] > product_id:
+                posting.insert(bisect_left(posting, product_id), product_id)
+            else:
+                posting.append(product_id)
+
+        self.nbr_of_products += 1
+        self.max_product_id = max(self.max_product_id, product_id)
+
+    def add_many(self, rows):
+        """rows: iterable of (product_id, keywords) ordered by product_id"""
+        for product_id, keywords in rows:
+            if product_id > self.max_product_id:
+                self.add(product_id, keywords)
+
+    def search(self, keywords_as_list: list[str]) -> array:
+        """Return the sorted ids of the products containing ALL the keywords."""
+
+        postings = []
+        for keyword in keywords_as_list:
+            posting = self.postings.get(keyword)
+            if not posting:  # No product contains this keyword
+                return array(POSTING_TYPECODE)
+            postings.append(posting)
+
+        if not postings:
+            return array(POSTING_TYPECODE)
+
+        # Start with the rarest keyword so that the intersections stay small
+        postings.sort(key=len)
+        product_ids = postings[0]
+        for posting in postings[1:]:
+            product_ids = intersect(product_ids, posting)
+            if not product_ids:
+                break
+        return product_ids
+
+    def memory_usage(self) -> dict:
+        """Approximate memory used by the index (in bytes)."""
+
+        size_of_postings = sum(sys.getsizeof(posting) for posting in self.postings.values())
+        size_of_tokens = sum(sys.getsizeof(token) for token in self.postings)
+        total = sys.getsizeof(self.postings) + size_of_postings + size_of_tokens
+
+        return {
+            "nbr_of_products": self.nbr_of_products,
+            "nbr_of_tokens": len(self.postings),
+            "total_bytes": total,
+            "bytes_per_product": total / self.nbr_of_products if self.nbr_of_products else 0,
+        }
+
+
+_inverted_index: InvertedIndex = None
+_lock = threading.Lock()
+
+
+def _fetch_products(min_product_id: int = 0):
+    from products.models import Product
+
+    return (
+        Product.objects.filter(id__gt=min_product_id)
+        .order_by("id")
+        .values_list("id", "keywords")
+        .iterator(chunk_size=5000)
+    )
+
+
+def build_inverted_index() -> InvertedIndex:
+    start = time.perf_counter()
+    inverted_index = InvertedIndex()
+    inverted_index.add_many(_fetch_products())
+
+    memory = inverted_index.memory_usage()
+    logging.info(
+        "Inverted index built in %.2f s: %s products, %s tokens, %.1f MB "
+        "(%.0f bytes per product)",
+        time.perf_counter() - start,
+        memory["nbr_of_products"],
+        memory["nbr_of_tokens"],
+        memory["total_bytes"] / 1024 / 1024,
+        memory["bytes_per_product"],
+    )
+    return inverted_index
+
+
+def get_inverted_index() -> InvertedIndex:
+    """Return the index of this process. It is built on first use then patched with
+    the products added since (at most every SEARCH_INDEX_REFRESH_INTERVAL seconds)."""
+
+    global _inverted_index
+
+    with _lock:
+        if _inverted_index is None:
+            _inverted_index = build_inverted_index()
+
+        elif time.monotonic() - _inverted_index.last_refresh > SEARCH_INDEX_REFRESH_INTERVAL:
+            _inverted_index.add_many(_fetch_products(_inverted_index.max_product_id))
+            _inverted_index.last_refresh = time.monotonic()
+
+        return _inverted_index
+
+
+def add_products(rows):
+    """Patch the index of this process (if already built) with new products.
+    rows: iterable of (product_id, keywords)"""
+
+    with _lock:
+        if _inverted_index is not None:
+            _inverted_index.add_many(sorted(rows))
+
+
+def reset_inverted_index():
+    global _inverted_index
+
+    with _lock:
+        _inverted_index = None
+
+
+class PrefixIndex:
+    """Sorted table of the tokens of the products (keywords and brands) weighted by
+    the number of products using each token. Used for the autocompletion:
+    the tokens starting with a prefix are contiguous in the table (bisection).
+    The suggestions of the short prefixes (whose range of tokens is large) are
+    precomputed."""
+
+    def __init__(self, token_counts: Counter, catalog_version: int = 0):
+        self.tokens = sorted(token_counts)
+        self.weights = array("I", (token_counts[token] for token in self.tokens))
+        self.catalog_version = catalog_version
+
+        self.precomputed_suggestions: dict[str, list[str]] = {}
+        for length in range(1, AUTOCOMPLETE_PRECOMPUTED_PREFIX_LENGTH + 1):
+            prefixes = {token[:length] for token in self.tokens if len(token) >= length}
+            for prefix in prefixes:
+                self.precomputed_suggestions[prefix] = self._find_best_tokens(
+                    prefix, AUTOCOMPLETE_MAX_SUGGESTIONS
+                )
+
+    @classmethod
+    def from_rows(cls, rows, catalog_version: int = 0) -> "PrefixIndex":
+        """rows: iterable of (keywords, brands) of each product"""
+
+        token_counts = Counter()
+        for keywords, brands in rows:
+            token_counts.update(set(tokenize(keywords)) | set(tokenize(brands)))
+        return cls(token_counts, catalog_version)
+
+    def _find_best_tokens(self, prefix: str, limit: int) -> list[str]:
+        first = bisect_left(self.tokens, prefix)
+        last = bisect_left(self.tokens, prefix + "\uffff", first)
+        best_positions = heapq.nlargest(
+            limit, range(first, last), key=lambda position: self.weights[position]
+        )
+        return [self.tokens[position] for position in best_positions]
+
+    def suggest(self, prefix: str, limit: int = AUTOCOMPLETE_MAX_SUGGESTIONS) -> list[str]:
+        """Return the most used tokens starting with prefix (the most used first)."""
+
+        if not prefix:
+            return []
+        if limit <= AUTOCOMPLETE_MAX_SUGGESTIONS and prefix in self.precomputed_suggestions:
+            return self.precomputed_suggestions[prefix][:limit]
+        return self._find_best_tokens(prefix, limit)
+
+
+def build_prefix_index(catalog_version: int) -> PrefixIndex:
+    from products.models import Product
+
+    start = time.perf_counter()
+    rows = Product.objects.values_list("keywords", "brands").iterator(chunk_size=5000)
+    prefix_index = PrefixIndex.from_rows(rows, catalog_version)
+    logging.info(
+        "Prefix index built in %.2f s: %s tokens",
+        time.perf_counter() - start,
+        len(prefix_index.tokens),
+    )
+    return prefix_index
+
+
+# Prefix index of this process
+_prefix_index = caches.CatalogIndex("Prefix index", build_prefix_index)
+
+
+def get_prefix_index() -> PrefixIndex:
+    """Return the prefix index of this process (see caches.CatalogIndex)."""
+
+    return _prefix_index.get()
+
+
+def reset_prefix_index():
+    _prefix_index.reset()
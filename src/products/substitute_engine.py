@@ -0,0 +1,422 @@
+"""Vectorized substitute engine (optional, requires NumPy).
+
+The relation products_category_products is loaded once into two compact CSR
+matrices (product => category indices and category => product indices) so the
+categories in common of many products are counted with NumPy instead of SQL.
+The substitutes are the ones of Product.find_substitute_products: the products with
+a better nutriscore_grade, ordered by number of categories in common (desc) then
+nutriscore_grade then id, MAX_NBR_OF_SUBSTITUTE_PRODUCTS at most.
+"""
+import logging
+import time
+from bisect import bisect_left
+
+from django.db import connection
+
+from products import caches
+
+from .constants import MAX_NBR_OF_SUBSTITUTE_PRODUCTS
+from .models import Category
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency: pip install numpy
+    np = None
+
+
+def is_available() -> bool:
+    return np is not None
+
+
+def _gather(indptr, values, rows):
+    """Return (owners, gathered values): the values of each row of the CSR matrix
+    (indptr, values), concatenated. owners[i] is the position in rows of the row of
+    the i-th value."""
+
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    first_of_owners = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    positions = np.repeat(starts, lengths) + np.arange(len(owners)) - first_of_owners
+    return owners, values[positions]
+
+
+class CategoryMatrix:
+    """Products x categories of the database, as CSR matrices of indices.
+    The products are indexed by increasing id: comparing indices is comparing ids."""
+
+    def __init__(
+        self, product_ids, nutriscore_grades: list[str], memberships,
+        max_category_frequency: int = None,
+    ):
+        """product_ids: ids of all the products (in any order)
+        nutriscore_grades: nutriscore_grade of each product of product_ids
+        memberships: (product_id, category_id) of each row of products_category_products
+        max_category_frequency: the categories of more products are too general, they
+        are not counted (see Category.substitute_memberships). None: no cap
+        """
+        if np is None:
+            raise ImportError("The vectorized substitute engine requires NumPy: pip install numpy")
+
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        order = np.argsort(product_ids, kind="stable")
+        self.product_ids = product_ids[order]
+        # The grades are compared as strings (as in SQL) through their rank
+        self.grades = sorted(set(nutriscore_grades))
+        grade_ranks = {grade: rank for rank, grade in enumerate(self.grades)}
+        self.grade_codes = np.array(
+            [grade_ranks[grade] for grade in nutriscore_grades], dtype=np.int64
+        )[order]
+
+        memberships = np.asarray(memberships, dtype=np.int64).reshape(-1, 2)
+        member_products = np.searchsorted(self.product_ids, memberships[:, 0])
+        category_ids, member_categories = np.unique(memberships[:, 1], return_inverse=True)
+        self.nbr_of_products = len(self.product_ids)
+        self.nbr_of_categories = len(category_ids)
+
+        # Product => indices of its categories
+        order = np.lexsort((member_categories, member_products))
+        self.product_indptr = self._indptr(member_products, self.nbr_of_products)
+        self.product_categories = member_categories[order]
+        # Category => indices of its products (by increasing id)
+        order = np.lexsort((member_products, member_categories))
+        self.category_indptr = self._indptr(member_categories, self.nbr_of_categories)
+        self.category_products = member_products[order]
+        # Category => True if it has more than max_category_frequency products
+        self.is_too_general = (
+            np.zeros(self.nbr_of_categories, dtype=bool)
+            if max_category_frequency is None
+            else np.diff(self.category_indptr) > max_category_frequency
+        )
+
+    @staticmethod
+    def _indptr(rows, nbr_of_rows: int):
+        return np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=nbr_of_rows))))
+
+    @classmethod
+    def load(cls, max_category_ratio: float = None) -> "CategoryMatrix":
+        """Build the matrix from the database.
+        max_category_ratio: see Category.max_substitute_frequency"""
+
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id, nutriscore_grade FROM products_product")
+            products = cursor.fetchall()
+            cursor.execute("SELECT product_id, category_id FROM products_category_products")
+            memberships = cursor.fetchall()
+
+        matrix = cls(
+            [product_id for product_id, _ in products],
+            [nutriscore_grade for _, nutriscore_grade in products],
+            memberships,
+            Category.max_substitute_frequency(max_category_ratio),
+        )
+        logging.info(
+            "Category matrix of %s products and %s categories (%s memberships) "
+            "loaded in %.2f s",
+            matrix.nbr_of_products,
+            matrix.nbr_of_categories,
+            len(memberships),
+            time.perf_counter() - start,
+        )
+        return matrix
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            array.nbytes
+            for array in (
+                self.product_ids,
+                self.grade_codes,
+                self.product_indptr,
+                self.product_categories,
+                self.category_indptr,
+                self.category_products,
+                self.is_too_general,
+            )
+        )
+
+    def _thresholds(self, rows, nutriscore_grade: str = None):
+        """Grade codes the substitutes of each row must be strictly below."""
+
+        if nutriscore_grade is None:
+            return self.grade_codes[rows]
+        return np.full(len(rows), bisect_left(self.grades, nutriscore_grade), dtype=np.int64)
+
+    def _counted_categories(self, row):
+        """Categories of the product counted in common with its substitutes: the too
+        general ones are left out, unless all the categories of the product are."""
+
+        first, last = self.product_indptr[row], self.product_indptr[row + 1]
+        categories = self.product_categories[first:last]
+        is_too_general = self.is_too_general[categories]
+        if is_too_general.all():
+            return categories
+        return categories[~is_too_general]
+
+    def _overlaps(self, rows, thresholds):
+        """Return (owners, candidates, weights): the candidates (indices of products
+        with a better grade) sharing categories with each row, owners[i] being the
+        position in rows of the row of the i-th candidate, sorted by owner then
+        candidate."""
+
+        category_owners, categories = _gather(
+            self.product_indptr, self.product_categories, rows
+        )
+        is_too_general = self.is_too_general[categories]
+        if is_too_general.any():
+            # The products whose categories are all too general keep them
+            has_other_categories = np.bincount(
+                category_owners[~is_too_general], minlength=len(rows)
+            ) > 0
+            is_kept = ~is_too_general | ~has_other_categories[category_owners]
+            category_owners, categories = category_owners[is_kept], categories[is_kept]
+        candidate_owners, candidates = _gather(
+            self.category_indptr, self.category_products, categories
+        )
+        owners = category_owners[candidate_owners]
+        is_better = self.grade_codes[candidates] < thresholds[owners]
+        # One (owner, candidate) pair per category in common: count the duplicates
+        pairs, weights = np.unique(
+            owners[is_better] * self.nbr_of_products + candidates[is_better],
+            return_counts=True,
+        )
+        return pairs // self.nbr_of_products, pairs % self.nbr_of_products, weights
+
+    def _ranking_keys(self, candidates, weights):
+        """Keys sorting the candidates as find_substitute_products does:
+        weight desc, nutriscore_grade asc, id asc."""
+
+        return (
+            (weights.max() - weights) * len(self.grades) + self.grade_codes[candidates]
+        ) * self.nbr_of_products + candidates
+
+    def _top_substitutes(self, candidates, weights) -> list[tuple[int, int]]:
+        """(id, weight) of the MAX_NBR_OF_SUBSTITUTE_PRODUCTS best candidates, in order."""
+
+        keys = self._ranking_keys(candidates, weights)
+        if len(keys) > MAX_NBR_OF_SUBSTITUTE_PRODUCTS:
+            best = np.argpartition(keys, MAX_NBR_OF_SUBSTITUTE_PRODUCTS - 1)
+            best = best[:MAX_NBR_OF_SUBSTITUTE_PRODUCTS]
+        else:
+            best = np.arange(len(keys))
+        best = best[np.argsort(keys[best])]
+        return list(
+            zip(self.product_ids[candidates[best]].tolist(), weights[best].tolist())
+        )
+
+    def find_substitutes(
+        self, product_id: int, nutriscore_grade: str = None
+    ) -> list[tuple[int, int]]:
+        """Return the (substitute id, weight) of the substitutes of the product, better
+        than nutriscore_grade (by default, the grade of the product)."""
+
+        row = np.searchsorted(self.product_ids, product_id)
+        if row == self.nbr_of_products or self.product_ids[row] != product_id:
+            return []
+
+        rows = np.array([row])
+        _, candidates, weights = self._overlaps(rows, self._thresholds(rows, nutriscore_grade))
+        if len(candidates) == 0:
+            return []
+
+        return self._top_substitutes(candidates, weights)
+
+    def find_many_substitutes(
+        self, product_ids=None, batch_size: int = 256
+    ) -> dict[int, list[tuple[int, int]]]:
+        """Return {product id: [(substitute id, weight), ...]} for the products (all of
+        them if product_ids is None). Each product gets the substitutes with a better
+        grade than its own. The products are processed batch_size at a time."""
+
+        if product_ids is None:
+            rows = np.arange(self.nbr_of_products)
+        else:
+            product_ids = np.unique(np.asarray(list(product_ids), dtype=np.int64))
+            rows = np.searchsorted(self.product_ids, product_ids)
+            is_known = rows < self.nbr_of_products
+            is_known[is_known] = self.product_ids[rows[is_known]] == product_ids[is_known]
+            rows = rows[is_known]
+
+        substitutes = {}
+        for first in range(0, len(rows), batch_size):
+            last = first + batch_size
+            batch = rows[first:last]
+            owners, candidates, weights = self._overlaps(batch, self._thresholds(batch))
+            if len(candidates) == 0:
+                continue
+
+            # Sorted by owner then ranking: the first N of each owner are the substitutes
+            keys = owners * (len(self.grades) * self.nbr_of_products * (weights.max() + 1))
+            order = np.argsort(keys + self._ranking_keys(candidates, weights), kind="stable")
+            owners, candidates, weights = owners[order], candidates[order], weights[order]
+            first_of_owners = np.searchsorted(owners, owners)
+            is_kept = np.arange(len(owners)) - first_of_owners < MAX_NBR_OF_SUBSTITUTE_PRODUCTS
+
+            substitute_ids = self.product_ids[candidates[is_kept]].tolist()
+            substitute_weights = weights[is_kept].tolist()
+            owner_ids = self.product_ids[batch[owners[is_kept]]].tolist()
+            for owner_id, substitute_id, weight in zip(
+                owner_ids, substitute_ids, substitute_weights
+            ):
+                substitutes.setdefault(owner_id, []).append((substitute_id, weight))
+        return substitutes
+
+
+class MinHashIndex:
+    """Approximate mode of the engine for very large catalogs.
+    The set of categories of each product is summed up by a MinHash signature of
+    nbr_of_bands * rows_per_band hashes, split into bands: the products having the same
+    band are in the same bucket (LSH). The candidates of a product are the products of
+    its buckets only (they share many categories with it, with a high probability)
+    instead of all the products sharing a category with it. Their categories in common
+    are then counted exactly and ranked as in CategoryMatrix.find_substitutes."""
+
+    # Hashes (a * category + b) % MERSENNE_PRIME: a * category fits in 64 bits
+    MERSENNE_PRIME = (1 << 31) - 1
+
+    def __init__(
+        self,
+        matrix: CategoryMatrix,
+        nbr_of_bands: int = 32,
+        rows_per_band: int = 2,
+        max_bucket_size: int = 2000,
+        batch_size: int = 100_000,
+        seed: int = 42,
+    ):
+        """max_bucket_size: the buckets holding more products are ignored. They are the
+        bands made only of broad categories: they would bring back the fan out of the
+        exact engine."""
+
+        self.matrix = matrix
+        self.max_bucket_size = max_bucket_size
+        self.nbr_of_bands = nbr_of_bands
+        self.rows_per_band = rows_per_band
+        random_generator = np.random.default_rng(seed)
+        nbr_of_hashes = nbr_of_bands * rows_per_band
+        self.hash_a = random_generator.integers(1, self.MERSENNE_PRIME, nbr_of_hashes)
+        self.hash_b = random_generator.integers(0, self.MERSENNE_PRIME, nbr_of_hashes)
+
+        # Bucket of each product in each band, sorted to be found by bisection
+        band_keys = np.empty((nbr_of_bands, matrix.nbr_of_products), dtype=np.uint64)
+        for first in range(0, matrix.nbr_of_products, batch_size):
+            rows = np.arange(first, min(first + batch_size, matrix.nbr_of_products))
+            band_keys[:, rows] = self._band_keys(self._signatures(rows)).T
+
+        # The products without category are in no bucket
+        has_categories = np.diff(matrix.product_indptr) > 0
+        self.bucket_rows = []
+        self.bucket_keys = []
+        for keys in band_keys:
+            rows = np.flatnonzero(has_categories)
+            order = np.argsort(keys[rows], kind="stable")
+            self.bucket_rows.append(rows[order].astype(np.int32))
+            self.bucket_keys.append(keys[rows][order])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.bucket_rows + self.bucket_keys)
+
+    def _signatures(self, rows):
+        """MinHash signatures (one row of hashes per product of rows)."""
+
+        owners, categories = _gather(
+            self.matrix.product_indptr, self.matrix.product_categories, rows
+        )
+        hashes = (
+            np.outer(categories, self.hash_a) + self.hash_b
+        ) % self.MERSENNE_PRIME
+        signatures = np.full((len(rows), len(self.hash_a)), self.MERSENNE_PRIME, dtype=np.int64)
+        np.minimum.at(signatures, owners, hashes)
+        return signatures
+
+    def _band_keys(self, signatures):
+        """Key (64 bits) of each band of the signatures."""
+
+        keys = np.zeros((len(signatures), self.nbr_of_bands), dtype=np.uint64)
+        bands = signatures.reshape(len(signatures), self.nbr_of_bands, self.rows_per_band)
+        for row_of_band in range(self.rows_per_band):
+            # Wraps around modulo 2**64
+            keys = keys * np.uint64(0x9E3779B97F4A7C15) + bands[:, :, row_of_band].astype(
+                np.uint64
+            )
+        return keys
+
+    def find_candidates(self, product_id: int):
+        """Return the indices of the products sharing a bucket with the product."""
+
+        matrix = self.matrix
+        row = np.searchsorted(matrix.product_ids, product_id)
+        if row == matrix.nbr_of_products or matrix.product_ids[row] != product_id:
+            return np.array([], dtype=np.int64)
+
+        keys = self._band_keys(self._signatures(np.array([row])))[0]
+        candidates = []
+        for bucket_rows, bucket_keys, key in zip(self.bucket_rows, self.bucket_keys, keys):
+            first = np.searchsorted(bucket_keys, key)
+            last = np.searchsorted(bucket_keys, key, "right")
+            if last - first <= self.max_bucket_size:
+                candidates.append(bucket_rows[first:last])
+        if not candidates:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(candidates))
+
+    def find_substitutes(
+        self, product_id: int, nutriscore_grade: str = None
+    ) -> list[tuple[int, int]]:
+        """Same as CategoryMatrix.find_substitutes, among the candidates of the buckets."""
+
+        matrix = self.matrix
+        candidates = self.find_candidates(product_id)
+        if len(candidates) == 0:
+            return []
+
+        row = np.searchsorted(matrix.product_ids, product_id)
+        threshold = matrix._thresholds(np.array([row]), nutriscore_grade)[0]
+        candidates = candidates[matrix.grade_codes[candidates] < threshold]
+
+        # Exact number of categories in common with the candidates (without the too
+        # general ones, as in CategoryMatrix._overlaps)
+        categories = matrix._counted_categories(row)
+        owners, candidate_categories = _gather(
+            matrix.product_indptr, matrix.product_categories, candidates
+        )
+        weights = np.bincount(
+            owners[np.isin(candidate_categories, categories)], minlength=len(candidates)
+        )
+        candidates, weights = candidates[weights > 0], weights[weights > 0]
+        if len(candidates) == 0:
+            return []
+
+        return matrix._top_substitutes(candidates, weights)
+
+
+def build_minhash_index(catalog_version: int) -> MinHashIndex:
+    start = time.perf_counter()
+    minhash_index = MinHashIndex(CategoryMatrix.load())
+    minhash_index.catalog_version = catalog_version
+    logging.info(
+        "MinHash index built in %.2f s: %.1f MB",
+        time.perf_counter() - start,
+        minhash_index.nbytes / 1024 / 1024,
+    )
+    return minhash_index
+
+
+# MinHash index of this process
+_minhash_index = caches.CatalogIndex("MinHash index", build_minhash_index)
+
+
+def get_minhash_index() -> MinHashIndex:
+    """Return the MinHash index of this process (approximate substitutes, see
+    settings.PRODUCTS_SUBSTITUTES_ENGINE and caches.CatalogIndex) or None without
+    NumPy."""
+
+    if not is_available():
+        logging.warning("The MinHash index requires NumPy. Finding the substitutes with SQL instead.")
+        return None
+    return _minhash_index.get()
+
+
+def reset_minhash_index():
+    _minhash_index.reset()
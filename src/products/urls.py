@@ -5,8 +5,12 @@ from products import views
 urlpatterns = [
     # Home page
     path('home', views.home, name='products_home'),
+    # Route to get the suggestions of keywords while the user is typing
+    path('autocomplete', views.get_suggestions, name='products_autocomplete'),
     # Route to store the original product and its substitute to the database
     path('add_to_favorites', views.add_to_favorites, name='products_add_to_favorites'),
+    # Route for the staff to get the hit/miss counters of the caches
+    path('cache-stats', views.get_cache_stats, name='products_cache_stats'),
     # Route for the user to send a message
     path('contact', views.contact, name='products_contact'),
     # Route to get the details of a substitute product
@@ -19,6 +23,10 @@ urlpatterns = [
     path('get-origial-product', views.get_origial_product, name='products_get_origial_product'),
     # Route to get a list of substitute products for an original product
     path('get-substitutes', views.get_substitutes, name='products_get_substitutes'),
+    # Route for the partner apps to search many products in one request (json)
+    path('search-batch', views.search_batch, name='products_search_batch'),
+    # Route for the partner apps to get the substitutes of many products at once (json)
+    path('substitutes-batch', views.substitutes_batch, name='products_substitutes_batch'),
     # Route to go to the page of the legal notice
     path('legal_notice', views.legal_notice, name='products_legal_notice'),
     # Home page
@@ -1,7 +1,21 @@
+import base64
+import binascii
+import functools
+import json
 import logging
+import math
+import re
+import unicodedata
+from typing import Optional, Union
 from dataclasses import dataclass, fields  # Built in modules
+from decimal import Decimal
 
-from django.utils.text import slugify
+from .constants import (
+    BARCODE_MAX_LENGTH,
+    NUTRITION_FACTS,
+    QUANTITY_VALUE_DECIMAL_PLACES,
+    QUANTITY_VALUE_MAX_DIGITS,
+)
 
 
 @dataclass(init=False)
@@ -60,42 +74,217 @@ class WellFormedProduct:  # Model used for each product to get downloaded
                 setattr(self, "is_valid", True)
 
 
+def is_barcode(text: str) -> bool:
+    """Return True if the text is only made of digits (e.g.: EAN-13 "3017620422003")."""
+
+    if not (text and isinstance(text, str)):
+        return False
+    text = text.strip()
+    return text.isdigit() and text.isascii() and len(text) <= BARCODE_MAX_LENGTH
+
+
+def trie_pattern(words) -> str:
+    """Regex matching any of the words, built from the trie of the words
+    (e.g.: " a ", " au ", " aux " => " a(?: |u(?: |x ))") so that the regex engine
+    never tries the same prefix twice."""
+
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}  # End of a word
+
+    def to_pattern(node: dict) -> str:
+        alternatives = [
+            re.escape(char) + to_pattern(child) for char, child in sorted(node.items()) if char
+        ]
+        if not alternatives:
+            return ""
+        if len(alternatives) == 1 and "" not in node:
+            return alternatives[0]
+        pattern = "(?:" + "|".join(alternatives) + ")"
+        return pattern + "?" if "" in node else pattern
+
+    return to_pattern(trie)
+
+
+class ReplacementChain:
+    """Chain of str.replace() built once from a table of (old, new) substrings.
+    The replacements are applied in the order of the table, exactly like chained
+    calls of str.replace() (each one applies to the result of the previous one), but
+    the whole chain is skipped if none of the old substrings is in the text
+    (a single scan with the compiled trie of the old substrings).
+    """
+
+    def __init__(self, replacements):
+        self.replacements = tuple(replacements)
+        olds = {old for old, _ in self.replacements}
+        # An old substring containing another one can't be found without the other one
+        self.trigger = re.compile(
+            trie_pattern(old for old in olds if not any(other in old for other in olds - {old}))
+        )
+
+    def __call__(self, text: str) -> str:
+        if self.trigger.search(text) is None:
+            return text
+        for old, new in self.replacements:
+            text = text.replace(old, new)
+        return text
+
+
+UNWANTED_WORDS = (
+    " au ", " à ", " a ", " la ", " le ", " aux ", " en ", " et ", " de ", " des ", " du ",
+    " marque: ", " marques: ", " brands: ", " code: ",
+    " marque:", " marques:", " brands:", " code:",
+    " marques ", " brands ", " code ", " marque ",
+)
+remove_unwanted_words = ReplacementChain((word, " ") for word in UNWANTED_WORDS)
+replace_ampersand = ReplacementChain(((" & ", " et "), ("&", " et ")))
+
+# Units glued to their quantity (e.g.: "1,5 l" => "1,5l"). Keep the order (and the
+# duplicates): each replacement applies to the result of the previous one.
+UNITS = (
+    "l", "cl", "ml", "hl", "dl", "g", "kg", "kg", "mm", "cm", "dm", "m2", "m²", "m3", "m³",
+    "cm2", "cm²", "cm3", "cm³", "mm2", "mm²", "mm3", "mm³",
+)
+glue_unit_to_quantity = ReplacementChain(
+    [(f" {unit} ", f"{unit} ") for unit in UNITS]
+    + [(f" {unit},", f"{unit}, ") for unit in UNITS]
+)
+
+UNIT_WORDS = (
+    (" gramme ", "g "),
+    (" grammes ", "g "),
+    (" grame ", "g "),
+    (" grames ", "g "),
+    (" gram ", "g "),
+    (" grams ", "g "),
+    (" litre ", "l "),
+    (" litres ", "l "),
+    (" kilogramme ", "kg "),
+    (" kilogrammes ", "kg "),
+    (" kilogrames ", "kg "),
+    (" kilogrammes ", "kg "),
+    (" liter ", "l "),
+    (" liters ", "l "),
+)
+replace_unit_words = ReplacementChain(UNIT_WORDS)
+
+# Unit => (base unit, number of base units). The quantities are stored in base units.
+UNIT_CONVERSIONS = {
+    "ml": ("ml", Decimal(1)),
+    "cl": ("ml", Decimal(10)),
+    "dl": ("ml", Decimal(100)),
+    "l": ("ml", Decimal(1000)),
+    "hl": ("ml", Decimal(100000)),
+    "mg": ("g", Decimal("0.001")),
+    "g": ("g", Decimal(1)),
+    "kg": ("g", Decimal(1000)),
+}
+# Base unit => units used to write a quantity (the first one whose size is not greater
+# than the quantity): 330ml => 33cl, 1500ml => 1.5l, 0.3kg => 300g
+CANONICAL_UNITS = {
+    "ml": (("l", Decimal(1000)), ("cl", Decimal(10)), ("ml", Decimal(1))),
+    "g": (("kg", Decimal(1000)), ("g", Decimal(1)), ("mg", Decimal("0.001"))),
+}
+# A quantity must fit Product.quantity_value once rounded to its decimal places
+QUANTITY_PRECISION = Decimal(1).scaleb(-QUANTITY_VALUE_DECIMAL_PLACES)  # 0.001
+QUANTITY_MAX_VALUE = Decimal(10) ** (QUANTITY_VALUE_MAX_DIGITS - QUANTITY_VALUE_DECIMAL_PLACES)
+QUANTITY = re.compile(
+    r"(?<![\w.,])(\d+(?:[.,]\d+)?)(" + "|".join(sorted(UNIT_CONVERSIONS, key=len, reverse=True))
+    + r")(?![\w²³])"
+)
+
+
+@dataclass(frozen=True)
+class Quantity:
+    value: Decimal  # In base unit
+    unit: str  # Base unit: "ml" or "g"
+
+    def __str__(self) -> str:
+        """Canonical writing of the quantity (e.g.: "33cl", "1.5l", "500g")."""
+        for unit, size in CANONICAL_UNITS[self.unit]:
+            if self.value >= size:
+                break
+        return format((self.value / size).normalize(), "f") + unit
+
+
+def to_quantity(number: str, unit: str) -> Quantity:
+    base_unit, size = UNIT_CONVERSIONS[unit]
+    return Quantity(Decimal(number.replace(",", ".")) * size, base_unit)
+
+
+@functools.lru_cache(maxsize=4096)  # The same few quantities are written everywhere
+def canonical_quantity(number: str, unit: str) -> str:
+    return str(to_quantity(number, unit))
+
+
+def canonicalize_quantities(text: str) -> str:
+    """Write each quantity of the text in its canonical unit
+    (e.g.: " 0,5l 330ml 1,75l 0.3kg " => " 50cl 33cl 1.75l 300g ")."""
+
+    if not any(char.isdigit() for char in text):
+        return text
+    return QUANTITY.sub(lambda match: canonical_quantity(*match.groups()), text)
+
+
+def storable_quantity(match) -> Quantity:
+    """Return the quantity of a match of QUANTITY or None if it does not fit
+    Product.quantity_value (e.g.: "99999999999999kg")."""
+
+    if not match:
+        return None
+    quantity = to_quantity(*match.groups())
+    if not (
+        quantity.value < QUANTITY_MAX_VALUE
+        and quantity.value.quantize(QUANTITY_PRECISION) < QUANTITY_MAX_VALUE
+    ):
+        return None
+    return quantity
+
+
+def as_quantity(keyword: str) -> Quantity:
+    """Return the quantity written by a normalized keyword (e.g.: "33cl" => 330 ml)
+    or None if the keyword is not a quantity (or a too large one)."""
+
+    return storable_quantity(QUANTITY.fullmatch(keyword))
+
+
+def parse_quantity(text: str) -> Quantity:
+    """Return the first quantity of the text (e.g.: "6 x 33 cl" => 330 ml)
+    or None if the text has no quantity with a known unit (or if the first one does
+    not fit Product.quantity_value)."""
+
+    if not (text and isinstance(text, str)):
+        return None
+    text = replace_unit_words(remove_space_between_quantity_and_unit(text))
+    return storable_quantity(QUANTITY.search(text))
+
+
+NON_WORD_CHARACTERS = re.compile(r"[^\w\s-]")
+SEPARATORS = re.compile(r"[-\s]+")
+
+
+def slugify_as_words(text: str) -> str:
+    """Same result as django.utils.text.slugify(text).replace("-", " ") with the
+    regexes compiled once and without the unicode normalization of ascii texts."""
+
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    text = NON_WORD_CHARACTERS.sub("", text.lower())
+    return SEPARATORS.sub("-", text).strip("-_").replace("-", " ")
+
+
 def format_text(text_to_modify):
 
     text_to_modify = " " + text_to_modify.lower() + " "
-    # Remove unwanted words
-    text_to_modify = (text_to_modify
-                        .replace(" au ", " ")
-                        .replace(" à ", " ")
-                        .replace(" a ", " ")
-                        .replace(" la ", " ")
-                        .replace(" le ", " ")
-                        .replace(" aux ", " ")
-                        .replace(" en ", " ")
-                        .replace(" et ", " ")
-                        .replace(" de ", " ")
-                        .replace(" des ", " ")
-                        .replace(" du ", " ")
-                        .replace(" marque: ", " ")
-                        .replace(" marques: ", " ")
-                        .replace(" brands: ", " ")
-                        .replace(" code: ", " ")
-                        .replace(" marque:", " ")
-                        .replace(" marques:", " ")
-                        .replace(" brands:", " ")
-                        .replace(" code:", " ")
-                        .replace(" marques ", " ")
-                        .replace(" brands ", " ")
-                        .replace(" code ", " ")
-                        .replace(" marque ", " "))
-
-    text_to_modify = (text_to_modify
-                        .replace(" & ", " et ")
-                        .replace("&", " et "))
+    text_to_modify = remove_unwanted_words(text_to_modify)
+    text_to_modify = replace_ampersand(text_to_modify)
 
     text_to_modify = text_to_modify.replace(".", "xxpoointxx")
     text_to_modify = text_to_modify.replace(",", "xxviirgxx")
-    text_to_modify = slugify(text_to_modify).replace("-", " ")
+    text_to_modify = slugify_as_words(text_to_modify)
     text_to_modify = text_to_modify.replace("xxpoointxx", ".")
     text_to_modify = text_to_modify.replace("xxviirgxx", ",")
     return format_quantity_and_unit(text_to_modify)
@@ -107,6 +296,7 @@ def format_quantity_and_unit(text_to_modify):
     - Convert 1,5 L into 1.5l
     - Convert 330 ml into 33cl
     ...
+    Any quantity is converted (see UNIT_CONVERSIONS and CANONICAL_UNITS).
     """
 
     if not isinstance(text_to_modify, str):
@@ -115,46 +305,8 @@ def format_quantity_and_unit(text_to_modify):
         return ""
 
     text_to_modify = remove_space_between_quantity_and_unit(text_to_modify)
-    text_to_modify = (text_to_modify
-                        .replace(" 0,5l", " 50cl")
-                        .replace(" 0.5l", " 50cl")
-                        .replace(" 1,5l", " 1.5l")
-                        .replace(" 1,25l", " 1.25l")
-                        .replace(" 2,5l", " 2.5l")
-                        .replace(" 0.75l", " 75cl")
-                        .replace(" 0,75l", " 75cl")
-                        .replace(" 0.33l", " 33cl")
-                        .replace(" 0,33l", " 33cl")
-                        .replace(" 250ml", " 25cl")
-                        .replace(" 330ml", " 33cl")
-                        .replace(" 500ml", " 50cl")
-                        .replace(" 600ml", " 60cl")
-                        .replace(" 750ml", " 75cl")
-                        .replace(" 1000ml", " 1l")
-                        .replace(" 1500ml", " 1.5l")
-                        .replace(" 0.2kg", " 200g")
-                        .replace(" 0,2kg", " 200g")
-                        .replace(" 0.3kg", " 300g")
-                        .replace(" 0,3kg", " 300g")
-                        .replace(" 0.5kg", " 500g")
-                        .replace(" 0,5kg", " 500g")
-                        .replace(" 0.75kg", " 750g")
-                        .replace(" 0,75kg", " 750g")
-                        .replace(" gramme ", "g ")
-                        .replace(" grammes ", "g ")
-                        .replace(" grame ", "g ")
-                        .replace(" grames ", "g ")
-                        .replace(" gram ", "g ")
-                        .replace(" grams ", "g ")
-                        .replace(" litre ", "l ")
-                        .replace(" litres ", "l ")
-                        .replace(" kilogramme ", "kg ")
-                        .replace(" kilogrammes ", "kg ")
-                        .replace(" kilogrames ", "kg ")
-                        .replace(" kilogrammes ", "kg ")
-                        .replace(" liter ", "l ")
-                        .replace(" liters ", "l "))
-    return text_to_modify
+    text_to_modify = replace_unit_words(text_to_modify)
+    return canonicalize_quantities(text_to_modify)
 
 
 def remove_space_between_quantity_and_unit(text_to_modify: str) -> str:
@@ -167,50 +319,50 @@ def remove_space_between_quantity_and_unit(text_to_modify: str) -> str:
     text_to_modify = text_to_modify.lower()
     text_to_modify = text_to_modify.strip()
     text_to_modify = " " + text_to_modify + " "
-    return (text_to_modify
-            .replace(" l ", "l ")
-            .replace(" cl ", "cl ")
-            .replace(" ml ", "ml ")
-            .replace(" hl ", "hl ")
-            .replace(" dl ", "dl ")
-            .replace(" g ", "g ")
-            .replace(" kg ", "kg ")
-            .replace(" kg ", "kg ")
-            .replace(" mm ", "mm ")
-            .replace(" cm ", "cm ")
-            .replace(" dm ", "dm ")
-            .replace(" m2 ", "m2 ")
-            .replace(" m² ", "m² ")
-            .replace(" m3 ", "m3 ")
-            .replace(" m³ ", "m³ ")
-            .replace(" cm2 ", "cm2 ")
-            .replace(" cm² ", "cm² ")
-            .replace(" cm3 ", "cm3 ")
-            .replace(" cm³ ", "cm³ ")
-            .replace(" mm2 ", "mm2 ")
-            .replace(" mm² ", "mm² ")
-            .replace(" mm3 ", "mm3 ")
-            .replace(" mm³ ", "mm³ ")
-            .replace(" l,", "l, ")
-            .replace(" cl,", "cl, ")
-            .replace(" ml,", "ml, ")
-            .replace(" hl,", "hl, ")
-            .replace(" dl,", "dl, ")
-            .replace(" g,", "g, ")
-            .replace(" kg,", "kg, ")
-            .replace(" kg,", "kg, ")
-            .replace(" mm,", "mm, ")
-            .replace(" cm,", "cm, ")
-            .replace(" dm,", "dm, ")
-            .replace(" m2,", "m2, ")
-            .replace(" m²,", "m², ")
-            .replace(" m3,", "m3, ")
-            .replace(" m³,", "m³, ")
-            .replace(" cm2,", "cm2, ")
-            .replace(" cm²,", "cm², ")
-            .replace(" cm3,", "cm3, ")
-            .replace(" cm³,", "cm³, ")
-            .replace(" mm2,", "mm2, ")
-            .replace(" mm²,", "mm², ")
-            .replace(" mm3,", "mm3, ")
-            .replace(" mm³,", "mm³, "))
+    return glue_unit_to_quantity(text_to_modify)
+
+
+def encode_cursor(sort_value: Union[str, float], product_id: int) -> str:
+    """Encode the (name or rank, id) of the last product of a page into a string
+    that can be put in a URL. Used for the keyset pagination."""
+
+    as_json = json.dumps([sort_value, product_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(as_json.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Optional[tuple[Union[str, float], int]]:
+    """Return the (name or rank, id) encoded by encode_cursor() or None if the cursor
+    is malformed."""
+
+    if not (cursor and isinstance(cursor, str)):
+        return None
+    try:
+        sort_value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not (
+            isinstance(sort_value, (str, int, float))
+            and not isinstance(sort_value, bool)
+            and type(product_id) is int
+        ):
+            raise ValueError("The cursor must contain a name or a rank and an id")
+    except (binascii.Error, TypeError, ValueError) as e:
+        logging.warning("Malformed cursor: %s (%s)", cursor, e)
+        return None
+    return sort_value, product_id
+
+
+def parse_nutrition_facts(nutriments) -> dict:
+    """Return the typed columns of Product (see NUTRITION_FACTS) read from the
+    nutriments of Open Food Facts: {"fat_100g": 1.5, "salt_100g": None, ...}.
+    A missing, non numeric, negative or infinite value is None."""
+
+    if not isinstance(nutriments, dict):
+        nutriments = {}
+
+    nutrition_facts = {}
+    for column, key in NUTRITION_FACTS.items():
+        try:
+            value = float(nutriments.get(key))
+        except (TypeError, ValueError):
+            value = None
+        nutrition_facts[column] = value if value is not None and 0 <= value < math.inf else None
+    return nutrition_facts
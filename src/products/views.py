@@ -1,13 +1,24 @@
+import json
 import logging
 
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import get_user_model
+from django.http import Http404, JsonResponse
 from django.shortcuts import redirect, render
-from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 
+from products.constants import (
+    BATCH_SEARCH_DEFAULT_K,
+    BATCH_SEARCH_MAX_K,
+    BATCH_SEARCH_MAX_QUERIES,
+    BATCH_SUBSTITUTES_MAX_IDS,
+    PRODUCT_ID_MAX,
+)
 from products.models import Product, ReceivedMessage, L_Favorite
-from products import utils
+from products import caches, search_index, utils
 
 
 User = get_user_model()
@@ -57,6 +68,20 @@ def add_to_favorites(request):
     return redirect(request.META["HTTP_REFERER"])
 
 
+@staff_member_required
+def get_cache_stats(request):
+    """Counters of the caches of the process that serves the request
+    (used to tune the size of the caches)."""
+
+    return JsonResponse(
+        {
+            "catalog_version": caches.get_catalog_version(),
+            "search_results": caches.search_results_cache.stats(),
+            "substitutes": caches.substitutes_cache.stats(),
+        }
+    )
+
+
 def check_email(email):
     if email and isinstance(email, str) and email.count("@") == 1:
 
@@ -164,10 +189,13 @@ def get_origial_product(request):
     """Beforehand, the user has entered keywords to find the original product he
     wants to replace.
     Through this route, we try to find the original product.
-    If only one product is found, the user is redirected to the list of matching
-    substitute products.
+    If only one product is found (or if the keywords are the bar code of a product),
+    the list of matching substitute products is returned at once.
     Otherwise, we return a list of original products that match the keywords. This
     way, the user can choose the right original product.
+    The list is paginated: the query param "after" is the cursor of the page.
+    The query params "nutriscore" and "category" filter the products. The number of
+    products per nutriscore grade and per category is shown (facets).
     """
 
     try:
@@ -177,12 +205,33 @@ def get_origial_product(request):
         logging.error(str(e))
         return render(request, "products/originals.html")
 
+    # Scanned or typed bar code: go straight to the substitutes
+    if utils.is_barcode(keywords) and (product := Product.find_by_barcode(keywords.strip())):
+        logging.info("Bar code found. Render the substitutes")
+        return render_substitutes(request, product.id)
+
+    keywords_of_original_product = keywords  # As typed by the user (for the next page)
+    cursor = request.GET.get("after", "")  # Cursor of the page (keyset pagination)
+    next_cursor = ""
+    nutriscore_grade = request.GET.get("nutriscore", "")
+    category = request.GET.get("category", "")
+    facets = {}
+
     original_products: list[Product] = None
     if keywords and isinstance(keywords, str):
 
         keywords = utils.format_text(keywords)
         original_products = Product.find_original_products(keywords)
 
+    if original_products is not None:
+        original_products = Product.filter_by_facets(
+            original_products, nutriscore_grade, category
+        )
+        matching_products = original_products
+        original_products, next_cursor = Product.get_page_of_products(
+            original_products, cursor
+        )
+
     if not keywords:
         logging.info("No keywords sent by user!")
         messages.success(
@@ -196,32 +245,146 @@ def get_origial_product(request):
             request, ("Aucun produit trouvé ! Essayez avec d'autres mots-clefs.")
         )
 
-    # If there is only one original product found then should redirect to get substitutes
-    if original_products and len(original_products) == 1:
-        logging.info("Redirect to get_substitutes")
-        return redirect(
-            reverse("products_get_substitutes") + f"?id={original_products[0].id}"
-            f"&nutriscore_grade={original_products[0].nutriscore_grade}"
-        )
+    # If there is only one original product found then should show its substitutes
+    # (without the round trip of a redirection to get_substitutes)
+    if (
+        original_products
+        and len(original_products) == 1
+        and not (cursor or next_cursor or nutriscore_grade or category)
+    ):
+        logging.info("Only one product found. Render the substitutes")
+        return render_substitutes(request, original_products[0].id)
 
     # Many products found should return the list so the user can choose the good one
+    if original_products:
+        facets = Product.get_facets(matching_products)
+
     logging.info("Render a list of products found as original products")
     return render(
-        request, "products/originals.html", {"original_products": original_products}
+        request,
+        "products/originals.html",
+        {
+            "original_products": original_products,
+            "keywords_of_original_product": keywords_of_original_product,
+            "next_cursor": next_cursor,
+            "facets": facets,
+            "nutriscore": nutriscore_grade,
+            "category": category,
+        },
     )
 
 
-def get_substitutes(request):
-    """This route returns a list of substitute products corresponding to the given
-    original product ID.
+def get_suggestions(request):
+    """Autocompletion of the search box of the home page.
+    The last word typed by the user (query param "q") is completed with the most
+    used tokens of the products. Returns {"suggestions": [...]} as json.
     """
 
-    original_product_id = request.GET.get("id")
-    nutriscore_grade = request.GET.get("nutriscore_grade")
+    text = request.GET.get("q", "")
+    words = text.split()
+    if not words or text[-1].isspace():  # The last word is already complete
+        return JsonResponse({"suggestions": []})
+
+    prefix = search_index.tokenize(words[-1])
+    if not prefix:  # Stop word (e.g.: "de") or punctuation
+        return JsonResponse({"suggestions": []})
+
+    beginning_of_text = text.rstrip()[: -len(words[-1])]
+    suggestions = [
+        beginning_of_text + token
+        for token in search_index.get_prefix_index().suggest(prefix[-1])
+    ]
+    return JsonResponse({"suggestions": suggestions})
+
+
+@csrf_exempt
+@require_POST
+def search_batch(request):
+    """Search many products at once (e.g.: the shopping list of a partner app).
+    Body (json): {"queries": ["coca cola zero", "nutella 400g", ...], "k": 5}
+    Returns {"results": [{"query": ..., "products": [...]}, ...]} as json
+    (the k first products found for each query, in the order of the queries).
+    """
+
+    try:
+        body = json.loads(request.body)
+        queries = body["queries"]
+        k = int(body.get("k", BATCH_SEARCH_DEFAULT_K))
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        logging.error("Invalid batch search: %s", e)
+        return JsonResponse({"error": 'Expected json: {"queries": [...], "k": 5}'}, status=400)
+
+    if not (isinstance(queries, list) and all(isinstance(query, str) for query in queries)):
+        return JsonResponse({"error": "queries must be a list of strings"}, status=400)
+    if len(queries) > BATCH_SEARCH_MAX_QUERIES:
+        return JsonResponse(
+            {"error": f"At most {BATCH_SEARCH_MAX_QUERIES} queries per request"}, status=400
+        )
+    if not 1 <= k <= BATCH_SEARCH_MAX_K:
+        return JsonResponse({"error": f"k must be between 1 and {BATCH_SEARCH_MAX_K}"}, status=400)
+
+    products_of_queries = Product.find_original_products_in_batch(queries, k)
+    return JsonResponse(
+        {
+            "results": [
+                {"query": query, "products": products}
+                for query, products in zip(queries, products_of_queries)
+            ]
+        }
+    )
 
-    substitute_products = Product.find_substitute_products(
+
+@csrf_exempt
+@require_POST
+def substitutes_batch(request):
+    """Substitutes of many products at once (e.g.: a basket or a list of favorites).
+    Body (json): {"ids": [12, 34, ...]}
+    Returns {"results": [{"id": 12, "substitutes": [...]}, ...]} as json
+    (in the order of the ids, no substitute for an unknown id).
+    The number of queries does not depend on the number of ids.
+    """
+
+    try:
+        product_ids = json.loads(request.body)["ids"]
+    except (ValueError, TypeError, KeyError) as e:
+        logging.error("Invalid batch of substitutes: %s", e)
+        return JsonResponse({"error": 'Expected json: {"ids": [...]}'}, status=400)
+
+    if not (
+        isinstance(product_ids, list)
+        and all(
+            type(product_id) is int and 1 <= product_id <= PRODUCT_ID_MAX
+            for product_id in product_ids
+        )
+    ):
+        return JsonResponse(
+            {"error": f"ids must be a list of integers from 1 to {PRODUCT_ID_MAX}"}, status=400
+        )
+    if len(product_ids) > BATCH_SUBSTITUTES_MAX_IDS:
+        return JsonResponse(
+            {"error": f"At most {BATCH_SUBSTITUTES_MAX_IDS} ids per request"}, status=400
+        )
+
+    substitutes = Product.find_substitutes_in_batch(product_ids)
+    return JsonResponse(
+        {
+            "results": [
+                {"id": product_id, "substitutes": substitutes.get(product_id, [])}
+                for product_id in product_ids
+            ]
+        }
+    )
+
+
+def render_substitutes(request, original_product_id, nutriscore_grade: str = None):
+    """Render the substitutes page of a product. The product and its substitutes are
+    fetched with a single query (unless they are cached)."""
+
+    original_product, substitute_products = Product.find_cached_substitutes(
         original_product_id, nutriscore_grade
     )
+    if original_product is None:
+        raise Http404("No product found")
 
     if len(substitute_products) == 0:
         logging.info("No original products found!")
@@ -229,8 +392,6 @@ def get_substitutes(request):
             request, ("Il n'y a pas de meilleurs produit qui soit similaire")
         )
 
-    original_product = Product.objects.get(id=original_product_id)
-
     return render(
         request,
         "products/substitutes.html",
@@ -241,6 +402,16 @@ def get_substitutes(request):
     )
 
 
+def get_substitutes(request):
+    """This route returns a list of substitute products corresponding to the given
+    original product ID.
+    """
+
+    return render_substitutes(
+        request, request.GET.get("id"), request.GET.get("nutriscore_grade")
+    )
+
+
 def legal_notice(request):
     return render(request, "products/legal_notice.html")
 
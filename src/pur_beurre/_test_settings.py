@@ -8,3 +8,8 @@ DATABASES = {
 }
 
 EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+# The ids of the products are reused from a test to another
+PRODUCTS_SEARCH_CACHE_SIZE = 0
+PRODUCTS_SUBSTITUTES_CACHE_SIZE = 0
+PRODUCTS_SUBSTITUTES_CACHE_ALIAS = ""
@@ -171,6 +171,38 @@ EMAIL_HOST = env("EMAIL_HOST", default=None)
 EMAIL_PORT = env("EMAIL_PORT", default=None)
 EMAIL_USE_TLS = env("EMAIL_USE_TLS", default=None)
 
+# Search settings
+# Engine used by Product.find_original_products ("icontains", "full_text", "fuzzy",
+# "tokens", "memory" or the dotted path of a backend, see products.search_backends)
+PRODUCTS_SEARCH_MODE = env("PRODUCTS_SEARCH_MODE", default="icontains")
+# Engine compared with the one above on a sample of the searches (empty to disable it)
+PRODUCTS_SEARCH_SHADOW_MODE = env("PRODUCTS_SEARCH_SHADOW_MODE", default="")
+PRODUCTS_SEARCH_SHADOW_SAMPLE_RATE = env.float("PRODUCTS_SEARCH_SHADOW_SAMPLE_RATE", default=0.01)
+# Cache of the search results of each process (0 to disable it)
+PRODUCTS_SEARCH_CACHE_SIZE = env.int("PRODUCTS_SEARCH_CACHE_SIZE", default=1000)  # Nbr of searches
+PRODUCTS_SEARCH_CACHE_TTL = env.int("PRODUCTS_SEARCH_CACHE_TTL", default=3600)  # Seconds
+# Cache of the substitutes: a tier per process (0 to disable it) and a tier shared by
+# the processes (alias of CACHES, empty to disable it). Without CACHE_URL, the default
+# cache is local to each process: the shared tier is disabled by default.
+PRODUCTS_SUBSTITUTES_CACHE_SIZE = env.int("PRODUCTS_SUBSTITUTES_CACHE_SIZE", default=1000)
+PRODUCTS_SUBSTITUTES_CACHE_TTL = env.int("PRODUCTS_SUBSTITUTES_CACHE_TTL", default=3600)
+PRODUCTS_SUBSTITUTES_CACHE_ALIAS = env(
+    "PRODUCTS_SUBSTITUTES_CACHE_ALIAS", default="default" if env("CACHE_URL", default="") else ""
+)
+# The categories found in more than this ratio of the products (e.g.: "Snacks") are
+# not used to find the substitutes (1 to use all of them). See the command categorystats.
+# The precomputed substitutes follow it after the next refreshsubstitutes.
+PRODUCTS_SUBSTITUTES_MAX_CATEGORY_RATIO = env.float("PRODUCTS_SUBSTITUTES_MAX_CATEGORY_RATIO", default=1.0)
+# Engine of the substitutes: "sql" (exact) or "minhash" (approximate, for very large
+# catalogs: the candidates are the products sharing a MinHash LSH bucket, see
+# products.substitute_engine, requires NumPy)
+PRODUCTS_SUBSTITUTES_ENGINE = env("PRODUCTS_SUBSTITUTES_ENGINE", default="sql")
+# Nbr of the most requested substitutes computed again after each load of products
+PRODUCTS_SUBSTITUTES_PREWARM_SIZE = env.int("PRODUCTS_SUBSTITUTES_PREWARM_SIZE", default=100)
+
+# Shared by all the processes with e.g. CACHE_URL=rediscache://127.0.0.1:6379/1
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.0/howto/static-files/
 
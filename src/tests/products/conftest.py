@@ -0,0 +1,14 @@
+import pytest
+
+from products.models import Category, Product
+from src.tests.products.params_for_mark_parametrize.products_objs import welformed_products
+
+
+@pytest.fixture
+def add_products_to_db():
+    # Store the categories of the products then the products
+    categories = set(
+        category for product in welformed_products for category in product.categories)
+    for category in categories:
+        Category.objects.create(name=category)
+    Product.add_many(welformed_products)
@@ -0,0 +1,167 @@
+from io import StringIO
+
+import pytest
+from django.core.cache import cache as default_cache
+from django.core.management import call_command
+
+from products import caches
+from products.caches import LRUCache, TieredCache
+from products.models import CatalogVersion, Product
+
+
+def test_lru_cache(monkeypatch):
+    cache = LRUCache(max_size=2, ttl=60)
+
+    print("A key that is not in the cache should return None and count a miss")
+    assert cache.get("cola", 1) is None
+    assert cache.misses == 1
+
+    print("A stored key should return its value and count a hit")
+    cache.set("cola", 1, [1, 2])
+    assert cache.get("cola", 1) == [1, 2]
+    assert cache.hits == 1
+
+    print("A key stored with another version of the catalog should be a miss")
+    assert cache.get("cola", 2) is None
+    assert cache.stats()["size"] == 0
+
+    print("The least recently used key should be evicted when the cache is full")
+    cache.set("cola", 1, [1])
+    cache.set("lemon", 1, [2])
+    cache.get("cola", 1)
+    cache.set("water", 1, [3])
+    assert cache.get("lemon", 1) is None
+    assert cache.get("cola", 1) == [1]
+    assert cache.evictions == 1
+
+    print("An expired key should be a miss")
+    monkeypatch.setattr(caches.time, "monotonic", lambda: 10**9)
+    assert cache.get("cola", 1) is None
+
+    print("A cache of size 0 should not store anything")
+    disabled_cache = LRUCache(max_size=0, ttl=60)
+    disabled_cache.set("cola", 1, [1])
+    assert disabled_cache.get("cola", 1) is None
+
+
+@pytest.mark.django_db
+def test_catalog_version():
+    print("The version of an empty catalog should be 0")
+    assert CatalogVersion.current() == 0
+
+    print("Bumping the version should increment it")
+    assert CatalogVersion.bump() == 1
+    assert CatalogVersion.bump() == 2
+    assert CatalogVersion.current() == 2
+
+
+@pytest.mark.django_db
+def test_find_original_products_with_cache(monkeypatch, django_assert_num_queries, add_products_to_db):
+    monkeypatch.setattr(caches, "search_results_cache", LRUCache(max_size=10, ttl=60))
+    caches.forget_catalog_version()
+
+    print("The first search should query the database and store the ids of the products")
+    assert len(Product.find_original_products("beverage lemon")) == 2
+    assert caches.search_results_cache.misses == 1
+
+    print("The same search should not scan the products again (only fetch them by id)")
+    with django_assert_num_queries(1):
+        assert len(Product.find_original_products("beverage lemon")) == 2
+    assert caches.search_results_cache.hits == 1
+
+    print("A new version of the catalog should invalidate the cached search")
+    CatalogVersion.bump()
+    caches.forget_catalog_version()
+    assert len(Product.find_original_products("beverage lemon")) == 2
+    assert caches.search_results_cache.misses == 2
+
+    caches.forget_catalog_version()
+
+
+def test_tiered_cache(monkeypatch):
+    default_cache.clear()
+    monkeypatch.setattr(caches, "SUBSTITUTES_REQUESTS_FLUSH_INTERVAL", 2)
+    cache = TieredCache("test", max_size=10, ttl=60, alias="default")
+    fills = []
+
+    def fill(value):
+        fills.append(value)
+        return value
+
+    print("A missing key should be filled then stored in both tiers")
+    assert cache.get_or_fill((1, ""), 1, lambda: fill([1, 2])) == [1, 2]
+    assert cache.get_or_fill((1, ""), 1, lambda: fill([3])) == [1, 2]
+    assert fills == [[1, 2]]
+    assert cache.stats()["hits"] == 1 and cache.stats()["fills"] == 1
+
+    print("Another process should find the key in the shared tier")
+    other_process_cache = TieredCache("test", max_size=10, ttl=60, alias="default")
+    assert other_process_cache.get_or_fill((1, ""), 1, lambda: fill([3])) == [1, 2]
+    assert other_process_cache.stats()["shared_hits"] == 1
+    assert other_process_cache.stats()["hit_rate"] == 1
+
+    print("A key of another version of the catalog should be filled again")
+    assert cache.get_or_fill((1, ""), 2, lambda: fill([4])) == [4]
+    assert len(fills) == 2
+
+    print("A None value should not be stored")
+    cache.get_or_fill((2, ""), 2, lambda: fill(None))
+    cache.get_or_fill((2, ""), 2, lambda: fill(None))
+    assert fills[-2:] == [None, None]
+
+    print("The most requested keys of all the processes should be known")
+    assert cache.most_requested(2) == [(1, ""), (2, "")]
+
+    print("Without shared tier, the requests of the process should be counted")
+    local_cache = TieredCache("test", max_size=10, ttl=60, alias="")
+    local_cache.get_or_fill((3, ""), 1, lambda: [3])
+    assert local_cache.most_requested(5) == [(3, "")]
+
+
+@pytest.mark.django_db
+def test_find_cached_substitutes(
+    monkeypatch, settings, tmp_path, django_assert_num_queries, add_products_to_db
+):
+    default_cache.clear()
+    monkeypatch.setattr(
+        caches, "substitutes_cache", TieredCache("substitutes", 10, 60, "default"))
+    caches.forget_catalog_version()
+    cool_cola = Product.objects.get(original_id=123457)
+
+    print("The substitutes should be the ones of find_product_and_substitutes")
+    product, substitutes = Product.find_cached_substitutes(cool_cola.id)
+    assert (product, substitutes) == Product.find_product_and_substitutes(cool_cola.id)
+
+    print("The same product should then be read from the cache without any query")
+    with django_assert_num_queries(0):
+        assert Product.find_cached_substitutes(str(cool_cola.id))[1] == substitutes
+
+    print("An unknown product should return no product")
+    assert Product.find_cached_substitutes(123456789) == (None, [])
+    assert Product.find_cached_substitutes("not an id") == (None, [])
+
+    print("A local-memory shared tier should not be pre-warmed: no other process reads it")
+    CatalogVersion.bump()
+    output = StringIO()
+    call_command("prewarmsubstitutes", size=1, stdout=output)
+    assert "local-memory cache" in output.getvalue()
+
+    print("After a load, the most requested substitutes should be pre-warmed in the "
+            "shared tier with the new version of the catalog")
+    settings.CACHES = {
+        **settings.CACHES,
+        "shared": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": str(tmp_path),
+        },
+    }
+    monkeypatch.setattr(
+        caches, "substitutes_cache", TieredCache("substitutes", 10, 60, "shared"))
+    Product.find_cached_substitutes(cool_cola.id)
+    CatalogVersion.bump()
+    call_command("prewarmsubstitutes", size=1, stdout=StringIO())
+    monkeypatch.setattr(
+        caches, "substitutes_cache", TieredCache("substitutes", 10, 60, "shared"))
+    with django_assert_num_queries(0):
+        assert Product.find_cached_substitutes(cool_cola.id)[1] == substitutes
+    assert caches.substitutes_cache.stats()["shared_hits"] == 1
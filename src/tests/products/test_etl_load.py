@@ -1,4 +1,4 @@
-from products.models import Category, Product
+from products.models import CatalogVersion, Category, Product, TokenFrequency
 from src.products import etl_load
 from products.utils import WellFormedProduct
 
@@ -78,8 +78,26 @@ def test_populate_database(monkeypatch):
 
         return True
 
+    catalog_versions = []
+
+    def mock_catalog_version_bump(nbr_of_products=None):
+        catalog_versions.append(len(catalog_versions) + 1)
+        return catalog_versions[-1]
+
+    def mock_token_frequency_refresh():
+        return len(list_of_welformed_products)
+
+    refreshed_category_frequencies = []
+
+    def mock_category_refresh_frequencies():
+        refreshed_category_frequencies.append(True)
+        return 3
+
     monkeypatch.setattr(Category, 'add_many', mock_category_add_many)
     monkeypatch.setattr(Product, 'add_many', mock_product_add_many)
+    monkeypatch.setattr(CatalogVersion, 'bump', mock_catalog_version_bump)
+    monkeypatch.setattr(TokenFrequency, 'refresh', mock_token_frequency_refresh)
+    monkeypatch.setattr(Category, 'refresh_frequencies', mock_category_refresh_frequencies)
 
     print("A list of WellFormedProduct and a set of categories "
             "should return True")
@@ -87,6 +105,12 @@ def test_populate_database(monkeypatch):
         list_of_welformed_products,
         set(["category1", "category2", "category3"])) == True
 
+    print("     should bump the version of the catalog")
+    assert catalog_versions == [1]
+
+    print("     should refresh the frequencies of the categories")
+    assert refreshed_category_frequencies == [True]
+
     print("A list of non-Welformed product as products should return False because "
             "The products can't be added.")
     assert SUT.populate_database(
@@ -98,3 +122,6 @@ def test_populate_database(monkeypatch):
     assert SUT.populate_database(
         [{"name": "product1"}, {"name": "product2"}],
         None) == False
+
+    print("The version of the catalog should not change if no product was added")
+    assert catalog_versions == [1]
@@ -151,6 +151,10 @@ def test_transform_product(monkeypatch):
     # assert transformed_product.product_name_fr == PRODUCT_NAME_MAX_LENGTH
     assert len(transformed_product.product_name_fr) <= PRODUCT_NAME_MAX_LENGTH
 
+    print("The downloaded product should have the nutrition facts of its nutriments")
+    assert transformed_product.nutrition_facts == utils.parse_nutrition_facts(
+        good_downloaded_product["nutriments"])
+
     print("The downloaded product should have its mega_keywords attribute updated "
             "with an expected value surrounded by spaces.")
     assert transformed_product.mega_keywords == (
@@ -1,6 +1,7 @@
 import logging
 
 import pytest
+from django.core.management import CommandError, call_command
 
 from src.products.management.commands.addproducts import Command
 
@@ -66,3 +67,11 @@ def test_add_arguments():
 
     print("Add_argument method should have <<'list_of_args'>> and <<nargs='+'>> as arguments")
     assert SUT.add_arguments(SUT, parser) == None
+
+
+@pytest.mark.parametrize(
+    "command", ["benchmarksearch", "benchmarksubstitutes", "benchmarksubstituteengine"])
+def test_benchmarks_refuse_to_write_without_allow_write(command):
+    print("A benchmark writing synthetic products should require --allow-write")
+    with pytest.raises(CommandError, match="--allow-write"):
+        call_command(command, 10)
@@ -0,0 +1,212 @@
+import logging
+import random
+
+import pytest
+from django.utils.text import slugify
+
+from products import utils
+
+
+# Verbatim copy of the chained str.replace() version of utils.format_text (and of the
+# functions it calls), up to the conversion of the quantities. Reference of the
+# differential test: the compiled replacement chains must return exactly the same text.
+# The quantities are converted with arithmetic, not with replacements: their canonical
+# forms are written out in test_format_text_converts_the_quantities.
+
+
+def reference_format_text(text_to_modify):
+
+    text_to_modify = " " + text_to_modify.lower() + " "
+    # Remove unwanted words
+    text_to_modify = (text_to_modify
+                        .replace(" au ", " ")
+                        .replace(" à ", " ")
+                        .replace(" a ", " ")
+                        .replace(" la ", " ")
+                        .replace(" le ", " ")
+                        .replace(" aux ", " ")
+                        .replace(" en ", " ")
+                        .replace(" et ", " ")
+                        .replace(" de ", " ")
+                        .replace(" des ", " ")
+                        .replace(" du ", " ")
+                        .replace(" marque: ", " ")
+                        .replace(" marques: ", " ")
+                        .replace(" brands: ", " ")
+                        .replace(" code: ", " ")
+                        .replace(" marque:", " ")
+                        .replace(" marques:", " ")
+                        .replace(" brands:", " ")
+                        .replace(" code:", " ")
+                        .replace(" marques ", " ")
+                        .replace(" brands ", " ")
+                        .replace(" code ", " ")
+                        .replace(" marque ", " "))
+
+    text_to_modify = (text_to_modify
+                        .replace(" & ", " et ")
+                        .replace("&", " et "))
+
+    text_to_modify = text_to_modify.replace(".", "xxpoointxx")
+    text_to_modify = text_to_modify.replace(",", "xxviirgxx")
+    text_to_modify = slugify(text_to_modify).replace("-", " ")
+    text_to_modify = text_to_modify.replace("xxpoointxx", ".")
+    text_to_modify = text_to_modify.replace("xxviirgxx", ",")
+    return reference_format_quantity_and_unit(text_to_modify)
+
+
+def reference_format_quantity_and_unit(text_to_modify):
+    """Glue the units to their quantity and replace the unit words
+    (the quantities are not converted)."""
+
+    if not isinstance(text_to_modify, str):
+        logging.error("Error in format_quantity_and_unit! "
+                        "Text to modify should be a string")
+        return ""
+
+    text_to_modify = reference_remove_space_between_quantity_and_unit(text_to_modify)
+    text_to_modify = (text_to_modify
+                        .replace(" gramme ", "g ")
+                        .replace(" grammes ", "g ")
+                        .replace(" grame ", "g ")
+                        .replace(" grames ", "g ")
+                        .replace(" gram ", "g ")
+                        .replace(" grams ", "g ")
+                        .replace(" litre ", "l ")
+                        .replace(" litres ", "l ")
+                        .replace(" kilogramme ", "kg ")
+                        .replace(" kilogrammes ", "kg ")
+                        .replace(" kilogrames ", "kg ")
+                        .replace(" kilogrammes ", "kg ")
+                        .replace(" liter ", "l ")
+                        .replace(" liters ", "l "))
+    return text_to_modify
+
+
+def reference_remove_space_between_quantity_and_unit(text_to_modify: str) -> str:
+
+    if not (text_to_modify
+                and isinstance(text_to_modify, str)):
+        logging.error("""Error in utils.remove_space_between_quantity_and_unit().
+        the arg (text to modify) should be a string and should not be empty.""")
+        return ""
+    text_to_modify = text_to_modify.lower()
+    text_to_modify = text_to_modify.strip()
+    text_to_modify = " " + text_to_modify + " "
+    return (text_to_modify
+            .replace(" l ", "l ")
+            .replace(" cl ", "cl ")
+            .replace(" ml ", "ml ")
+            .replace(" hl ", "hl ")
+            .replace(" dl ", "dl ")
+            .replace(" g ", "g ")
+            .replace(" kg ", "kg ")
+            .replace(" kg ", "kg ")
+            .replace(" mm ", "mm ")
+            .replace(" cm ", "cm ")
+            .replace(" dm ", "dm ")
+            .replace(" m2 ", "m2 ")
+            .replace(" m² ", "m² ")
+            .replace(" m3 ", "m3 ")
+            .replace(" m³ ", "m³ ")
+            .replace(" cm2 ", "cm2 ")
+            .replace(" cm² ", "cm² ")
+            .replace(" cm3 ", "cm3 ")
+            .replace(" cm³ ", "cm³ ")
+            .replace(" mm2 ", "mm2 ")
+            .replace(" mm² ", "mm² ")
+            .replace(" mm3 ", "mm3 ")
+            .replace(" mm³ ", "mm³ ")
+            .replace(" l,", "l, ")
+            .replace(" cl,", "cl, ")
+            .replace(" ml,", "ml, ")
+            .replace(" hl,", "hl, ")
+            .replace(" dl,", "dl, ")
+            .replace(" g,", "g, ")
+            .replace(" kg,", "kg, ")
+            .replace(" kg,", "kg, ")
+            .replace(" mm,", "mm, ")
+            .replace(" cm,", "cm, ")
+            .replace(" dm,", "dm, ")
+            .replace(" m2,", "m2, ")
+            .replace(" m²,", "m², ")
+            .replace(" m3,", "m3, ")
+            .replace(" m³,", "m³, ")
+            .replace(" cm2,", "cm2, ")
+            .replace(" cm²,", "cm², ")
+            .replace(" cm3,", "cm3, ")
+            .replace(" cm³,", "cm³, ")
+            .replace(" mm2,", "mm2, ")
+            .replace(" mm²,", "mm², ")
+            .replace(" mm3,", "mm3, ")
+            .replace(" mm³,", "mm³, "))
+
+
+# Pieces of text triggering every replacement (and their interactions)
+PIECES = [
+    " au ", " à ", " a ", "la", "le ", " aux ", "en", "et", "de", "des", "du", "marque:",
+    "marques", "brands:", "code:", "code", "&", " & ", ".", ",", "l", "cl", "ml", "kg", "g",
+    "m²", "cm³", "mm2", "0,5", "1,5", "0.75", "0,33", "330", "1000", "1500", "gramme",
+    "grammes", "litre", "kilogrammes", "liter", "coca", "cola", "Pâte", "À", "TARTINER",
+    "nutella", "1", "2", "33", "  ", "-", "'", "é", "ß", "\t", "_", "ﬁ", "œ", "₂", "™",
+]
+
+
+def random_text(random_generator: random.Random) -> str:
+    return "".join(
+        random_generator.choice(PIECES) + random_generator.choice(["", " ", " ", ","])
+        for _ in range(random_generator.randint(1, 14))
+    )
+
+
+def test_format_text_is_identical_to_the_chained_replacements():
+    logging.disable(logging.ERROR)  # Empty texts log an error (in both versions)
+    random_generator = random.Random(2022)
+
+    print("The compiled normalizer should return exactly the same text as the chained "
+            "str.replace() on random texts (once their quantities are converted)")
+    try:
+        for _ in range(20000):
+            text = random_text(random_generator)
+            assert utils.format_text(text) == utils.canonicalize_quantities(
+                reference_format_text(text)), text
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+@pytest.mark.parametrize("text, expected", [
+    # The fixed table of quantities replaced by the conversion
+    ("0,5l 0.5l 1,5l 1,25l 2,5l", " 50cl 50cl 1.5l 1.25l 2.5l "),
+    ("0.75l 0,75l 0.33l 0,33l", " 75cl 75cl 33cl 33cl "),
+    ("250ml 330ml 500ml 600ml 750ml 1000ml 1500ml", " 25cl 33cl 50cl 60cl 75cl 1l 1.5l "),
+    ("0.2kg 0,2kg 0.3kg 0,3kg 0.5kg 0,5kg 0.75kg 0,75kg",
+        " 200g 200g 300g 300g 500g 500g 750g 750g "),
+    # Any other quantity
+    ("400 ml 1,98 L 0.0005 kg", " 40cl 1.98l 500mg "),
+    ("2500ml, 125 ml", " 2.5l, 12.5cl "),
+    ("2,5 litres 3 grammes 6 x 33 cl", " 2.5l 3g 6 x 33cl "),
+    ("33cl 1.5l 300g 2kg", " 33cl 1.5l 300g 2kg "),
+    ("0,5lait 10m²", " 0,5lait 10m2 "),
+    # Texts of products
+    ("Coca-Cola Zero 33 cl, Marque: Coca-Cola & Co", " coca cola zero 33cl,  coca cola et co "),
+    ("Pâte à tartiner aux noisettes et au cacao 1 KILOGRAMME",
+        " pate tartiner noisettes cacao 1kg "),
+    ("Jus d'orange 1,5 L - 0,5 L - 330 ml - 1000 ml", " jus dorange 1.5l 50cl 33cl 1l "),
+    ("Lait demi-écrémé UHT brands: Lactel code: 3017620422003",
+        " lait demi ecreme uht lactel 3017620422003 "),
+])
+def test_format_text_converts_the_quantities(text, expected):
+    print("Each quantity should be written in its canonical unit")
+    assert utils.format_text(text) == expected
+
+
+def test_replacement_chain():
+    chain = utils.ReplacementChain([(" l ", "l "), (" l,", "l, "), ("xl", "x")])
+
+    print("The replacements should apply in order, each one on the previous result")
+    assert chain(" 1 l , 2 l,") == " 1l , 2l, "
+    assert chain(" x l ") == " x "
+
+    print("A text without any of the substrings should be returned as is")
+    text = " nutella "
+    assert chain(text) is text
@@ -0,0 +1,18 @@
+import importlib
+
+
+nutriments_json = importlib.import_module("products.migrations.0013_product_nutriments_json")
+
+
+def test_nutriments_from_python_repr():
+    nutriments_from_python_repr = nutriments_json.nutriments_from_python_repr
+
+    print("The Python repr of the nutriments should be converted to a dict")
+    assert nutriments_from_python_repr("{'fat_100g': 1.5, 'nova': None, 'bio': True}") == {
+        "fat_100g": 1.5, "nova": None, "bio": True}
+
+    print("Nutriments already decoded or not made of a dict should be unchanged")
+    assert nutriments_from_python_repr({"fat_100g": 1.5}) == {"fat_100g": 1.5}
+    assert nutriments_from_python_repr("Some nutriments") == "Some nutriments"
+    assert nutriments_from_python_repr("{not python}") == "{not python}"
+    assert nutriments_from_python_repr("{__import__('os')}") == "{__import__('os')}"
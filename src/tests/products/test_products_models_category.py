@@ -1,6 +1,9 @@
 import pytest
 
+from products import caches
+from products.models import CatalogVersion, Product
 from products.models import Category as SUT
+from src.tests.products.params_for_mark_parametrize.products_objs import welformed_products
 
 
 pytestmark = pytest.mark.django_db
@@ -51,3 +54,30 @@ class TestCategoryModel:
 
         print("         with an instance of Category as a value")
         assert [category for category in categories.values() if not (isinstance, SUT)] or True
+
+    def test_refresh_frequencies(self):
+        categories = set(
+            category for product in welformed_products for category in product.categories)
+        for category in categories:
+            SUT.objects.create(name=category)
+        Product.add_many(welformed_products)
+
+        print("The number of products of each category should be counted")
+        assert SUT.refresh_frequencies() == len(categories)
+        assert SUT.objects.get(name="beverage").nbr_of_products == 5
+        assert SUT.objects.get(name="water").nbr_of_products == 1
+
+        print("Without cap, all the categories should be used to find the substitutes")
+        assert SUT.max_substitute_frequency(1) is None
+        assert SUT.substitute_memberships(1) == ("products_category_products", [])
+
+        print("     as well as before the first load of products")
+        caches.forget_catalog_version()
+        assert SUT.max_substitute_frequency(0.5) is None
+
+        print("The cap should be a number of products of the catalog")
+        CatalogVersion.bump(5)
+        caches.forget_catalog_version()
+        assert SUT.max_substitute_frequency(0.5) == 2
+
+        caches.forget_catalog_version()
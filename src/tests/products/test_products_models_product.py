@@ -1,6 +1,28 @@
-import pytest
+import copy
+import importlib
+import logging
 
-from products.models import Category
+import pytest
+from django.apps import apps as django_apps
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from products.constants import (
+    NUTRIENT_OF_ORIGINAL,
+    SEARCH_MODE_FULL_TEXT,
+    SEARCH_MODE_FUZZY,
+    SEARCH_MODE_ICONTAINS,
+    SEARCH_MODE_MEMORY,
+    SEARCH_MODE_TOKENS,
+)
+from products import caches, search_index, utils
+from products.models import (
+    CatalogVersion,
+    Category,
+    ProductSubstitute,
+    TokenFrequency,
+    TouchedProduct,
+)
 from products.models import Product as SUT
 from src.tests.products.params_for_mark_parametrize.products_objs import welformed_products
 
@@ -53,6 +75,15 @@ class TestProductModel:
 
         assert SUT.objects.all().count() == 5
 
+        print("A quantity too large for the database should not prevent the product "
+                "from being stored")
+        product_with_huge_quantity = copy.deepcopy(welformed_products[0])
+        product_with_huge_quantity._id = "123499"
+        product_with_huge_quantity.quantity = "99999999999999 kg"
+        assert SUT.add_many([product_with_huge_quantity]) == True
+        stored_product = SUT.objects.get(original_id=123499)
+        assert (stored_product.quantity_value, stored_product.quantity_unit) == (None, "")
+
     def test_find_original_products(self, add_products_to_db):
 
         print("Preparing the database for testing...")
@@ -83,6 +114,256 @@ class TestProductModel:
         assert len(original_products) == 1
         assert original_products[0].name == "Lemonade light"
 
+    @pytest.mark.parametrize("mode", [SEARCH_MODE_FULL_TEXT, SEARCH_MODE_TOKENS])
+    def test_find_original_products_with_postgresql_modes(self, caplog, add_products_to_db, mode):
+        add_products_to_db
+
+        print(f"The {mode} mode should return only the products containing ALL the keywords")
+        original_products = SUT.find_original_products("beverage lemon light", mode=mode)
+        assert len(original_products) == 1
+        assert original_products[0].name == "Lemonade light"
+
+        assert list(SUT.find_original_products("beverage orange", mode=mode)) == []
+
+        if connection.vendor != "postgresql":
+            print("     should log a warning then search with icontains if the database "
+                    "is not PostgreSQL")
+            assert f"The {mode} search requires PostgreSQL" in caplog.text
+
+    def test_find_original_products_in_fuzzy_mode(self, caplog, add_products_to_db):
+        add_products_to_db
+
+        print("The fuzzy mode should return the most similar products first")
+        original_products = SUT.find_original_products(
+            "beverage lemon light", mode=SEARCH_MODE_FUZZY)
+        assert original_products[0].name == "Lemonade light"
+
+        if connection.vendor == "postgresql":
+            print("     even with a typo")
+            original_products = SUT.find_original_products(
+                "lemonade ligth", mode=SEARCH_MODE_FUZZY)
+            assert original_products[0].name == "Lemonade light"
+        else:
+            print("     should log a warning then search with icontains if the database "
+                    "is not PostgreSQL")
+            assert "The fuzzy search requires PostgreSQL" in caplog.text
+            assert len(original_products) == 1
+
+    def test_find_original_products_by_tokens(self, add_products_to_db):
+        add_products_to_db
+
+        if connection.vendor != "postgresql":
+            pytest.skip("The tokens column only exists on PostgreSQL")
+
+        print("The tokens mode should only match whole tokens")
+        assert len(SUT.find_original_products("lemon", mode=SEARCH_MODE_TOKENS)) == 2
+        assert list(SUT.find_original_products("lemo", mode=SEARCH_MODE_TOKENS)) == []
+
+    def test_find_original_products_by_barcode(self, add_products_to_db):
+        add_products_to_db
+
+        print("A bar code as keyword should return the products having this code")
+        original_products = SUT.find_original_products(str(welformed_products[0].code))
+        assert len(original_products) == 5
+
+        print("A number that is not a bar code should be searched in the keywords")
+        assert list(SUT.find_original_products("1234567890123")) == []
+
+        print("find_by_barcode should return the first product having this code")
+        product = SUT.find_by_barcode(str(welformed_products[0].code))
+        assert product.code == welformed_products[0].code
+        assert SUT.find_by_barcode("1234567890123") is None
+        assert SUT.find_by_barcode("not a code") is None
+
+    def test_find_original_products_by_quantity(self, add_products_to_db):
+        add_products_to_db
+
+        print("The quantity of each product should be stored in its base unit")
+        assert SUT.objects.filter(quantity_unit="g", quantity_value=2000).count() == 5
+
+        print("A quantity as keyword should be compared to the stored quantity "
+                "whatever its unit")
+        assert len(SUT.find_original_products("lemon 2kg")) == 2
+        assert len(SUT.find_original_products("lemon 2000g")) == 2
+        assert len(SUT.find_original_products("2kg")) == 5
+        assert list(SUT.find_original_products("lemon 33cl")) == []
+
+        print("A quantity found in the keywords should select the product too, whatever "
+                "the stored quantity (missing, unparsable or another one of the pack)")
+        SUT.objects.filter(original_id=123457).update(
+            keywords=" cool cola soda beverage cola 6x33cl 33cl ",
+            quantity_value=None, quantity_unit="")
+        assert [product.name for product in SUT.find_original_products("cola 33cl")] == [
+            "Cool cola"]
+        assert [product.name for product in SUT.find_original_products("33cl")] == [
+            "Cool cola"]
+        assert len(SUT.find_original_products("cola 2kg")) == 1
+
+    def test_find_original_products_stored_with_old_keywords(self, add_products_to_db):
+        add_products_to_db
+        canonicalize_keywords = importlib.import_module(
+            "products.migrations.0017_product_keywords_canonical_quantities"
+        ).canonicalize_keywords
+
+        print("A product stored with the old spelling of its quantities in the keywords "
+                "should be found again once the migration 0017 canonicalized them")
+        SUT.objects.filter(original_id=123457).update(
+            keywords=" cool cola soda beverage coca 1,98l 400ml 33cl ",
+            quantity_value=None, quantity_unit="")
+        TokenFrequency.refresh()
+        catalog_version = CatalogVersion.bump(SUT.objects.count())
+        # The keywords of a search are normalized by the view
+        assert utils.format_text("coca 1,98 l").split() == ["coca", "1.98l"]
+        assert utils.format_text("coca 400 ml").split() == ["coca", "40cl"]
+        assert list(SUT.find_original_products(utils.format_text("coca 1,98 l"))) == []
+        assert list(SUT.find_original_products(utils.format_text("coca 400 ml"))) == []
+
+        canonicalize_keywords(django_apps, None)
+        assert SUT.objects.get(original_id=123457).keywords == (
+            " cool cola soda beverage coca 1.98l 40cl 33cl ")
+        for keywords in ("coca 1,98 l", "coca 400 ml", "coca 40cl", "coca 33cl"):
+            assert [
+                product.name for product in SUT.find_original_products(utils.format_text(keywords))
+            ] == ["Cool cola"]
+
+        print("     and refresh the frequencies of the tokens and the version of the catalog")
+        assert TokenFrequency.objects.get(token="1.98l").frequency == 1
+        assert not TokenFrequency.objects.filter(token="400ml").exists()
+        assert CatalogVersion.current() == catalog_version + 1
+
+    def test_plan_search(self, caplog, add_products_to_db):
+        caplog.set_level(logging.INFO)
+        add_products_to_db
+
+        print("Without frequencies, the keywords should be searched as typed")
+        caches.forget_catalog_version()
+        assert TokenFrequency.plan(["beverage", "light"], is_exact_match=False) == [
+            "beverage", "light"]
+
+        print("The frequencies should be the number of products containing each token")
+        assert TokenFrequency.refresh() == 5
+        assert TokenFrequency.objects.get(token="cola").frequency == 2
+        CatalogVersion.bump(5)
+        caches.forget_catalog_version()
+
+        print("The rarest keyword should be checked first and a keyword found in most "
+                "of the products should be ignored")
+        assert TokenFrequency.plan(["beverage", "cola", "soda"], is_exact_match=False) == [
+            "cola", "soda"]
+        assert "'beverage' ignored" in caplog.text
+
+        print("     but at least one keyword should be kept")
+        assert TokenFrequency.plan(["beverage"], is_exact_match=False) == ["beverage"]
+
+        print("A keyword that is not a token should give no result if the whole token "
+                "must match")
+        assert TokenFrequency.plan(["cola", "lemo"], is_exact_match=True) == []
+        assert "no product contains 'lemo'" in caplog.text
+
+        print("     and should be kept (last) if it can be a part of a token")
+        assert TokenFrequency.plan(["lemo", "cola"], is_exact_match=False) == ["cola", "lemo"]
+
+        print("The planned search should return the same products")
+        assert SUT.find_original_products("beverage lemon light")[0].name == "Lemonade light"
+        assert len(SUT.find_original_products("beverage lemo")) == 2
+
+        caches.forget_catalog_version()
+
+    def test_find_original_products_in_batch(self, add_products_to_db, django_assert_num_queries):
+        add_products_to_db
+        queries = ["Lemonade", "Cool cola light", "", "orange"]
+
+        print("Each query should return its k first products (in the order of the queries)")
+        results = SUT.find_original_products_in_batch(queries, k=1)
+        assert [[product["name"] for product in products] for products in results] == [
+            ["Lemonade"], ["Cool cola light"], [], []]
+
+        print("The memory mode should answer all the queries with a single query to the db")
+        search_index.reset_inverted_index()
+        search_index.get_inverted_index()
+        with django_assert_num_queries(1):
+            results = SUT.find_original_products_in_batch(queries, k=5, mode=SEARCH_MODE_MEMORY)
+        assert [len(products) for products in results] == [2, 1, 0, 0]
+
+        print("Each query should find the products of the list of the search results, "
+                "in the same order (bar codes and quantities included)")
+        water_code = str(SUT.objects.get(original_id=123460).code)
+        queries = ["beverage", "cola 2kg", water_code, "cool", "orange"]
+        for mode in (SEARCH_MODE_ICONTAINS, SEARCH_MODE_MEMORY):
+            results = SUT.find_original_products_in_batch(queries, k=2, mode=mode)
+            assert [[product["id"] for product in products] for products in results] == [
+                [
+                    product.id
+                    for product in SUT.get_page_of_products(
+                        SUT.find_original_products(query, mode), "", page_size=2)[0]
+                ]
+                for query in queries
+            ]
+            assert [len(products) for products in results] == [2, 2, 2, 2, 0]
+        search_index.reset_inverted_index()
+
+    def test_get_facets(self, add_products_to_db, django_assert_num_queries):
+        add_products_to_db
+        lemonades = SUT.find_original_products("lemonade")
+
+        print("The facets should be counted with a single query")
+        with django_assert_num_queries(1):
+            facets = SUT.get_facets(lemonades)
+
+        print("     should count the products found per nutriscore grade")
+        assert facets["nutriscore_grade"] == [("b", 1), ("d", 1)]
+
+        print("     should count the products found per category (the most used first)")
+        assert facets["categories"][0] == ("beverage", 2)
+        assert ("light", 1) in facets["categories"]
+
+        print("     should return at most max_categories categories")
+        assert len(SUT.get_facets(lemonades, max_categories=3)["categories"]) == 3
+
+        print("Filtering by facets should keep the products of the nutriscore grade "
+                "and of the category")
+        assert [product.name for product in SUT.filter_by_facets(lemonades, "b")] == [
+            "Lemonade light"]
+        assert len(SUT.filter_by_facets(SUT.find_original_products("beverage"), "", "cola")) == 2
+        assert list(SUT.filter_by_facets(lemonades, "b", "sugar added")) == []
+
+    def test_get_page_of_products(self, add_products_to_db):
+        add_products_to_db
+        all_products = SUT.objects.all()
+
+        print("The first page should return the first products ordered by name "
+                "and a cursor for the next page")
+        page, next_cursor = SUT.get_page_of_products(all_products, "", page_size=2)
+        assert [product.name for product in page] == ["Cool cola", "Cool cola light"]
+        assert next_cursor
+
+        print("The cursor should give the next page")
+        page, next_cursor = SUT.get_page_of_products(all_products, next_cursor, page_size=2)
+        assert [product.name for product in page] == ["Lemonade", "Lemonade light"]
+
+        print("The last page should not have a cursor for a next page")
+        page, next_cursor = SUT.get_page_of_products(all_products, next_cursor, page_size=2)
+        assert [product.name for product in page] == ["Natural carbonated water"]
+        assert next_cursor == ""
+
+        print("The heavy fields should not be fetched")
+        assert "keywords" in page[0].get_deferred_fields()
+        assert "nutriments" in page[0].get_deferred_fields()
+
+        print("Ranked products (e.g.: full_text search) should be paginated by rank")
+        ranked_ids = list(all_products.order_by("-name").values_list("id", flat=True))
+        ranked_products = SUT.find_in_order(ranked_ids)
+        page, next_cursor = SUT.get_page_of_products(ranked_products, "", page_size=3)
+        assert [product.id for product in page] == ranked_ids[:3]
+        page, next_cursor = SUT.get_page_of_products(ranked_products, next_cursor, page_size=3)
+        assert [product.id for product in page] == ranked_ids[3:]
+        assert next_cursor == ""
+
+        print("     and a cursor of the order by name should give the first page")
+        _, name_cursor = SUT.get_page_of_products(all_products, "", page_size=2)
+        page, _ = SUT.get_page_of_products(ranked_products, name_cursor, page_size=3)
+        assert [product.id for product in page] == ranked_ids[:3]
+
     def test_find_substitute_products(self, add_products_to_db):
         add_products_to_db
 
@@ -104,6 +385,15 @@ class TestProductModel:
                 "(number of categories in common) to the lighter")
         assert substitutes[0]["weight"] > substitutes[-1]["weight"]
 
+        print("     should return the nutriments as decoded JSON (null and true included)")
+        SUT.objects.filter(id=substitutes[0]["id"]).update(
+            nutriments={"fat_100g": 1.5, "nova_group": None, "organic": True})
+        substitutes = SUT.find_substitute_products(
+            str(cool_cola_with_score_e.id),
+            cool_cola_with_score_e.nutriscore_grade)
+        assert substitutes[0]["nutriments"] == {
+            "nutriment": {"fat_100g": 1.5, "nova_group": None, "organic": True}}
+
         print("An original product that does not have a better substitute ")
         natural_carb_water_with_score_a = SUT.objects.get(original_id=123460)
 
@@ -137,3 +427,286 @@ class TestProductModel:
             SUT.find_substitute_products(
                 str(natural_carb_water_with_score_a.id),
                 "")
+
+    def test_find_substitute_products_with_nutrient_constraints(self, add_products_to_db):
+        add_products_to_db
+        cool_cola_with_score_e = SUT.objects.get(original_id=123457)
+        SUT.objects.filter(id=cool_cola_with_score_e.id).update(sugars_100g=10.6, fat_100g=0)
+        substitutes = SUT.find_substitute_products(
+            str(cool_cola_with_score_e.id), cool_cola_with_score_e.nutriscore_grade)
+        less_sugars_id, more_sugars_id = substitutes[0]["id"], substitutes[1]["id"]
+        SUT.objects.filter(id=less_sugars_id).update(sugars_100g=0.5, fat_100g=0)
+        SUT.objects.filter(id=more_sugars_id).update(sugars_100g=12, fat_100g=0.2)
+
+        print("Only the substitutes with less sugars than the original product should be "
+                "returned (the ones whose sugars are unknown are excluded)")
+        substitutes = SUT.find_substitute_products(
+            str(cool_cola_with_score_e.id), cool_cola_with_score_e.nutriscore_grade,
+            {"sugars_100g__lt": NUTRIENT_OF_ORIGINAL})
+        assert [substitute["id"] for substitute in substitutes] == [less_sugars_id]
+
+        print("A nutrient can be compared to a number")
+        substitutes = SUT.find_substitute_products(
+            str(cool_cola_with_score_e.id), cool_cola_with_score_e.nutriscore_grade,
+            {"sugars_100g__gte": 1, "fat_100g__lte": 0.2})
+        assert [substitute["id"] for substitute in substitutes] == [more_sugars_id]
+
+        print("An unknown nutrient or operator should raise an exception")
+        for nutrient_constraints in (
+            {"sugars__lt": 1}, {"sugars_100g__ne": 1}, {"sugars_100g__lt": "1; DROP"}
+        ):
+            with pytest.raises(Exception):
+                SUT.find_substitute_products(
+                    str(cool_cola_with_score_e.id), cool_cola_with_score_e.nutriscore_grade,
+                    nutrient_constraints)
+
+    def test_find_substitute_products_without_too_general_categories(
+            self, settings, add_products_to_db):
+        add_products_to_db
+        Category.refresh_frequencies()
+        CatalogVersion.bump(5)
+        caches.forget_catalog_version()
+        cool_cola_with_score_e = SUT.objects.get(original_id=123457)
+
+        def find_substitutes(product, **kwargs):
+            return [
+                (substitute["name"], substitute["weight"])
+                for substitute in SUT.find_substitute_products(
+                    str(product.id), product.nutriscore_grade, **kwargs)
+            ]
+
+        print("All the categories should be counted by default")
+        assert find_substitutes(cool_cola_with_score_e) == [
+            ("Cool cola light", 2), ("Lemonade", 2),
+            ("Natural carbonated water", 1), ("Lemonade light", 1)]
+
+        print("A category found in more than max_category_ratio of the products should "
+                "not be counted ('beverage' is on all of them)")
+        assert find_substitutes(cool_cola_with_score_e, max_category_ratio=0.8) == [
+            ("Cool cola light", 1), ("Lemonade", 1)]
+
+        print("     unless all the categories of the product are too general")
+        assert find_substitutes(
+            cool_cola_with_score_e, max_category_ratio=0.1
+        ) == find_substitutes(cool_cola_with_score_e)
+
+        print("The cap of the settings should be used to find, read and precompute "
+                "the substitutes")
+        settings.PRODUCTS_SUBSTITUTES_MAX_CATEGORY_RATIO = 0.8
+        products = list(SUT.objects.all())
+
+        def ids_and_weights(substitutes):
+            return [(substitute["id"], substitute["weight"]) for substitute in substitutes]
+
+        expected_substitutes = {
+            product.id: ids_and_weights(
+                SUT.find_substitute_products(str(product.id), product.nutriscore_grade))
+            for product in products
+        }
+        assert len(expected_substitutes[cool_cola_with_score_e.id]) == 2
+        for is_precomputed in (False, True):
+            if is_precomputed:
+                ProductSubstitute.refresh()
+            for product in products:
+                assert ids_and_weights(
+                    SUT.find_product_and_substitutes(product.id)[1]
+                ) == expected_substitutes[product.id]
+            assert {
+                product_id: ids_and_weights(substitutes)
+                for product_id, substitutes in SUT.find_substitutes_in_batch(
+                    list(expected_substitutes)).items()
+            } == {
+                product_id: substitutes
+                for product_id, substitutes in expected_substitutes.items()
+                if substitutes
+            }
+
+        caches.forget_catalog_version()
+
+    def test_refresh_substitutes_when_categories_cross_the_cap(self, settings, add_products_to_db):
+        add_products_to_db
+        Category.refresh_frequencies()
+        CatalogVersion.bump(5)
+        caches.forget_catalog_version()
+        ProductSubstitute.refresh()
+        products = list(SUT.objects.all())
+
+        def assert_precomputed_substitutes_are_up_to_date():
+            for product in products:
+                assert [
+                    (row.substitute_id, row.weight)
+                    for row in ProductSubstitute.objects.filter(product=product).order_by("rank")
+                ] == [
+                    (substitute["id"], substitute["weight"])
+                    for substitute in SUT.find_substitute_products(
+                        str(product.id), product.nutriscore_grade)
+                ]
+
+        print("The incremental refresh should recompute the substitutes of the products of a "
+                "category going over the cap ('beverage' is on all of them)")
+        settings.PRODUCTS_SUBSTITUTES_MAX_CATEGORY_RATIO = 0.8
+        ProductSubstitute.refresh(incremental=True)
+        assert_precomputed_substitutes_are_up_to_date()
+        assert CatalogVersion.objects.get(id=1).substitutes_too_general_categories == [
+            Category.objects.get(name="beverage").id]
+
+        print("     or going under the cap (e.g.: the catalog has grown)")
+        CatalogVersion.bump(7)
+        caches.forget_catalog_version()
+        ProductSubstitute.refresh(incremental=True)
+        assert_precomputed_substitutes_are_up_to_date()
+        assert CatalogVersion.objects.get(id=1).substitutes_too_general_categories == []
+
+        caches.forget_catalog_version()
+
+    def test_find_product_and_substitutes(self, add_products_to_db, django_assert_num_queries):
+        add_products_to_db
+        cool_cola_with_score_e = SUT.objects.get(original_id=123457)
+
+        print("A product and its substitutes should be fetched with a single query")
+        with django_assert_num_queries(1):
+            product, substitutes = SUT.find_product_and_substitutes(cool_cola_with_score_e.id)
+        assert product == cool_cola_with_score_e
+
+        print("     the substitutes should be the ones of find_substitute_products")
+        expected_substitutes = SUT.find_substitute_products(
+            str(cool_cola_with_score_e.id), cool_cola_with_score_e.nutriscore_grade)
+        assert [(substitute["id"], substitute["weight"]) for substitute in substitutes] == [
+            (substitute["id"], substitute["weight"]) for substitute in expected_substitutes]
+        assert substitutes[0]["nutriments"] == expected_substitutes[0]["nutriments"]
+
+        print("A better nutriscore grade can be required")
+        product, substitutes = SUT.find_product_and_substitutes(
+            str(cool_cola_with_score_e.id), "b")
+        assert all(substitute["nutriscore_grade"] < "b" for substitute in substitutes)
+
+        print("An unknown product id should return no product")
+        assert SUT.find_product_and_substitutes(123456789) == (None, [])
+        assert SUT.find_product_and_substitutes("not an id") == (None, [])
+
+    def test_refresh_substitutes(self, add_products_to_db, django_assert_num_queries):
+        add_products_to_db
+        CatalogVersion.bump()
+        products = list(SUT.objects.all())
+        computed_substitutes = {
+            product.id: SUT.find_product_and_substitutes(product.id)[1] for product in products}
+
+        print("The substitutes of all the products should be precomputed")
+        assert ProductSubstitute.refresh() == sum(
+            len(substitutes) for substitutes in computed_substitutes.values())
+        assert CatalogVersion.objects.get(id=1).substitutes_version == CatalogVersion.current()
+
+        print("     then read from the table with a single query")
+        for product in products:
+            with django_assert_num_queries(1):
+                _, substitutes = SUT.find_product_and_substitutes(product.id)
+            assert substitutes == computed_substitutes[product.id]
+
+        print("     but not if another nutriscore grade is required")
+        cool_cola_with_score_e = SUT.objects.get(original_id=123457)
+        substitutes = SUT.find_product_and_substitutes(cool_cola_with_score_e.id, "c")[1]
+        assert [substitute["nutriscore_grade"] for substitute in substitutes] == ["a", "b"]
+
+        print("The precomputed substitutes should not be used with a new catalog")
+        SUT.objects.update(nutriscore_grade="a")
+        assert len(SUT.find_product_and_substitutes(cool_cola_with_score_e.id)[1]) == 4
+        CatalogVersion.bump()
+        assert SUT.find_product_and_substitutes(cool_cola_with_score_e.id)[1] == []
+
+    def test_find_substitutes_in_batch(self, add_products_to_db, django_assert_num_queries):
+        add_products_to_db
+        products = list(SUT.objects.all())
+        expected_substitutes = {
+            product.id: [
+                (substitute["id"], substitute["weight"])
+                for substitute in SUT.find_substitute_products(
+                    str(product.id), product.nutriscore_grade)
+            ]
+            for product in products
+        }
+
+        def find_in_batch(product_ids):
+            return {
+                product_id: [(substitute["id"], substitute["weight"]) for substitute in substitutes]
+                for product_id, substitutes in SUT.find_substitutes_in_batch(product_ids).items()
+            }
+
+        print("The substitutes of many products should be the ones of "
+                "find_substitute_products, found with a single query")
+        for nbr_of_products in (1, 3, len(products)):
+            product_ids = [product.id for product in products[:nbr_of_products]]
+            with django_assert_num_queries(1):
+                substitutes = find_in_batch(product_ids + [123456789])
+            assert substitutes == {
+                product_id: expected_substitutes[product_id]
+                for product_id in product_ids
+                if expected_substitutes[product_id]
+            }
+
+        print("     also when they are read from the precomputed table")
+        CatalogVersion.bump()
+        ProductSubstitute.refresh()
+        assert find_in_batch([product.id for product in products]) == {
+            product_id: substitutes
+            for product_id, substitutes in expected_substitutes.items()
+            if substitutes
+        }
+
+        print("No id should return no substitute")
+        assert SUT.find_substitutes_in_batch([]) == {}
+
+    def test_refresh_substitutes_incrementally(self, add_products_to_db):
+        add_products_to_db
+
+        print("The added products should be recorded for the next refresh")
+        assert TouchedProduct.objects.count() == 5
+        CatalogVersion.bump()
+        ProductSubstitute.refresh()
+        assert TouchedProduct.objects.count() == 0
+
+        lemonade = SUT.objects.get(original_id=123456)
+        rows_of_lemonade = list(
+            ProductSubstitute.objects.filter(product=lemonade).values_list("id", flat=True))
+
+        print("A product added to the category 'cola' should be recorded")
+        new_cola = copy.deepcopy(welformed_products[1])
+        new_cola._id = "123461"
+        new_cola.nutriscore_grade = "a"
+        new_cola.categories = ["cola"]
+        SUT.add_many([new_cola])
+        assert list(TouchedProduct.objects.values_list("product__original_id", flat=True)) == [
+            123461]
+        CatalogVersion.bump()
+
+        print("     then only the substitutes of the colas should be recomputed")
+        assert ProductSubstitute.refresh(incremental=True) == 5 + 3  # Cool cola (light)
+        assert list(ProductSubstitute.objects.filter(product=lemonade).values_list(
+            "id", flat=True)) == rows_of_lemonade
+
+        print("     and the substitutes should be the same as after a full refresh")
+        rows = set(ProductSubstitute.objects.values_list(
+            "product", "substitute", "weight", "rank"))
+        ProductSubstitute.refresh()
+        assert rows == set(ProductSubstitute.objects.values_list(
+            "product", "substitute", "weight", "rank"))
+        _, substitutes = SUT.find_product_and_substitutes(
+            SUT.objects.get(original_id=123457).id)
+        assert 123461 in [substitute["original_id"] for substitute in substitutes]
+
+        print("A product added to a new category should be recorded")
+        welformed_products[0].categories.append("cola")
+        try:
+            SUT.add_many([welformed_products[0]])
+        finally:
+            welformed_products[0].categories.remove("cola")
+        assert list(TouchedProduct.objects.values_list("product", flat=True)) == [lemonade.id]
+
+        print("The categories of the stored products should be read with a single query")
+        with CaptureQueriesContext(connection) as context:
+            SUT.add_many(welformed_products)
+        assert len([
+            query for query in context.captured_queries
+            if '"products_category"."name"' in query["sql"]
+            and '"products_category_products"' in query["sql"]
+        ]) == 1
+        assert list(TouchedProduct.objects.values_list("product", flat=True)) == [lemonade.id]
@@ -1,9 +1,15 @@
 import logging
+from decimal import Decimal
 
 from products import utils
 from products.utils import (
+    decode_cursor,
+    encode_cursor,
     format_quantity_and_unit,
     format_text,
+    is_barcode,
+    parse_nutrition_facts,
+    parse_quantity,
     remove_space_between_quantity_and_unit,
 )
 
@@ -89,6 +95,41 @@ def test_format_quantity_and_unit(monkeypatch, caplog):
     assert "ERROR" in caplog.text
 
 
+def test_format_quantity_and_unit_converts_any_quantity():
+    print("Each quantity should be written in its canonical unit")
+    assert format_quantity_and_unit(" 400 ml ") == " 40cl "
+    assert format_quantity_and_unit(" 1,75 L ") == " 1.75l "
+    assert format_quantity_and_unit(" 0,5 kilogramme ") == " 500g "
+    assert format_quantity_and_unit(" 2500 ml 125ml 0.0005kg ") == " 2.5l 12.5cl 500mg "
+    assert format_quantity_and_unit(" 1000ml, 2.50l ") == " 1l, 2.5l "
+
+    print("A canonical quantity should stay the same")
+    assert format_quantity_and_unit(" 33cl 1.5l 300g 2kg ") == " 33cl 1.5l 300g 2kg "
+
+    print("A number glued to a word should not be taken for a quantity")
+    assert format_quantity_and_unit(" 0,5lait 3d 10m² ") == " 0,5lait 3d 10m² "
+
+
+def test_parse_quantity():
+    print("The first quantity of the text should be returned in its base unit")
+    assert parse_quantity("6 x 33 cl") == utils.Quantity(Decimal(330), "ml")
+    assert parse_quantity("1,5 L") == utils.Quantity(Decimal(1500), "ml")
+    assert parse_quantity("Pack de 8 pieces de 2 Kg de farine") == utils.Quantity(
+        Decimal(2000), "g"
+    )
+    assert str(parse_quantity("500 grammes")) == "500g"
+
+    print("A text without quantity should return None")
+    assert parse_quantity("1 bouteille") is None
+    assert parse_quantity("") is None
+    assert parse_quantity(None) is None
+
+    print("A quantity that does not fit Product.quantity_value should return None")
+    assert parse_quantity("99999999999999 kg") is None
+    assert parse_quantity("999999999999,9999 g") is None
+    assert parse_quantity("999999999999 g") == utils.Quantity(Decimal(999999999999), "g")
+
+
 def test_format_text(monkeypatch, caplog):
 
     expected = (
@@ -123,3 +164,64 @@ def test_format_text(monkeypatch, caplog):
     print("Non string text should return empty string and log an error")
     assert format_quantity_and_unit({"text": "is dict"}) == ""
     assert "ERROR" in caplog.text
+
+
+def test_encode_and_decode_cursor(caplog):
+    print("A decoded cursor should return the name and the id that were encoded")
+    cursor = encode_cursor("Pâte à tartiner & co", 42)
+    assert decode_cursor(cursor) == ("Pâte à tartiner & co", 42)
+
+    print("     or the rank and the id")
+    assert decode_cursor(encode_cursor(0.0607927, 42)) == (0.0607927, 42)
+
+    print("The cursor should be usable in a URL")
+    assert all(char.isalnum() or char in "-_=" for char in cursor)
+
+    print("A malformed cursor should return None and log a warning")
+    assert decode_cursor("not a cursor") is None
+    assert decode_cursor(encode_cursor("name", "not an id")) is None
+    assert decode_cursor(encode_cursor(True, 42)) is None
+    assert "Malformed cursor" in caplog.text
+
+    print("An empty cursor should return None")
+    assert decode_cursor("") is None
+
+
+def test_is_barcode():
+    print("A text made only of digits should be a bar code")
+    assert is_barcode("3017620422003")
+    assert is_barcode(" 3017620422003 ")
+
+    print("A text containing other characters than digits should not be a bar code")
+    assert not is_barcode("coca cola 33cl")
+    assert not is_barcode("3017620422003 nutella")
+    assert not is_barcode("３０１７")  # Full width digits
+
+    print("A number too big for Product.code should not be a bar code")
+    assert not is_barcode("1" * 19)
+
+    print("An empty text or a non string should not be a bar code")
+    assert not is_barcode("")
+    assert not is_barcode(3017620422003)
+
+
+def test_parse_nutrition_facts():
+    print("The nutrients per 100 g should be read as floats")
+    nutrition_facts = parse_nutrition_facts(
+        {"energy-kcal_100g": 539, "fat_100g": "30.9", "sugars_100g": 56.3, "salt": 0.1})
+    assert nutrition_facts == {
+        "energy_kcal_100g": 539.0,
+        "fat_100g": 30.9,
+        "fiber_100g": None,
+        "proteins_100g": None,
+        "salt_100g": None,
+        "sugars_100g": 56.3,
+    }
+
+    print("A non numeric, negative or infinite nutrient should be None")
+    nutrition_facts = parse_nutrition_facts(
+        {"fat_100g": "traces", "salt_100g": -1, "sugars_100g": "inf"})
+    assert set(nutrition_facts.values()) == {None}
+
+    print("Nutriments that are not a dict should give no nutrient")
+    assert set(parse_nutrition_facts("Some nutriments").values()) == {None}
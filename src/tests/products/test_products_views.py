@@ -1,13 +1,13 @@
 import logging
 
 from django.test import Client
-from django.urls import reverse
 
 import pytest
 
 from products.models import Category, Customer, L_Favorite, Product
 from src.tests.products.params_for_mark_parametrize.products_objs import welformed_products
 import src.products.views as sut
+from products import search_index
 
 
 client = Client()
@@ -146,7 +146,7 @@ def test_check_email():
 def test_get_substitutes(monkeypatch, caplog):
     caplog.clear()
 
-    def mock_find_substitute_products(id, nutriscore_grade):
+    def mock_find_product_and_substitutes(id, nutriscore_grade=None):
         try:
             if not (id
                     and isinstance(id, str)):
@@ -158,19 +158,21 @@ def test_get_substitutes(monkeypatch, caplog):
         except Exception as e:
             print(f"Exception raised: {str(e)}")
 
+        original_product = Product.objects.filter(id=id).first()
+
         if nutriscore_grade > "b":
-            return substitutes_list1
+            return original_product, substitutes_list1
 
         if nutriscore_grade == "b":
-            return substitutes_list2
+            return original_product, substitutes_list2
 
-        return []
+        return original_product, []
 
-    monkeypatch.setattr(Product, "find_substitute_products", mock_find_substitute_products)
+    monkeypatch.setattr(Product, "find_product_and_substitutes", mock_find_product_and_substitutes)
 
-    print("An original product id that doesn't exist should raise an exception")
-    with pytest.raises(Exception):
-        response = client.get('/get-substitutes', {'id': '9995288', 'nutriscore_grade': "c"})
+    print("An original product id that doesn't exist should return a 404 error")
+    response = client.get('/get-substitutes', {'id': '9995288', 'nutriscore_grade': "c"})
+    assert response.status_code == 404
 
     print("An original product")
     add_a_category()
@@ -307,17 +309,18 @@ def test_get_origial_product(caplog, add_products_to_db):
     caplog.clear()
 
     print("If only ONE product contains ALL the keywords then")
-    print("     should redirect to the substitutes page with original product_id and "
-            "nutriscore_grade as query")
+    print("     should serve the substitutes page of this product (without redirection)")
 
     context = {"keywords_of_original_product": "Lemonade light"}
     response = client.get(url, context)
-    assert response['Location'] == (reverse('products_get_substitutes')
-                                    + '?id=3'
-                                    '&nutriscore_grade=b')
-
-    print("     Should log an info: 'Redirect to get_substitutes'")
-    assert "Redirect to get_substitutes" in caplog.text
+    assert response.status_code == 200
+    assert response.templates[0].name == 'products/substitutes.html'
+    assert response.context["original_product"].id == 3
+    assert [product["name"] for product in response.context["substitute_products"]] == [
+        "Natural carbonated water"]
+
+    print("     Should log an info: 'Only one product found. Render the substitutes'")
+    assert "Only one product found. Render the substitutes" in caplog.text
     caplog.clear()
 
     print("If no products contain absolutly ALL the keywords then ")
@@ -335,6 +338,53 @@ def test_get_origial_product(caplog, add_products_to_db):
     assert "autres mots-clefs." in str(response.content)
 
 
+@pytest.mark.integration_test
+def test_get_origial_product_by_barcode(caplog, django_assert_num_queries):
+    caplog.set_level(logging.INFO)
+    product = add_a_product()
+    url = "/products_get-origial-product"
+
+    print("If the keywords are the bar code of a product then")
+    print("     should serve the substitutes page with two queries (the bar code then "
+            "the product and its substitutes)")
+    context = {"keywords_of_original_product": f" {product.code} "}
+    with django_assert_num_queries(2):
+        response = client.get(url, context)
+    assert response.templates[0].name == 'products/substitutes.html'
+    assert response.context["original_product"] == product
+    assert "Bar code found" in caplog.text
+
+    print("If no product has this bar code then")
+    print("     should search the number in the keywords")
+    context = {"keywords_of_original_product": "1234567890123"}
+    response = client.get(url, context, follow=True)
+    assert "No original products found!" in caplog.text
+
+
+@pytest.mark.integration_test
+def test_get_origial_product_with_facets(add_products_to_db):
+    add_products_to_db
+    url = "/products_get-origial-product"
+
+    print("The products found should be counted per nutriscore grade and category")
+    response = client.get(url, {"keywords_of_original_product": "Beverage"})
+    assert response.context["facets"]["nutriscore_grade"] == [
+        ("a", 1), ("b", 1), ("c", 1), ("d", 1), ("e", 1)]
+    assert ("cola", 2) in response.context["facets"]["categories"]
+
+    print("The filters should narrow the products found")
+    response = client.get(url, {"keywords_of_original_product": "Beverage", "category": "cola"})
+    assert len(response.context["original_products"]) == 2
+    assert response.context["facets"]["nutriscore_grade"] == [("c", 1), ("e", 1)]
+
+    print("     should not redirect to the substitutes if only one product is left")
+    response = client.get(
+        url, {"keywords_of_original_product": "Beverage", "category": "cola", "nutriscore": "c"})
+    assert response.status_code == 200
+    assert [product.name for product in response.context["original_products"]] == [
+        "Cool cola light"]
+
+
 @pytest.mark.integration_test
 def test_legal_notice():
     print("This view should return the page 'products/legal_notice.html'")
@@ -418,3 +468,104 @@ def test_get_message():
 def test_delete_fake_users():
     response = client.get('/accounts_delete_fake_users', follow=True)
     assert response.templates[0].name == 'products/home.html'
+
+
+@pytest.mark.integration_test
+def test_get_cache_stats(add_customer_to_db):
+    url = "/products_cache-stats"
+
+    print("A user who is not a member of the staff should be redirected to the login page")
+    response = client.get(url)
+    assert response.status_code == 302
+
+    print("A member of the staff should get the counters of the caches as json")
+    user = add_customer_to_db
+    user.is_staff = True
+    user.save()
+    client.force_login(user)
+    response = client.get(url)
+    assert response.json()["catalog_version"] == 0
+    assert set(response.json()["search_results"]) >= {"hits", "misses", "hit_rate"}
+    client.logout()
+
+
+@pytest.mark.integration_test
+def test_get_suggestions(add_products_to_db):
+    add_products_to_db
+    search_index.reset_prefix_index()
+    url = "/products_autocomplete"
+
+    print("The last word should be completed with the tokens of the products")
+    response = client.get(url, {"q": "Lemon"})
+    assert response.json()["suggestions"] == ["lemon", "lemonade"]
+
+    print("     and the beginning of the text should be kept")
+    response = client.get(url, {"q": "cool co"})
+    assert response.json()["suggestions"] == ["cool cola", "cool cool"]
+
+    print("A text ending with a space or an empty text should return no suggestion")
+    assert client.get(url, {"q": "cool "}).json()["suggestions"] == []
+    assert client.get(url).json()["suggestions"] == []
+
+    search_index.reset_prefix_index()
+
+
+@pytest.mark.integration_test
+def test_search_batch(add_products_to_db):
+    add_products_to_db
+    url = "/products_search-batch"
+
+    print("A list of queries should return the products found for each query")
+    response = client.post(
+        url, {"queries": ["Lemonade", "cola", "orange"], "k": 1}, content_type="application/json")
+    results = response.json()["results"]
+    assert [result["query"] for result in results] == ["Lemonade", "cola", "orange"]
+    assert [len(result["products"]) for result in results] == [1, 1, 0]
+    assert results[0]["products"][0]["name"] == "Lemonade"
+
+    print("An invalid body should return the status 400")
+    assert client.post(url, "not json", content_type="application/json").status_code == 400
+    assert client.post(
+        url, {"queries": "cola"}, content_type="application/json").status_code == 400
+    assert client.post(
+        url, {"queries": ["cola"], "k": 0}, content_type="application/json").status_code == 400
+    assert client.post(
+        url, {"queries": ["cola"] * 51}, content_type="application/json").status_code == 400
+
+    print("Only the method POST should be allowed")
+    assert client.get(url).status_code == 405
+
+
+def test_substitutes_batch(add_products_to_db, django_assert_max_num_queries):
+    add_products_to_db
+    url = "/products_substitutes-batch"
+    cool_cola = Product.objects.get(original_id=123457)
+    water = Product.objects.get(original_id=123460)
+
+    print("A list of ids should return the substitutes of each product, in the same order")
+    with django_assert_max_num_queries(1):
+        response = client.post(
+            url, {"ids": [cool_cola.id, water.id, 123456789]}, content_type="application/json")
+    results = response.json()["results"]
+    assert [result["id"] for result in results] == [cool_cola.id, water.id, 123456789]
+    assert [substitute["id"] for substitute in results[0]["substitutes"]] == [
+        substitute["id"]
+        for substitute in Product.find_substitute_products(
+            str(cool_cola.id), cool_cola.nutriscore_grade)
+    ]
+    assert results[1]["substitutes"] == results[2]["substitutes"] == []
+
+    print("An invalid body should return the status 400")
+    assert client.post(url, "not json", content_type="application/json").status_code == 400
+    assert client.post(url, {"ids": "1"}, content_type="application/json").status_code == 400
+    assert client.post(url, {"ids": ["1"]}, content_type="application/json").status_code == 400
+    assert client.post(url, {"ids": [0]}, content_type="application/json").status_code == 400
+    assert client.post(
+        url, {"ids": [2**63]}, content_type="application/json").status_code == 400
+    assert client.post(
+        url, {"ids": [2**70]}, content_type="application/json").status_code == 400
+    assert client.post(
+        url, {"ids": [1] * 101}, content_type="application/json").status_code == 400
+
+    print("Only the method POST should be allowed")
+    assert client.get(url).status_code == 405
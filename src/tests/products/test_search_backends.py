@@ -0,0 +1,179 @@
+import logging
+import threading
+
+import pytest
+from django.db import connection
+
+from products import caches, models, search_backends, search_index
+from products.caches import LRUCache
+from products.constants import SEARCH_MODE_FULL_TEXT, SEARCH_MODE_ICONTAINS, SEARCH_MODE_MEMORY
+from products.models import Product
+from products.search_backends import IcontainsBackend, MemoryBackend, SearchBackend
+
+
+pytestmark = pytest.mark.django_db
+
+
+class ColaBackend(SearchBackend):
+    """Backend of a third party app (selected by its dotted path)"""
+
+    name = "cola"
+
+    def search(self, keywords_as_list):
+        return Product.objects.filter(keywords__contains="cola")
+
+
+class RankedBackend(SearchBackend):
+    """Backend ordering the products by relevance (here: the last added first)"""
+
+    name = "ranked"
+    is_ranked = True
+
+    def search(self, keywords_as_list):
+        return Product.objects.filter(keywords__contains=keywords_as_list[0]).order_by("-id")
+
+
+def test_get_backend(settings, caplog):
+    print("A built-in backend should be selected by its name")
+    assert isinstance(search_backends.get_backend(SEARCH_MODE_MEMORY), MemoryBackend)
+
+    print("The default backend should be the one of the settings")
+    settings.PRODUCTS_SEARCH_MODE = SEARCH_MODE_MEMORY
+    assert isinstance(search_backends.get_backend(), MemoryBackend)
+
+    print("A backend should be selected by its dotted path")
+    backend = search_backends.get_backend("tests.products.test_search_backends.ColaBackend")
+    assert backend.name == "cola"
+
+    print("An unknown backend should log a warning and fall back to icontains")
+    assert isinstance(search_backends.get_backend("unknown"), IcontainsBackend)
+    assert "Unknown search mode: unknown" in caplog.text
+
+    if connection.vendor != "postgresql":
+        print("A PostgreSQL backend should fall back to icontains on another database")
+        assert isinstance(search_backends.get_backend(SEARCH_MODE_FULL_TEXT), IcontainsBackend)
+
+
+def test_built_in_backends(add_products_to_db):
+    search_index.reset_inverted_index()
+
+    print("The built-in backends should return the products containing ALL the keywords")
+    for name in (SEARCH_MODE_ICONTAINS, SEARCH_MODE_MEMORY):
+        products = search_backends.get_backend(name).search(["beverage", "lemon", "light"])
+        assert [product.name for product in products] == ["Lemonade light"]
+
+    search_index.reset_inverted_index()
+
+
+def test_compare_with_shadow_backend(settings, caplog, monkeypatch, add_products_to_db):
+    caplog.set_level(logging.INFO)
+    search_index.reset_inverted_index()
+    backend = IcontainsBackend()
+
+    print("Without shadow backend, nothing should be compared")
+    settings.PRODUCTS_SEARCH_SHADOW_MODE = ""
+    assert search_backends.get_shadow_backend(backend) is None
+
+    print("A search out of the sample should not be compared")
+    settings.PRODUCTS_SEARCH_SHADOW_MODE = SEARCH_MODE_MEMORY
+    settings.PRODUCTS_SEARCH_SHADOW_SAMPLE_RATE = 0
+    assert search_backends.get_shadow_backend(backend) is None
+
+    print("     nor a search with the same backend")
+    settings.PRODUCTS_SEARCH_SHADOW_SAMPLE_RATE = 1
+    assert search_backends.get_shadow_backend(MemoryBackend()) is None
+
+    print("A sampled search should log the latency and the overlap of both backends")
+    shadow_backend = search_backends.get_shadow_backend(backend)
+    lemon_ids = list(backend.search(["lemon"]).values_list("id", flat=True))
+    comparison = search_backends.compare_with_shadow_backend(
+        ["lemon"], backend, lemon_ids, 1.5, shadow_backend)
+    assert comparison["nbr_of_products"] == comparison["shadow_nbr_of_products"] == 2
+    assert comparison["latency"] == 1.5
+    assert comparison["overlap"] == 1.0
+    assert "Shadow search 'lemon': icontains 1.5 ms" in caplog.text
+
+    print("     icontains matches a part of a token and memory only whole tokens")
+    comparison = search_backends.compare_with_shadow_backend(
+        ["lemo"], backend, lemon_ids, 1.5, shadow_backend)
+    assert comparison["nbr_of_products"] == 2
+    assert comparison["shadow_nbr_of_products"] == 0
+    assert comparison["overlap"] == 0
+
+    print("find_original_products should compare the products it served, after the response")
+    comparisons = []
+    monkeypatch.setattr(
+        search_backends,
+        "compare_with_shadow_backend_later",
+        lambda *args: comparisons.append(args),
+    )
+    products = Product.find_original_products("lemonade")
+    keywords, compared_backend, product_ids, latency, compared_shadow_backend = comparisons[0]
+    assert keywords == ["lemonade"]
+    assert sorted(product_ids) == sorted(product.id for product in products)
+    assert latency > 0
+    assert compared_shadow_backend.name == SEARCH_MODE_MEMORY
+
+    print("     but not the searches served from the cache")
+    monkeypatch.setattr(caches, "search_results_cache", LRUCache(max_size=10, ttl=60))
+    comparisons.clear()
+    Product.find_original_products("lemonade")
+    Product.find_original_products("lemonade")
+    assert len(comparisons) == 1
+
+    search_index.reset_inverted_index()
+
+
+def test_pending_shadow_comparisons_are_bounded(caplog, monkeypatch):
+    released = threading.Event()
+
+    class SlowBackend(SearchBackend):
+        name = "slow"
+
+        def search(self, keywords_as_list):
+            released.wait(5)
+            return Product.objects.none()
+
+    monkeypatch.setattr(search_backends, "_shadow_pending", threading.BoundedSemaphore(1))
+    backend = IcontainsBackend()
+
+    print("A comparison should wait in the background while the shadow search is slow")
+    future = search_backends.compare_with_shadow_backend_later(
+        ["lemon"], backend, [1, 2], 1.5, SlowBackend())
+    assert future is not None
+
+    print("     but the comparisons over the limit should be dropped and logged")
+    assert search_backends.compare_with_shadow_backend_later(
+        ["cola"], backend, [3], 1.5, SlowBackend()) is None
+    assert "Shadow search of ['cola'] dropped" in caplog.text
+
+    print("Once done, a comparison should free its place")
+    released.set()
+    assert future.result(5)["shadow_backend"] == "slow"
+    future = search_backends.compare_with_shadow_backend_later(
+        ["cola"], backend, [3], 1.5, SlowBackend())
+    assert future is not None
+    future.result(5)
+
+
+def test_cached_search_keeps_the_rank(monkeypatch, add_products_to_db):
+    monkeypatch.setattr(caches, "search_results_cache", LRUCache(max_size=10, ttl=60))
+    caches.forget_catalog_version()
+    mode = "tests.products.test_search_backends.RankedBackend"
+    expected_ids = list(RankedBackend().search(["beverage"]).values_list("id", flat=True))
+
+    print("A ranked search should be served in the order of the ranking, cached or not")
+    for _ in range(2):
+        products = Product.find_original_products("beverage", mode=mode)
+        assert [product.id for product in products] == expected_ids
+    assert caches.search_results_cache.hits == 1
+
+    print("Only a bounded number of ids should be cached: a broader search is run again")
+    monkeypatch.setattr(caches, "search_results_cache", LRUCache(max_size=10, ttl=60))
+    monkeypatch.setattr(models, "SEARCH_CACHE_MAX_RESULTS", 2)
+    for _ in range(2):
+        products = Product.find_original_products("beverage", mode=mode)
+        assert [product.id for product in products] == expected_ids
+    assert len(caches.search_results_cache.get(f"{mode}:beverage", 0)) == 3
+
+    caches.forget_catalog_version()
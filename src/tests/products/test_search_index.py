@@ -0,0 +1,135 @@
+import threading
+from array import array
+
+import pytest
+
+from products import caches, search_index
+from products.constants import PRODUCT_ID_MAX, SEARCH_MODE_MEMORY
+from products.models import Product
+from products.search_index import InvertedIndex, PrefixIndex, intersect, tokenize
+
+
+@pytest.fixture
+def inverted_index():
+    index = InvertedIndex()
+    index.add_many([
+        (1, " lemonade lemon beverage "),
+        (2, " cool cola soda beverage cola "),
+        (3, " lemonade lemon beverage light"),
+        (4, " cool cola soda beverage cola light "),
+    ])
+    return index
+
+
+def test_tokenize():
+    print("Keywords should be normalized with format_text then split")
+    assert tokenize("Coca Cola, 1,5 L de soda") == ["coca", "cola", "1.5l", "soda"]
+
+    print("Empty or non string keywords should return an empty list")
+    assert tokenize("") == []
+    assert tokenize(None) == []
+
+
+def test_intersect():
+    print("Should return the ids present in both sorted lists")
+    assert intersect(array("I", [2, 5, 9]), array("I", [1, 2, 3, 9, 12])) == array("I", [2, 9])
+    assert intersect(array("I", [20]), array("I", [1, 2, 3])) == array("I", [])
+
+
+def test_inverted_index_search(inverted_index):
+    print("Should return the ids of the products containing ALL the keywords")
+    assert list(inverted_index.search(["beverage"])) == [1, 2, 3, 4]
+    assert list(inverted_index.search(["light", "cola"])) == [4]
+
+    print("A keyword that no product contains should return no product")
+    assert list(inverted_index.search(["cola", "orange"])) == []
+
+    print("A product added with a smaller id should keep the posting lists sorted")
+    inverted_index.add(0, "cola")
+    assert list(inverted_index.search(["cola"])) == [0, 2, 4]
+
+    print("Any id of Product (64 bits) should be indexed")
+    inverted_index.add(PRODUCT_ID_MAX, "cola")
+    assert list(inverted_index.search(["cola"])) == [0, 2, 4, PRODUCT_ID_MAX]
+
+
+def test_inverted_index_memory_usage(inverted_index):
+    memory = inverted_index.memory_usage()
+
+    print("Should report the size of the index and the size per product")
+    assert memory["nbr_of_products"] == 4
+    assert memory["nbr_of_tokens"] == 7
+    assert memory["bytes_per_product"] == memory["total_bytes"] / 4
+
+
+@pytest.mark.django_db
+def test_find_original_products_in_memory_mode(add_products_to_db):
+    search_index.reset_inverted_index()
+
+    print("The memory mode should return the products containing ALL the keywords")
+    original_products = Product.find_original_products(
+        "beverage lemon light", mode=SEARCH_MODE_MEMORY)
+    assert [product.name for product in original_products] == ["Lemonade light"]
+
+    assert list(Product.find_original_products("beverage orange", mode=SEARCH_MODE_MEMORY)) == []
+
+    print("The index should be patched with the products added afterwards")
+    search_index.add_products([(999, " lemonade lemon beverage light ")])
+    assert 999 in search_index.get_inverted_index().search(["lemonade", "light"])
+
+    search_index.reset_inverted_index()
+
+
+def test_prefix_index_suggest():
+    prefix_index = PrefixIndex.from_rows([
+        (" cool cola soda beverage cola ", "Coca-Cola"),
+        (" coca cola light ", "Coca-Cola"),
+        (" cookies chocolat ", "LU"),
+        (" coconut water ", "Cocowater"),
+    ])
+
+    print("Should return the tokens starting with the prefix, the most used first")
+    assert prefix_index.suggest("coc") == ["coca", "coconut", "cocowater"]
+    assert set(prefix_index.suggest("co")[:2]) == {"coca", "cola"}
+
+    print("Should suggest the brands too")
+    assert prefix_index.suggest("l") == ["light", "lu"]
+
+    print("Should return at most 'limit' suggestions")
+    assert len(prefix_index.suggest("c", limit=2)) == 2
+
+    print("An unknown or empty prefix should return no suggestion")
+    assert prefix_index.suggest("xyz") == []
+    assert prefix_index.suggest("") == []
+
+
+def test_prefix_index_rebuilt_in_background(monkeypatch):
+    search_index.reset_prefix_index()
+    monkeypatch.setattr(caches, "get_catalog_version", lambda: 1)
+    built = threading.Event()
+
+    def build_prefix_index(catalog_version):
+        if catalog_version == 2:
+            built.wait(5)
+        return PrefixIndex.from_rows([(f" version{catalog_version} ", "")], catalog_version)
+
+    monkeypatch.setattr(search_index._prefix_index, "build", build_prefix_index)
+
+    print("The prefix index should be built on first use")
+    assert search_index.get_prefix_index().suggest("v") == ["version1"]
+
+    print("After a load, the previous index should be served while the new one is built")
+    monkeypatch.setattr(caches, "get_catalog_version", lambda: 2)
+    assert search_index.get_prefix_index().suggest("v") == ["version1"]
+    rebuild = search_index._prefix_index.rebuild
+    assert rebuild is not None
+    assert search_index.get_prefix_index().suggest("v") == ["version1"]
+    assert search_index._prefix_index.rebuild is rebuild
+
+    print("     then be replaced once built")
+    built.set()
+    rebuild.join(5)
+    assert search_index.get_prefix_index().suggest("v") == ["version2"]
+    assert search_index._prefix_index.rebuild is None
+
+    search_index.reset_prefix_index()
@@ -0,0 +1,222 @@
+import random
+
+import pytest
+
+from products import caches
+from products.models import CatalogVersion, Category, Product
+
+np = pytest.importorskip("numpy")
+
+from products import substitute_engine  # noqa: E402
+from products.constants import SUBSTITUTES_ENGINE_MINHASH, SUBSTITUTES_ENGINE_SQL  # noqa: E402
+from products.substitute_engine import CategoryMatrix, MinHashIndex  # noqa: E402
+
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def add_random_products_to_db():
+    # Few categories and grades: many ties on the weight and on the grade
+    random_generator = random.Random(42)
+    categories = Category.objects.bulk_create(
+        Category(name=f"random category {index}") for index in range(8))
+    products = Product.objects.bulk_create(
+        Product(
+            name=f"random product {index}", brands="", code=index, original_id=-index - 1,
+            quantity="", image_thumb_url="", image_url="", ingredients_text="",
+            keywords="", nutriments={}, nutriscore_grade=random_generator.choice("abcde"),
+            stores="", url="",
+        )
+        for index in range(150)
+    )
+    Membership = Category.products.through
+    Membership.objects.bulk_create(
+        Membership(category_id=category.id, product_id=product.id)
+        for product in products
+        for category in random_generator.sample(categories, random_generator.randint(0, 4))
+    )
+
+
+def expected_substitutes(product: Product, nutriscore_grade: str = None, **kwargs):
+    return [
+        (substitute["id"], substitute["weight"])
+        for substitute in Product.find_substitute_products(
+            str(product.id), nutriscore_grade or product.nutriscore_grade, **kwargs)
+    ]
+
+
+def test_find_substitutes(add_products_to_db, add_random_products_to_db):
+    matrix = CategoryMatrix.load()
+    products = list(Product.objects.all())
+
+    print("The substitutes of each product should be the ones of find_substitute_products "
+            "(same products, same weights, same order)")
+    for product in products:
+        assert matrix.find_substitutes(product.id) == expected_substitutes(product)
+
+    print("A better nutriscore grade can be required")
+    for product in products[:20]:
+        assert matrix.find_substitutes(product.id, "c") == expected_substitutes(product, "c")
+
+    print("An unknown product should have no substitute")
+    assert matrix.find_substitutes(max(product.id for product in products) + 1) == []
+
+
+def test_find_many_substitutes(add_products_to_db, add_random_products_to_db):
+    matrix = CategoryMatrix.load()
+    products = list(Product.objects.all())
+
+    print("The substitutes of all the products should be computed at once, in small "
+            "batches too")
+    for batch_size in (256, 7):
+        substitutes = matrix.find_many_substitutes(batch_size=batch_size)
+        for product in products:
+            assert substitutes.get(product.id, []) == expected_substitutes(product)
+
+    print("The substitutes of some products only should be computed")
+    substitutes = matrix.find_many_substitutes([products[0].id, products[1].id, 123456789])
+    assert set(substitutes) <= {products[0].id, products[1].id}
+    assert substitutes.get(products[0].id, []) == expected_substitutes(products[0])
+
+
+def test_find_substitutes_without_too_general_categories(
+        add_products_to_db, add_random_products_to_db):
+    Category.refresh_frequencies()
+    CatalogVersion.bump(Product.objects.count())
+    caches.forget_catalog_version()
+    products = list(Product.objects.all())
+
+    print("The categories on more than max_category_ratio of the products should not be "
+            "counted, as in find_substitute_products")
+    matrix = CategoryMatrix.load(max_category_ratio=0.2)
+    assert 0 < matrix.is_too_general.sum() < matrix.nbr_of_categories
+    substitutes = matrix.find_many_substitutes()
+    for product in products:
+        expected = expected_substitutes(product, max_category_ratio=0.2)
+        assert matrix.find_substitutes(product.id) == expected
+        assert substitutes.get(product.id, []) == expected
+    assert any(
+        substitutes.get(product.id, []) != expected_substitutes(product) for product in products)
+
+    caches.forget_catalog_version()
+
+
+def test_find_approximate_substitutes(add_products_to_db, add_random_products_to_db):
+    matrix = CategoryMatrix.load()
+    index = MinHashIndex(matrix, nbr_of_bands=64, rows_per_band=2)
+    products = list(Product.objects.all())
+    categories = {
+        product.id: set(product.categories.values_list("id", flat=True)) for product in products}
+    grades = {product.id: product.nutriscore_grade for product in products}
+
+    print("The approximate substitutes should be better products with their exact number "
+            "of categories in common, in the order of the exact engine")
+    nbr_of_found = nbr_of_expected = 0
+    for product in products:
+        substitutes = index.find_substitutes(product.id)
+        for substitute_id, weight in substitutes:
+            assert grades[substitute_id] < product.nutriscore_grade
+            assert weight == len(categories[substitute_id] & categories[product.id]) > 0
+        assert substitutes == sorted(
+            substitutes, key=lambda substitute: (-substitute[1], grades[substitute[0]], substitute[0]))
+
+        exact_substitutes = matrix.find_substitutes(product.id)
+        nbr_of_expected += len(exact_substitutes)
+        nbr_of_found += len(set(exact_substitutes) & set(substitutes))
+
+    print("     most of the exact substitutes should be found")
+    assert nbr_of_found / nbr_of_expected > 0.5
+
+    print("The products having the same categories should always be candidates")
+    for product in products[:20]:
+        candidate_ids = set(matrix.product_ids[index.find_candidates(product.id)].tolist())
+        assert all(
+            other_product_id in candidate_ids
+            for other_product_id, other_categories in categories.items()
+            if other_categories and other_categories == categories[product.id])
+
+    print("An unknown product should have no substitute")
+    assert index.find_substitutes(max(product.id for product in products) + 1) == []
+
+
+def test_find_approximate_substitutes_without_too_general_categories(
+    settings, add_products_to_db, add_random_products_to_db
+):
+    Category.refresh_frequencies()
+    CatalogVersion.bump(Product.objects.count())
+    caches.forget_catalog_version()
+    substitute_engine.reset_minhash_index()
+    settings.PRODUCTS_SUBSTITUTES_MAX_CATEGORY_RATIO = 0.2
+    matrix = CategoryMatrix.load()
+    assert 0 < matrix.is_too_general.sum() < matrix.nbr_of_categories
+    index = MinHashIndex(matrix, nbr_of_bands=64, rows_per_band=2)
+    products = list(Product.objects.all())
+
+    print("The approximate substitutes should not count the too general categories either: "
+            "their weights are the ones of the exact engine with the same cap")
+    nbr_of_found = nbr_of_expected = 0
+    for product in products:
+        exact_substitutes = dict(expected_substitutes(product))
+        substitutes = index.find_substitutes(product.id)
+        assert all(
+            exact_substitutes.get(substitute_id, weight) == weight
+            for substitute_id, weight in substitutes)
+        nbr_of_expected += len(exact_substitutes)
+        nbr_of_found += len(set(exact_substitutes.items()) & set(substitutes))
+    assert nbr_of_found / nbr_of_expected > 0.5
+
+    print("     also with the minhash engine of the settings")
+    settings.PRODUCTS_SUBSTITUTES_ENGINE = SUBSTITUTES_ENGINE_MINHASH
+    index = substitute_engine.get_minhash_index()
+    for product in products[:30]:
+        substitutes = Product.find_substitute_products(str(product.id), product.nutriscore_grade)
+        assert [(substitute["id"], substitute["weight"]) for substitute in substitutes] == (
+            index.find_substitutes(product.id))
+        _, page_substitutes = Product.find_product_and_substitutes(product.id)
+        assert [substitute["id"] for substitute in page_substitutes] == [
+            substitute["id"] for substitute in substitutes]
+
+    substitute_engine.reset_minhash_index()
+    caches.forget_catalog_version()
+
+
+def test_find_substitute_products_with_minhash_engine(
+    settings, add_products_to_db, add_random_products_to_db
+):
+    substitute_engine.reset_minhash_index()
+    caches.forget_catalog_version()
+    index = MinHashIndex(CategoryMatrix.load())
+    products = list(Product.objects.all()[:30])
+
+    print("The minhash engine should find the substitutes of the MinHash index, in the format "
+            "of the exact engine")
+    settings.PRODUCTS_SUBSTITUTES_ENGINE = SUBSTITUTES_ENGINE_MINHASH
+    nbr_of_substitutes = 0
+    for product in products:
+        substitutes = Product.find_substitute_products(str(product.id), product.nutriscore_grade)
+        nbr_of_substitutes += len(substitutes)
+        assert [(substitute["id"], substitute["weight"]) for substitute in substitutes] == (
+            index.find_substitutes(product.id))
+        assert all(
+            substitute.keys() == exact_substitute.keys()
+            for substitute, exact_substitute in zip(
+                substitutes, Product.find_substitute_products(
+                    str(product.id), product.nutriscore_grade, engine=SUBSTITUTES_ENGINE_SQL)))
+
+        print("     also for the substitutes page")
+        page_product, page_substitutes = Product.find_product_and_substitutes(product.id)
+        assert page_product == product
+        assert [substitute["id"] for substitute in page_substitutes] == [
+            substitute["id"] for substitute in substitutes]
+    assert nbr_of_substitutes > 0
+
+    print("The nutrient constraints should be resolved by the exact engine")
+    product = products[0]
+    assert Product.find_substitute_products(
+        str(product.id), product.nutriscore_grade, {"fat_100g__lte": 100}
+    ) == Product.find_substitute_products(
+        str(product.id), product.nutriscore_grade, {"fat_100g__lte": 100},
+        engine=SUBSTITUTES_ENGINE_SQL)
+
+    substitute_engine.reset_minhash_index()